@@ -0,0 +1,59 @@
+#! /usr/bin/env python
+"""
+Benchmarks the parser, the writers, the comparer and the replay server on synthetic captures, and saves the
+results as json. With --compare, flags the results that got worse than a previous run.
+"""
+import argparse
+import json
+import os
+import sys
+
+import bmv_utils.benchmark
+
+
+def print_result(name, messages, result):
+    rss = f", peak RSS {result['peak RSS MB']:.0f} MB" if 'peak RSS MB' in result else ''
+    print(f"{name}/{messages}: {result['messages/sec']:,.0f} messages/sec, {result['MB/sec']:.1f} MB/sec, "
+          f"{result['seconds']:.3f} s{rss}")
+    for stage, seconds in result.get('stages', {}).items():
+        print(f'    {stage}: {seconds:.3f} s')
+    if 'latency ms' in result:
+        print('    latency ' + ', '.join(f'{key} {value:.2f} ms' for key, value in result['latency ms'].items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks bmv_utils on synthetic captures of fixed sizes')
+    parser.add_argument('output_filename', metavar='results.json', help='Where to save the results')
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')], default=[100000],
+                        help='Messages of the captures, separated by commas (default: 100000)')
+    parser.add_argument('--benchmarks', type=lambda value: value.split(','),
+                        help='Benchmarks to run, separated by commas (default: all, %s)'
+                             % ','.join(bmv_utils.benchmark.BMV_BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each benchmark, the fastest is kept (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic captures (default: 0)')
+    parser.add_argument('--directory', default='benchmark-data',
+                        help='Where the captures are generated and kept between runs (default: benchmark-data)')
+    parser.add_argument('--compare', metavar='previous.json', help='Results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Worse by more than this fraction is a regression (default: 0.1)')
+    args = parser.parse_args()
+    for name in args.benchmarks or ():
+        if name not in bmv_utils.benchmark.BMV_BENCHMARKS:
+            parser.error(f'unknown benchmark {name}')
+
+    os.makedirs(args.directory, exist_ok=True)
+    results = bmv_utils.benchmark.run_bmv_benchmarks(args.directory, args.sizes, args.benchmarks, args.repeat,
+                                                     args.seed, print_result)
+    with open(args.output_filename, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f'Results saved in {args.output_filename}')
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+        regressions = bmv_utils.benchmark.compare_bmv_benchmarks(previous, results, args.threshold)
+        for benchmark, metric, before, after, change in regressions:
+            print(f'REGRESSION {benchmark} {metric}: {before:,.3f} -> {after:,.3f} ({change:+.1%})')
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare} (commit {previous.get('commit')})")
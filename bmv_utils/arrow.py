@@ -0,0 +1,109 @@
+'''
+Columnar (parquet and arrow) output of the parsed BMV messages.
+
+Messages are written in one table per tipoMensaje, with typed columns built from the layouts in bmv_utils.parse,
+so downstream readers can load only the types and columns they need.
+'''
+import os
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet
+
+from bmv_utils.parse import BMV_LAYOUTS_BY_TIPO, BmvLayout
+
+# Arrow types of the BMV data types, as they come in the parsed messages.
+BMV_ARROW_TYPES = {
+    'alfa': pa.string(),
+    'bandera': pa.bool_(),
+    'int8': pa.int8(),
+    'int16': pa.int16(),
+    'int32': pa.int32(),
+    'int64': pa.int64(),
+    'precio4': pa.float64(),
+    'precio8': pa.float64(),
+    'timestamp1': pa.timestamp('s'),
+    'timestamp2': pa.timestamp('s'),
+}
+
+BMV_ARROW_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+def bmv_arrow_schema(layout: BmvLayout) -> pa.Schema:
+    '''Returns the schema of a table for the messages of a layout, including the fields added per packet'''
+    fields = [pa.field('key', pa.string())]
+    for name, tipo, size in layout.fields:
+        if name is not None:
+            fields.append(pa.field(name, BMV_ARROW_TYPES[tipo]))
+    fields += [pa.field('fechaHora', pa.timestamp('ms')),
+               pa.field('timestamp', pa.timestamp('us')),
+               pa.field('longitud', pa.int16())]
+    return pa.schema(fields)
+
+
+def bmv_arrow_input_schema(schema: pa.Schema) -> pa.Schema:
+    '''Same schema, but with the timestamps as the iso strings of the parsed messages.
+    They are converted to timestamps in bulk, once per batch.'''
+    return pa.schema([pa.field(field.name, pa.string()) if pa.types.is_timestamp(field.type) else field
+                      for field in schema])
+
+
+class BmvArrowWriter:
+    '''Writes the messages in output_dir/<tipoMensaje>/part-<part>.<format>, in batches of batch_size messages'''
+
+    def __init__(self, output_dir: str, output_format: str = 'parquet', part: int = 0,
+                 batch_size: int = 65536, compression: str = 'zstd'):
+        assert output_format in BMV_ARROW_EXTENSIONS, f'Unknown columnar format {output_format}'
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.part = part
+        self.batch_size = batch_size
+        self.compression = compression
+        self.pending = {}  # Messages waiting to be written, by tipoMensaje
+        self.writers = {}  # Open writers, by tipoMensaje
+        self.schemas = {}  # (schema, input_schema), by tipoMensaje
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write_mensaje(self, mensaje: dict) -> None:
+        tipo_mensaje = mensaje['tipoMensaje']
+        pending = self.pending.get(tipo_mensaje)
+        if pending is None:
+            pending = self.pending[tipo_mensaje] = []
+        pending.append(mensaje)
+        if len(pending) >= self.batch_size:
+            self.write_batch(tipo_mensaje)
+
+    def write_batch(self, tipo_mensaje: str) -> None:
+        '''Converts the pending messages of a tipoMensaje into a typed table and writes it'''
+        pending = self.pending.get(tipo_mensaje)
+        if not pending:
+            return
+        if tipo_mensaje not in self.schemas:
+            schema = bmv_arrow_schema(BMV_LAYOUTS_BY_TIPO[tipo_mensaje])
+            self.schemas[tipo_mensaje] = (schema, bmv_arrow_input_schema(schema))
+        schema, input_schema = self.schemas[tipo_mensaje]
+        table = pa.Table.from_pylist(pending, schema=input_schema).cast(schema)
+        writer = self.writers.get(tipo_mensaje)
+        if writer is None:
+            writer = self.writers[tipo_mensaje] = self.open_table(tipo_mensaje, schema)
+        writer.write_table(table)
+        pending.clear()
+
+    def open_table(self, tipo_mensaje: str, schema: pa.Schema):
+        table_dir = os.path.join(self.output_dir, tipo_mensaje)
+        os.makedirs(table_dir, exist_ok=True)
+        filename = os.path.join(table_dir, f'part-{self.part:05d}.{BMV_ARROW_EXTENSIONS[self.output_format]}')
+        if self.output_format == 'parquet':
+            return pa.parquet.ParquetWriter(filename, schema, compression=self.compression)
+        options = pa.ipc.IpcWriteOptions(compression=self.compression)
+        return pa.ipc.new_file(filename, schema, options=options)
+
+    def flush(self) -> None:
+        for tipo_mensaje in self.pending:
+            self.write_batch(tipo_mensaje)
+
+    def close(self) -> None:
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
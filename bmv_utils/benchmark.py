@@ -0,0 +1,274 @@
+'''
+Benchmarks of the parser, the writers, the comparer and the replay server, over synthetic captures.
+
+Each benchmark runs in a fresh process, so its peak RSS is its own, and returns the messages and bytes it went
+through, the seconds it took and the seconds of each of its stages. Results are saved as json to compare runs.
+'''
+import contextlib
+import io
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from bmv_utils.output import open_bmv_writer
+from bmv_utils.parse import (BMV_LONGITUD_STRUCT, BMV_PARSERS, BMV_TIPO_MENSAJE_SIZES, HEADER_SIZE,
+                             parse_bmv_pcap_file, parse_bmv_udp_packet)
+from bmv_utils.pcap import iter_pcap_udp_payloads
+from bmv_utils.synthetic import BmvSyntheticGenerator, write_bmv_pcap
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not in Windows, there is no peak RSS there
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmarks by name, see bmv_benchmark.
+BMV_BENCHMARKS = {}
+# Results that can be compared between runs, and if higher is better.
+BMV_BENCHMARK_METRICS = {'messages/sec': True, 'MB/sec': True, 'seconds': False, 'peak RSS MB': False}
+
+
+def bmv_benchmark(name: str):
+    '''Registers a benchmark. It is called with the capture and a working directory and returns a dictionary with
+    messages, bytes and seconds, plus stages (seconds by stage) and anything else worth saving'''
+    def register(function):
+        BMV_BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def make_bmv_benchmark_capture(directory: str, messages: int, seed: int = 0) -> str:
+    '''Generates (once) a synthetic capture with messages grupo 18 messages. Returns its file name'''
+    pcap_filename = os.path.join(directory, f'synthetic-{messages}-{seed}.pcap')
+    if not os.path.exists(pcap_filename):
+        generator = BmvSyntheticGenerator(seed)
+        destinations = {18: ('239.200.100.18', 12141), 40: ('239.200.100.40', 12141)}
+        with open(pcap_filename + '.tmp', 'wb') as output_file:
+            write_bmv_pcap(output_file, generator.iter_packets(messages), destinations)
+        os.replace(pcap_filename + '.tmp', pcap_filename)
+    return pcap_filename
+
+
+def load_payloads(pcap_filename: str) -> list:
+    '''UDP payloads of a capture, as bytes in memory'''
+    with open(pcap_filename, 'rb') as input_file:
+        return [bytes(payload) for timestamp, payload in iter_pcap_udp_payloads(input_file)]
+
+
+@bmv_benchmark('parse_bmv_udp_packet')
+def benchmark_parse_bmv_udp_packet(pcap_filename: str, directory: str) -> dict:
+    payloads = load_payloads(pcap_filename)
+    messages = 0
+    start = time.perf_counter()
+    for payload in payloads:
+        messages += len(parse_bmv_udp_packet(payload)['mensajes'])
+    seconds = time.perf_counter() - start
+    return {'messages': messages, 'bytes': sum(len(payload) for payload in payloads), 'seconds': seconds}
+
+
+@bmv_benchmark('decoders')
+def benchmark_decoders(pcap_filename: str, directory: str) -> dict:
+    '''Each parser of BMV_PARSERS over all the messages of its tipoMensaje'''
+    by_tipo = {}
+    for payload in load_payloads(pcap_filename):
+        grupo_market_data = payload[3]
+        tipo_size = BMV_TIPO_MENSAJE_SIZES[grupo_market_data]
+        start = HEADER_SIZE
+        while start < len(payload):
+            longitud = BMV_LONGITUD_STRUCT.unpack_from(payload, start)[0]
+            raw = payload[start + 2:start + 2 + longitud]
+            by_tipo.setdefault((grupo_market_data, raw[:tipo_size]), []).append(raw)
+            start += longitud + 2
+    result = {'messages': 0, 'bytes': 0, 'seconds': 0.0, 'stages': {}, 'messages/sec by tipo': {}}
+    for (grupo_market_data, tipo_mensaje), raws in sorted(by_tipo.items()):
+        parser = BMV_PARSERS[grupo_market_data][tipo_mensaje]
+        start = time.perf_counter()
+        for raw in raws:
+            parser(raw)
+        seconds = time.perf_counter() - start
+        name = tipo_mensaje.decode('iso-8859-1')
+        result['stages'][name] = seconds
+        result['messages/sec by tipo'][name] = len(raws) / seconds if seconds else 0.0
+        result['messages'] += len(raws)
+        result['bytes'] += sum(len(raw) for raw in raws)
+        result['seconds'] += seconds
+    return result
+
+
+@bmv_benchmark('parse_bmv_pcap_file')
+def benchmark_parse_bmv_pcap_file(pcap_filename: str, directory: str) -> dict:
+    '''End to end, capture to json lines, with the time of reading the capture and of parsing it on their own'''
+    stages = {}
+    start = time.perf_counter()
+    messages = size = 0
+    with open(pcap_filename, 'rb') as input_file:
+        for timestamp, payload in iter_pcap_udp_payloads(input_file):
+            messages += payload[2]  # total_mensajes of the header
+            size += len(payload)
+    stages['read'] = time.perf_counter() - start
+    start = time.perf_counter()
+    with open(pcap_filename, 'rb') as input_file:
+        for timestamp, payload in iter_pcap_udp_payloads(input_file):
+            parse_bmv_udp_packet(payload)
+    stages['read and parse'] = time.perf_counter() - start
+    output_filename = os.path.join(directory, 'benchmark.json')
+    start = time.perf_counter()
+    with open(pcap_filename, 'rb') as input_file, contextlib.redirect_stdout(io.StringIO()):
+        writer = open_bmv_writer(output_filename)
+        parse_bmv_pcap_file(input_file, writer)
+        writer.close()
+    seconds = time.perf_counter() - start
+    stages['write'] = seconds - stages['read and parse']
+    os.remove(output_filename)
+    return {'messages': messages, 'bytes': size, 'seconds': seconds, 'stages': stages}
+
+
+@bmv_benchmark('compare_bmv_producto_jsons')
+def benchmark_compare_bmv_producto_jsons(pcap_filename: str, directory: str) -> dict:
+    '''Compares the json lines of the capture with themselves'''
+    sys.path.insert(0, REPO_DIRECTORY)
+    from compare_bmv_jsons import compare_bmv_producto_jsons
+    json_filename = os.path.join(directory, 'benchmark-compare.json')
+    with open(pcap_filename, 'rb') as input_file, contextlib.redirect_stdout(io.StringIO()):
+        writer = open_bmv_writer(json_filename)
+        counter_msgs = parse_bmv_pcap_file(input_file, writer)
+        writer.close()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        is_equal = compare_bmv_producto_jsons(json_filename, json_filename)
+    seconds = time.perf_counter() - start
+    size = os.path.getsize(json_filename) * 2
+    os.remove(json_filename)
+    assert is_equal, 'A file must be equal to itself'
+    return {'messages': sum(counter['total'] for counter in counter_msgs.values()), 'bytes': size, 'seconds': seconds}
+
+
+def free_port() -> int:
+    with socket.socket() as listener:
+        listener.bind(('localhost', 0))
+        return listener.getsockname()[1]
+
+
+def request_replay(port: int, first_message: int, quantity: int, grupo_market_data: int = 18) -> int:
+    '''Does a login and a replay request to the replay server, and reads until it closes. Returns the bytes read'''
+    with socket.create_connection(('localhost', port)) as connection:
+        connection.sendall(bytes((19, 33, grupo_market_data)) + b'INFS01' + b'1234567890')
+        connection.sendall(bytes((9, 35, grupo_market_data)) + first_message.to_bytes(4, 'big')
+                           + quantity.to_bytes(2, 'big'))
+        received = 0
+        while True:
+            data = connection.recv(1 << 16)
+            if not data:
+                return received
+            received += len(data)
+
+
+@bmv_benchmark('replay-server')
+def benchmark_replay_server(pcap_filename: str, directory: str, requests: int = 200, quantity: int = 1000) -> dict:
+    '''Latency of replay requests of quantity messages to replay-server.py serving the capture, one after another'''
+    with open(pcap_filename, 'rb') as input_file:
+        # Requests go over the grupo 18 messages of the capture, and start again from the first when they end.
+        available = sum(payload[2] for timestamp, payload in iter_pcap_udp_payloads(input_file) if payload[3] == 18)
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(REPO_DIRECTORY, 'replay-server.py'), pcap_filename,
+                               '--port', str(port), '--max-quantity', str(quantity), '--rate-limit', str(requests * 2)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Waits until the server loaded the capture and listens.
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                socket.create_connection(('localhost', port)).close()
+                break
+            except ConnectionRefusedError:
+                assert server.poll() is None and time.monotonic() < deadline, 'replay-server.py did not start'
+                time.sleep(0.05)
+        latencies = []
+        size = 0
+        start = time.perf_counter()
+        for number in range(requests):
+            request_start = time.perf_counter()
+            size += request_replay(port, 1 + number * quantity % max(available - quantity, 1), quantity)
+            latencies.append(time.perf_counter() - request_start)
+        seconds = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    latencies.sort()
+    return {'messages': requests * quantity, 'bytes': size, 'seconds': seconds,
+            'latency ms': {'p50': latencies[len(latencies) // 2] * 1000,
+                           'p99': latencies[min(len(latencies) * 99 // 100, len(latencies) - 1)] * 1000,
+                           'max': latencies[-1] * 1000}}
+
+
+def run_bmv_benchmark_process(name: str, pcap_filename: str, directory: str) -> dict:
+    '''Runs a benchmark and adds its rates and the peak RSS of the process'''
+    result = BMV_BENCHMARKS[name](pcap_filename, directory)
+    seconds = result['seconds']
+    result['messages/sec'] = result['messages'] / seconds if seconds else 0.0
+    result['MB/sec'] = result['bytes'] / 1000000 / seconds if seconds else 0.0
+    if resource is not None:
+        # ru_maxrss is in kilobytes in Linux, and in bytes in macOS.
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['peak RSS MB'] = maxrss / (1000000 if sys.platform == 'darwin' else 1000)
+    return result
+
+
+def run_bmv_benchmark(name: str, pcap_filename: str, directory: str, repeat: int = 1) -> dict:
+    '''Runs a benchmark repeat times, each in a new process, and keeps the fastest run'''
+    best = None
+    for _ in range(repeat):
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(run_bmv_benchmark_process, name, pcap_filename, directory).result()
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIRECTORY, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_bmv_benchmarks(directory: str, sizes=(100000,), names=None, repeat: int = 1, seed: int = 0,
+                       progress=None) -> dict:
+    '''Runs the benchmarks (all of them by default) on synthetic captures of each size in messages.
+    progress, if given, is called with (name, messages, result) after each benchmark'''
+    results = {'created': datetime.now().isoformat(), 'commit': git_commit(), 'python': platform.python_version(),
+               'platform': platform.platform(), 'seed': seed, 'benchmarks': {}}
+    for messages in sizes:
+        pcap_filename = make_bmv_benchmark_capture(directory, messages, seed)
+        for name in names or BMV_BENCHMARKS:
+            result = run_bmv_benchmark(name, pcap_filename, directory, repeat)
+            results['benchmarks'][f'{name}/{messages}'] = result
+            if progress is not None:
+                progress(name, messages, result)
+    return results
+
+
+def compare_bmv_benchmarks(previous: dict, current: dict, threshold: float = 0.1) -> list:
+    '''Compares two results of run_bmv_benchmarks.
+    Returns (benchmark, metric, previous, current, change) for the metrics that got worse by more than threshold'''
+    regressions = []
+    for benchmark, result in current['benchmarks'].items():
+        if benchmark not in previous['benchmarks']:
+            continue
+        for metric, higher_is_better in BMV_BENCHMARK_METRICS.items():
+            before = previous['benchmarks'][benchmark].get(metric)
+            after = result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append((benchmark, metric, before, after, change))
+    return regressions
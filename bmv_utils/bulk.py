@@ -0,0 +1,153 @@
+'''
+Bulk (columnar) decoding of BMV captures into numpy structured arrays.
+
+Instead of building a dictionary per message, a whole capture is scanned once to gather the bytes of the
+messages of each tipoMensaje, and then each tipoMensaje is decoded at once with numpy, using a big-endian dtype
+that mirrors its layout in bmv_utils.parse.
+'''
+import struct
+from array import array
+from io import BufferedReader
+
+import numpy as np
+
+from bmv_utils.parse import (BMV_HEADER_STRUCT, BMV_INT16_FORMAT, BMV_LAYOUTS, BMV_TIPO_MENSAJE_SIZES, HEADER_SIZE,
+                             BmvLayout)
+from bmv_utils.pcap import iter_pcap_udp_payloads
+
+# numpy equivalents of the BMV data types. All of them are big-endian, as in the wire.
+BMV_NUMPY_FORMATS = {
+    'int8': '>i1',
+    'int16': '>i2',
+    'int32': '>i4',
+    'int64': '>i8',
+    'precio4': '>i4',
+    'precio8': '>i8',
+    'timestamp1': '>i8',
+    'timestamp2': '>i8',
+}
+
+# Same scale used by the conversions in bmv_utils.parse.
+BMV_PRECIO_SCALES = {'precio4': 1000.0, 'precio8': 100000000.0}
+
+
+def bmv_layout_dtype(layout: BmvLayout) -> np.dtype:
+    '''Returns a big-endian structured dtype that mirrors the layout as it comes in the wire. Fillers are skipped.'''
+    names, formats, offsets = [], [], []
+    offset = 0
+    for name, tipo, size in layout.fields:
+        if name is not None:
+            names.append(name)
+            formats.append(BMV_NUMPY_FORMATS.get(tipo, f'S{size}'))
+            offsets.append(offset)
+        offset += size
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': layout.length})
+
+
+def bmv_decoded_dtype(layout: BmvLayout) -> np.dtype:
+    '''Returns the dtype of the decoded columns: precios as floats, timestamps as datetime64 and banderas as bool.
+    Every row also gets the secuencia of the message and the fechaHora of its packet.'''
+    fields = [('secuencia', 'i8'), ('fechaHora', 'datetime64[ms]')]
+    for name, tipo, size in layout.fields:
+        if name is None:
+            continue
+        if tipo in BMV_PRECIO_SCALES:
+            fields.append((name, 'f8'))
+        elif tipo in ('timestamp1', 'timestamp2'):
+            fields.append((name, 'datetime64[s]'))
+        elif tipo == 'bandera':
+            fields.append((name, '?'))
+        elif tipo in BMV_NUMPY_FORMATS:
+            fields.append((name, BMV_NUMPY_FORMATS[tipo][1:]))
+        else:
+            fields.append((name, f'S{size}'))
+    return np.dtype(fields)
+
+
+# Longitud and tipoMensaje at the start of every message, by grupo_market_data, read with a single unpack.
+BMV_MESSAGE_START_STRUCTS = {grupo_market_data: struct.Struct(f'{BMV_INT16_FORMAT}{tipo_size}s')
+                             for grupo_market_data, tipo_size in BMV_TIPO_MENSAJE_SIZES.items()}
+
+
+def scan_bmv_pcap_messages(input_file: BufferedReader):
+    '''Walks all the udp packets of a pcap file, mapped in memory, and copies the bytes of each message to the
+    buffer of its tipoMensaje. All the messages of a tipoMensaje have the same length, so its buffer is an array of
+    them, one after the other.
+    Returns:
+        positions: dictionary by tipoMensaje of (buffer, secuencias, fechas_hora).
+    '''
+    positions = {}
+    # Layouts by grupo_market_data and raw tipoMensaje, as it comes in the wire (with its spaces).
+    raw_layouts = {
+        grupo_market_data: {tipo_mensaje.ljust(BMV_TIPO_MENSAJE_SIZES[grupo_market_data]).encode('iso-8859-1'): layout
+                            for tipo_mensaje, layout in layouts.items()}
+        for grupo_market_data, layouts in BMV_LAYOUTS.items()}
+    for timestamp, packet_data in iter_pcap_udp_payloads(input_file):
+        try:
+            longitud, total_mensajes, grupo_market_data, sesion, secuencia, fecha_hora = \
+                BMV_HEADER_STRUCT.unpack_from(packet_data)
+            assert longitud == len(packet_data), f'Longitud {longitud} must be equal to the packet size {len(packet_data)})'
+            layouts = raw_layouts[grupo_market_data]
+            message_start = BMV_MESSAGE_START_STRUCTS[grupo_market_data]
+        except Exception as e:
+            # Same as parse_bmv_pcap_file, we skip what we can not understand and continue.
+            print(e)
+            continue
+        start = HEADER_SIZE
+        for i in range(total_mensajes):
+            if start + message_start.size > longitud:
+                break  # Incomplete packet
+            longitud_msg, raw_tipo = message_start.unpack_from(packet_data, start)
+            layout = layouts.get(raw_tipo)
+            end = start + 2 + longitud_msg
+            if layout is not None and layout.length == longitud_msg and end <= longitud:
+                tipo_positions = positions.get(layout.tipo_mensaje)
+                if tipo_positions is None:
+                    tipo_positions = positions[layout.tipo_mensaje] = (bytearray(), array('q'), array('q'))
+                buffer, secuencias, fechas_hora = tipo_positions
+                # Slices of the mapped payload, only the message bytes are copied.
+                buffer += packet_data[start + 2:end]
+                secuencias.append(secuencia + i)
+                fechas_hora.append(fecha_hora)
+            start = end
+    return positions
+
+
+def decode_bmv_messages_bulk(buffer, layout: BmvLayout, secuencias, fechas_hora) -> np.ndarray:
+    '''Decodes all the messages of the same layout, that come one after the other in buffer, in one go.'''
+    raw = np.frombuffer(buffer, dtype=bmv_layout_dtype(layout))
+    decoded = np.empty(len(raw), dtype=bmv_decoded_dtype(layout))
+    decoded['secuencia'] = np.frombuffer(secuencias, dtype=np.int64)
+    decoded['fechaHora'] = np.frombuffer(fechas_hora, dtype=np.int64).astype('datetime64[ms]')
+    for name, tipo, size in layout.fields:
+        if name is None:
+            continue
+        column = raw[name]
+        if tipo in BMV_PRECIO_SCALES:
+            decoded[name] = column / BMV_PRECIO_SCALES[tipo]
+        elif tipo in ('timestamp1', 'timestamp2'):
+            # Same as the dictionaries, we drop the milliseconds.
+            decoded[name] = (column // 1000).astype('datetime64[s]')
+        elif tipo == 'bandera':
+            decoded[name] = column == b'1'
+        elif tipo == 'alfa':
+            # ALFA fields are filled on the right with spaces.
+            decoded[name] = np.char.rstrip(column)
+        else:
+            decoded[name] = column
+    return decoded
+
+
+def parse_bmv_pcap_file_bulk(input_file: BufferedReader) -> dict:
+    '''Decodes a complete pcap file from BMV 'producto 18' or 'producto 40' into columns.
+    Returns:
+        A dictionary by tipoMensaje with a numpy structured array of all the messages of that type.
+    Notes:
+        Timestamps are kept as UTC datetime64 values, and the catalog assertions are not applied.
+    '''
+    positions = scan_bmv_pcap_messages(input_file)
+    tablas = {}
+    for tipo_mensaje, (buffer, secuencias, fechas_hora) in positions.items():
+        layout = BMV_LAYOUTS[18].get(tipo_mensaje) or BMV_LAYOUTS[40][tipo_mensaje]
+        tablas[tipo_mensaje] = decode_bmv_messages_bulk(buffer, layout, secuencias, fechas_hora)
+    return tablas
@@ -2,285 +2,436 @@
 Utilities to compare all kinds of BMV messages and catalogs in json format.
 '''
 
+import os
+import re
 import sys
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
 import dateutil.parser
 import json
 
+from bmv_utils.parse import BMV_LAYOUTS_BY_TIPO, BMV_MESSAGE_FIELDS, BMV_TIPO_MENSAJE_SIZES, BmvLayout
 
-def assert_eq_json_field(expected_json: dict, actual_json: dict, field: str) -> None:
-    assert expected_json[field] == actual_json[field], f"key {expected_json['key']}: {field} {expected_json[field]} != {actual_json[field]}"
 
+#
+# The fields to compare come from the same layouts the parsers decode with (bmv_utils.parse.BMV_LAYOUTS_BY_TIPO),
+# plus the fields every message gets from its packet. They are compiled once per tipoMensaje into a tuple of
+# (field, equal) where equal is None for a plain ==, or the function that decides if two different values are
+# still the same: prices within a tolerance, or dates written in other ways.
+#
 
-def compare_bmv_mensaje_M(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'tipoMensaje')
-    assert_eq_json_field(expected, actual, 'precioPromedioPonderado')
-    assert_eq_json_field(expected, actual, 'volatilidad')
-    return True
+# Fields not compared by default, the time the message was parsed is never the same.
+BMV_COMPARE_IGNORE = ('timestamp',)
+BMV_PRICE_TIPOS = frozenset(('precio4', 'precio8'))
+BMV_DATETIME_TIPOS = frozenset(('timestamp1', 'timestamp2', 'timestamp3', 'timestamp'))
 
 
-def compare_bmv_mensaje_H(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'tipoMensaje')
-    assert_eq_json_field(expected, actual, 'folioHecho')
-    return True
-   
-    
-def compare_bmv_mensaje_O(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'volumen')
-    assert_eq_json_field(expected, actual, 'precio')
-    assert_eq_json_field(expected, actual, 'sentido')
-    assert_eq_json_field(expected, actual, 'tipo')
-    return True
-   
-    
-def compare_bmv_mensaje_E(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'numeroOperaciones')
-    assert_eq_json_field(expected, actual, 'volumen')
-    assert_eq_json_field(expected, actual, 'importe')
-    assert_eq_json_field(expected, actual, 'apertura')
-    assert_eq_json_field(expected, actual, 'maximo')
-    assert_eq_json_field(expected, actual, 'minimo')
-    assert_eq_json_field(expected, actual, 'promedio')
-    assert_eq_json_field(expected, actual, 'last')
-    return True
-
+def equal_bmv_prices(tolerance: float, expected, actual) -> bool:
+    try:
+        return abs(expected - actual) <= tolerance
+    except TypeError:
+        return False
 
-def compare_bmv_mensaje_P(expected: dict, actual: dict) -> bool:
-    '''Compare two p messages, one is the expected output, the other is the actual output.'''
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'fechaHora')
-    assert_eq_json_field(expected, actual, 'tipoMensaje')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert dateutil.parser.isoparse(expected['horaHecho']) == dateutil.parser.isoparse(actual['horaHecho']), f"key {key}: horaHecho {expected['horaHecho']} != {actual['horaHecho']}"
-    assert_eq_json_field(expected, actual, 'volumen')
-    assert_eq_json_field(expected, actual, 'precio')
-    assert_eq_json_field(expected, actual, 'tipoConcertacion')
-    assert_eq_json_field(expected, actual, 'folioHecho')
-    assert_eq_json_field(expected, actual, 'fijaPrecio')
-    assert_eq_json_field(expected, actual, 'tipoOperacion')
-    assert_eq_json_field(expected, actual, 'importe')
-    assert_eq_json_field(expected, actual, 'compra')
-    assert_eq_json_field(expected, actual, 'vende')
-    assert_eq_json_field(expected, actual, 'liquidacion')
-    assert_eq_json_field(expected, actual, 'indicadorSubasta')
-    return True
-    
-
-def compare_bmv_catalogo_ca(expected: dict, actual: dict) -> bool:
-    '''Compare two ca messages, one is the expected output, the other is the actual output.'''
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'tipoValor')
-    assert_eq_json_field(expected, actual, 'emisora')
-    assert_eq_json_field(expected, actual, 'serie')
-    assert_eq_json_field(expected, actual, 'ultimoPrecio')
-    assert_eq_json_field(expected, actual, 'PPP')
-    assert_eq_json_field(expected, actual, 'precioCierre')
-    assert dateutil.parser.isoparse(expected['fechaReferencia']) == dateutil.parser.isoparse(actual['fechaReferencia']), f"key {key}: fechaReferencia {expected['tipoMensaje']} != {actual['tipoMensaje']}"
-    assert_eq_json_field(expected, actual, 'referencia')
-    assert_eq_json_field(expected, actual, 'cuponVigente')
-    assert_eq_json_field(expected, actual, 'bursatilidad')
-    assert_eq_json_field(expected, actual, 'bursatilidadNumerica')
-    assert_eq_json_field(expected, actual, 'ISIN')
-    assert_eq_json_field(expected, actual, 'mercado')
-    assert_eq_json_field(expected, actual, 'valoresInscritos')
-    assert_eq_json_field(expected, actual, 'importeBloques')
-    assert_eq_json_field(expected, actual, 'bolsaOrigen')
-    return True
-    
-
-def compare_bmv_catalogo_ce(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'numeroTrac')
-    assert_eq_json_field(expected, actual, 'nombreTrac')
-    assert_eq_json_field(expected, actual, 'emisoraSubyascente')
-    assert_eq_json_field(expected, actual, 'serieSubyacente')
-    assert_eq_json_field(expected, actual, 'titulos')
-    assert_eq_json_field(expected, actual, 'titulosExcluidos')
-    assert_eq_json_field(expected, actual, 'precio')
-    assert_eq_json_field(expected, actual, 'componenteEfectivo')
-    assert_eq_json_field(expected, actual, 'valorExcluido')
-    assert_eq_json_field(expected, actual, 'numeroCertificados')
-    assert_eq_json_field(expected, actual, 'precioTeorico')
-    return True
 
+def equal_bmv_datetimes(expected, actual) -> bool:
+    try:
+        return dateutil.parser.isoparse(expected) == dateutil.parser.isoparse(actual)
+    except (TypeError, ValueError):
+        return False
 
-def compare_bmv_catalogo_cf(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'tipoMensaje')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'tipoValor')
-    assert_eq_json_field(expected, actual, 'emisora')
-    assert_eq_json_field(expected, actual, 'serie')
-    assert_eq_json_field(expected, actual, 'sector')
-    assert_eq_json_field(expected, actual, 'subsector')
-    assert_eq_json_field(expected, actual, 'ramo')
-    assert_eq_json_field(expected, actual, 'subramo')
-    assert_eq_json_field(expected, actual, 'operadora')
-    assert_eq_json_field(expected, actual, 'precioReferencia')
-    assert_eq_json_field(expected, actual, 'fechaReferencia')
-    assert_eq_json_field(expected, actual, 'referencia')
-    assert_eq_json_field(expected, actual, 'ISIN')
-    assert_eq_json_field(expected, actual, 'calificacion')
-    return True
 
+def compile_bmv_field_comparers(layout: BmvLayout, tolerances: dict = None, ignore=BMV_COMPARE_IGNORE) -> tuple:
+    '''Compiles the (field, equal) pairs to compare the messages of a layout.
+    tolerances gives the absolute tolerance of the prices, by field name or by layout tipo ('precio4', 'precio8').
+    Fields in ignore are not compared.'''
+    tolerances = tolerances or {}
+    comparers = []
+    for name, tipo, *size in (*BMV_MESSAGE_FIELDS[:1], *layout.fields, *BMV_MESSAGE_FIELDS[1:]):
+        if name is None or name in ignore:
+            continue
+        equal = None
+        if tipo in BMV_PRICE_TIPOS:
+            tolerance = tolerances.get(name, tolerances.get(tipo, 0.0))
+            if tolerance:
+                equal = partial(equal_bmv_prices, tolerance)
+        elif tipo in BMV_DATETIME_TIPOS:
+            equal = equal_bmv_datetimes
+        comparers.append((name, equal))
+    return tuple(comparers)
 
-def compare_bmv_catalogo_cc(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'tipoMensaje')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'tipoValor')
-    assert_eq_json_field(expected, actual, 'emisora')
-    assert_eq_json_field(expected, actual, 'serie')
-    assert_eq_json_field(expected, actual, 'tipoWarrant')
-    assert_eq_json_field(expected, actual, 'fechaVencimiento')
-    assert_eq_json_field(expected, actual, 'precioEjercicio')
-    assert_eq_json_field(expected, actual, 'precioReferencia')
-    assert_eq_json_field(expected, actual, 'fechaReferencia')
-    assert_eq_json_field(expected, actual, 'referencia')
-    assert_eq_json_field(expected, actual, 'ISIN')
-    assert_eq_json_field(expected, actual, 'bolsaOrigen')
-    return True
 
+def compile_bmv_comparers(tolerances: dict = None, ignore=BMV_COMPARE_IGNORE) -> dict:
+    '''The field comparers of every known tipoMensaje, see compile_bmv_field_comparers'''
+    return {tipo_mensaje: compile_bmv_field_comparers(layout, tolerances, ignore)
+            for tipo_mensaje, layout in BMV_LAYOUTS_BY_TIPO.items()}
 
-def compare_bmv_catalogo_cb(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'tipoMensaje')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'tipoValor')
-    assert_eq_json_field(expected, actual, 'emisora')
-    assert_eq_json_field(expected, actual, 'emision')
-    assert_eq_json_field(expected, actual, 'fechaEmision')
-    assert_eq_json_field(expected, actual, 'fechaVencimiento')
-    assert_eq_json_field(expected, actual, 'precioOtasaReferencia')
-    assert_eq_json_field(expected, actual, 'fechaReferencia')
-    assert_eq_json_field(expected, actual, 'referencia')
-    assert_eq_json_field(expected, actual, 'diasPlazo')
-    assert_eq_json_field(expected, actual, 'cuponOperiodo')
-    assert_eq_json_field(expected, actual, 'ISIN')
-    assert_eq_json_field(expected, actual, 'mercado')
-    assert_eq_json_field(expected, actual, 'valorNominalActual')
-    assert_eq_json_field(expected, actual, 'valorNominalOriginal')
-    assert_eq_json_field(expected, actual, 'accionesEnCirculacion')
-    assert_eq_json_field(expected, actual, 'montoColocado')
-    assert_eq_json_field(expected, actual, 'operaTasaPrecio')
-    assert_eq_json_field(expected, actual, 'bolsaOrigen')
-    return True
 
+BMV_COMPARERS = compile_bmv_comparers()
 
-def compare_bmv_catalogo_cy(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'tipoMensaje')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'emisora')
-    assert_eq_json_field(expected, actual, 'serie')
-    assert_eq_json_field(expected, actual, 'tipoValor')
-    assert_eq_json_field(expected, actual, 'emisoraSubyacente')
-    assert_eq_json_field(expected, actual, 'serieSubyacente')
-    assert_eq_json_field(expected, actual, 'tipoValorSubyacente')
-    assert_eq_json_field(expected, actual, 'numeroValoresInscritos')
-    assert_eq_json_field(expected, actual, 'bolsaOrigen')
-    return True
-        
-    
-def compare_bmv_catalogo_cd(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'tipoMensaje')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'tipoValor')
-    assert_eq_json_field(expected, actual, 'clase')
-    assert_eq_json_field(expected, actual, 'vencimiento')
-    assert_eq_json_field(expected, actual, 'tipoOpcion')
-    assert_eq_json_field(expected, actual, 'precioEjercicio')
-    assert_eq_json_field(expected, actual, 'puja')
-    assert_eq_json_field(expected, actual, 'precioLiquidacionDiaAnterior')
-    assert_eq_json_field(expected, actual, 'ultimaFechaOperacion')
-    assert_eq_json_field(expected, actual, 'fechaVencimiento')
-    assert_eq_json_field(expected, actual, 'contratosAbiertos')
-    assert_eq_json_field(expected, actual, 'tamanoContrato')
-    assert_eq_json_field(expected, actual, 'codigoProducto')
-    assert_eq_json_field(expected, actual, 'vencimientoDiario')
-    assert_eq_json_field(expected, actual, 'clavePrecioEjercicio')
-    assert_eq_json_field(expected, actual, 'codigoCFI')
-    return True
 
+def diff_bmv_message_json(expected_json: dict, actual_json: dict, comparers: dict = None) -> list:
+    '''Returns the (field, expected value, actual value) of every field that differs, an empty list if they are equal.
+    comparers are the ones of compile_bmv_comparers, with exact prices and without 'timestamp' by default.'''
+    tipo_mensaje = expected_json.get('tipoMensaje')
+    if tipo_mensaje != actual_json.get('tipoMensaje'):
+        return [('tipoMensaje', tipo_mensaje, actual_json.get('tipoMensaje'))]
+    field_comparers = (comparers or BMV_COMPARERS).get(tipo_mensaje)
+    if field_comparers is None:
+        return [('tipoMensaje', tipo_mensaje, f'Unknown message type: {tipo_mensaje}')]
+    differences = []
+    for field, equal in field_comparers:
+        expected_value = expected_json.get(field)
+        actual_value = actual_json.get(field)
+        if expected_value == actual_value:
+            continue
+        if equal is not None and equal(expected_value, actual_value):
+            continue
+        differences.append((field, expected_value, actual_value))
+    return differences
 
-def compare_bmv_catalogo_cg(expected: dict, actual: dict) -> bool:
-    key = actual['key']
-    assert_eq_json_field(expected, actual, 'key')
-    assert_eq_json_field(expected, actual, 'tipoMensaje')
-    assert_eq_json_field(expected, actual, 'numeroInstrumento')
-    assert_eq_json_field(expected, actual, 'tipoValor')
-    assert_eq_json_field(expected, actual, 'clase')
-    assert_eq_json_field(expected, actual, 'vencimiento')
-    assert_eq_json_field(expected, actual, 'tipoEstrategia')
-    assert_eq_json_field(expected, actual, 'puja')
-    assert_eq_json_field(expected, actual, 'ultimaFechaOperacion')
-    assert_eq_json_field(expected, actual, 'fechaVencimiento')
-    assert_eq_json_field(expected, actual, 'identificadorPataCorta')
-    assert_eq_json_field(expected, actual, 'identificadorPataLarga')
-    assert_eq_json_field(expected, actual, 'periodicidad')
-    assert_eq_json_field(expected, actual, 'numeroVencimientos')
-    return True
 
 #
 # Binding together all the pieces above.
 #
 
-def compare_bmv_message_json(expected_json, actual_json) -> bool:
-    is_equal = True
+def compare_bmv_message_json(expected_json, actual_json, comparers: dict = None) -> bool:
+    '''Compares two messages, raising an AssertionError that describes their differences if they are not equal'''
     # Key is important because is the way to identfy the message received from BMV
     assert 'key' in actual_json, f"'key' not in {actual_json}"
     # tipoMensaje is important because is the way we can identify the type of message received from BMV and its fields.
     assert 'tipoMensaje' in actual_json, f"'tipoMensaje' not in {actual_json}"
-    match  expected_json['tipoMensaje']:
-        case 'M':
-            is_equal = compare_bmv_mensaje_M(expected_json, actual_json) and is_equal
-        case 'H':
-            is_equal = compare_bmv_mensaje_H(expected_json, actual_json) and is_equal
-        case 'O':
-            is_equal = compare_bmv_mensaje_O(expected_json, actual_json) and is_equal
-        case 'E':
-            is_equal = compare_bmv_mensaje_E(expected_json, actual_json) and is_equal
-        case 'P':
-            is_equal = compare_bmv_mensaje_P(expected_json, actual_json) and is_equal
-        case 'ca':
-            is_equal = compare_bmv_catalogo_ca(expected_json, actual_json) and is_equal
-        case 'ce':
-            is_equal = compare_bmv_catalogo_ce(expected_json, actual_json) and is_equal
-        case 'cf':
-            is_equal = compare_bmv_catalogo_cf(expected_json, actual_json) and is_equal
-        case 'cc':
-            is_equal = compare_bmv_catalogo_cc(expected_json, actual_json) and is_equal
-        case 'cb':
-            is_equal = compare_bmv_catalogo_cb(expected_json, actual_json) and is_equal
-        case 'cy':
-            is_equal = compare_bmv_catalogo_cy(expected_json, actual_json) and is_equal
-        case 'cd':
-            is_equal = compare_bmv_catalogo_cd(expected_json, actual_json) and is_equal
-        case 'cg':
-            is_equal = compare_bmv_catalogo_cg(expected_json, actual_json) and is_equal
-        case _:
-            print(f"{expected_json['key']}: Unknown message type: {expected_json['tipoMensaje']}")
-            is_equal = False
-    return is_equal
- 
\ No newline at end of file
+    differences = diff_bmv_message_json(expected_json, actual_json, comparers)
+    assert not differences, f"key {expected_json.get('key')}: " + ', '.join(
+        f'{field} {expected_value} != {actual_value}' for field, expected_value, actual_value in differences)
+    return True
+
+
+#
+# Joining two json lines files by key, so a missing or reordered message is reported once
+# instead of shifting every line after it.
+#
+
+# The key and tipoMensaje as written by the json encoders, with or without spaces.
+BMV_KEY_PATTERN = re.compile(r'"key":\s*"([^"]*)"')
+BMV_TIPO_MENSAJE_PATTERN = re.compile(r'"tipoMensaje":\s*"([^"]*)"')
+# The json lines don't have the grupo_market_data, but the size of the tipoMensaje tells it.
+BMV_GRUPOS_BY_TIPO_MENSAJE_SIZE = {size: grupo_market_data for grupo_market_data, size in BMV_TIPO_MENSAJE_SIZES.items()}
+BMV_JOINS = ('auto', 'merge', 'hash')
+# Files up to this size are joined in memory, bigger ones are split in partitions on disk.
+BMV_JOIN_MEMORY_LIMIT = 256 * 1024 * 1024
+# Memory taken by the lines of a file joined in memory (decoded strings, the dictionary by key and its deques)
+# for each of its bytes on disk. Measured around 4 for parse_bmv_pcap.py output with unique keys.
+BMV_JOIN_MEMORY_OVERHEAD = 4
+
+
+def bmv_key_order(key: tuple) -> tuple:
+    '''Sort order of a (grupo_market_data, date-secuencia) key, by grupo, by date and then by the number of the
+    secuencia'''
+    grupo_market_data, key = key
+    date, _, secuencia = key.rpartition('-')
+    return grupo_market_data, date, int(secuencia)
+
+
+def read_bmv_tipo_mensaje(line: str) -> str:
+    match = BMV_TIPO_MENSAJE_PATTERN.search(line)
+    return match.group(1) if match is not None else None
+
+
+def read_bmv_key(line: str) -> tuple:
+    '''Finds the (grupo_market_data, key) of a json line without decoding the rest of it.
+    The key alone is not unique, grupo 18 and grupo 40 count their own secuencia and have the same keys.'''
+    key_match = BMV_KEY_PATTERN.search(line)
+    tipo_mensaje = read_bmv_tipo_mensaje(line)
+    if key_match is None or tipo_mensaje is None:
+        message = json.loads(line)
+        key, tipo_mensaje = message['key'], message.get('tipoMensaje', '')
+    else:
+        key = key_match.group(1)
+    return BMV_GRUPOS_BY_TIPO_MENSAJE_SIZE.get(len(tipo_mensaje), 0), key
+
+
+def iter_bmv_json_keys(filename: str, start: int = None, end: int = None):
+    '''Yields ((grupo_market_data, key), line) for the non empty lines of a json lines file, or of its lines between
+    the byte offsets start and end, that must be where lines start'''
+    with open(filename, 'rb') as input_file:
+        offset = start or 0
+        input_file.seek(offset)
+        for raw_line in input_file:
+            if end is not None and offset >= end:
+                break
+            offset += len(raw_line)
+            line = raw_line.decode()
+            if line.strip():
+                yield read_bmv_key(line), line
+
+
+def is_sorted_by_bmv_key(filename: str) -> bool:
+    '''Tells if the lines of a json lines file come in the order of their (grupo_market_data, key), see bmv_key_order.
+    Repeated keys are allowed.'''
+    last_order = None
+    for key, line in iter_bmv_json_keys(filename):
+        order = bmv_key_order(key)
+        if last_order is not None and order < last_order:
+            return False
+        last_order = order
+    return True
+
+
+def merge_join_bmv_jsons(expected_filename: str, actual_filename: str, expected_range: tuple = (None, None),
+                         actual_range: tuple = (None, None)):
+    '''Joins two json lines files sorted by (grupo_market_data, key), reading both only once.
+    Yields ((grupo_market_data, key), expected_line, actual_line), with None as the line of the file that doesn't
+    have the key.
+    When a key is repeated, its first line in one file goes with its first line in the other, and so on.
+    The ranges are (start, end) byte offsets to join only part of the files, see split_bmv_json_ranges.'''
+    expected_lines = iter_bmv_json_keys(expected_filename, *expected_range)
+    actual_lines = iter_bmv_json_keys(actual_filename, *actual_range)
+    expected = next(expected_lines, None)
+    actual = next(actual_lines, None)
+    while expected is not None or actual is not None:
+        if actual is None:
+            order = -1
+        elif expected is None:
+            order = 1
+        else:
+            expected_order, actual_order = bmv_key_order(expected[0]), bmv_key_order(actual[0])
+            order = (expected_order > actual_order) - (expected_order < actual_order)
+        if order < 0:
+            yield expected[0], expected[1], None
+            expected = next(expected_lines, None)
+        elif order > 0:
+            yield actual[0], None, actual[1]
+            actual = next(actual_lines, None)
+        else:
+            yield expected[0], expected[1], actual[1]
+            expected = next(expected_lines, None)
+            actual = next(actual_lines, None)
+
+
+def hash_join_lines(expected_lines, actual_lines):
+    '''Joins (key, line) pairs in any order, keeping the actual ones in memory.
+    Yields (key, expected_line, actual_line) like merge_join_bmv_jsons'''
+    by_key = {}
+    for key, line in actual_lines:
+        by_key.setdefault(key, deque()).append(line)
+    for key, line in expected_lines:
+        lines = by_key.get(key)
+        if lines:
+            yield key, line, lines.popleft()
+            if not lines:
+                del by_key[key]
+        else:
+            yield key, line, None
+    for key, lines in by_key.items():
+        for line in lines:
+            yield key, None, line
+
+
+def partition_bmv_json(filename: str, directory: str, name: str, partitions: int) -> list:
+    '''Splits the lines of a json lines file in partitions files by the hash of their key. Returns their names'''
+    partition_filenames = [os.path.join(directory, f'{name}.{i}') for i in range(partitions)]
+    partition_files = [open(partition_filename, 'w') for partition_filename in partition_filenames]
+    try:
+        for key, line in iter_bmv_json_keys(filename):
+            partition = zlib.crc32(f'{key[0]}/{key[1]}'.encode()) % partitions
+            partition_files[partition].write(line if line.endswith('\n') else line + '\n')
+    finally:
+        for partition_file in partition_files:
+            partition_file.close()
+    return partition_filenames
+
+
+def count_bmv_join_partitions(filename: str, memory_limit: int, minimum: int = 1) -> int:
+    '''Partitions needed so the lines of each one, joined in memory, take about memory_limit bytes at most'''
+    return max(minimum, os.path.getsize(filename) * BMV_JOIN_MEMORY_OVERHEAD // memory_limit + 1)
+
+
+def hash_join_bmv_jsons(expected_filename: str, actual_filename: str, memory_limit: int = BMV_JOIN_MEMORY_LIMIT,
+                        directory: str = None):
+    '''Joins two json lines files in any order. Yields (key, expected_line, actual_line) like merge_join_bmv_jsons.
+    When the lines of the actual file would take more than memory_limit bytes in memory (see
+    BMV_JOIN_MEMORY_OVERHEAD), both files are first split by key in partitions in a temporary directory (inside
+    directory if given), and then each pair of partitions is joined in memory.'''
+    partitions = count_bmv_join_partitions(actual_filename, memory_limit)
+    if partitions == 1:
+        yield from hash_join_lines(iter_bmv_json_keys(expected_filename), iter_bmv_json_keys(actual_filename))
+        return
+    with tempfile.TemporaryDirectory(dir=directory) as temporary_directory:
+        expected_partitions = partition_bmv_json(expected_filename, temporary_directory, 'expected', partitions)
+        actual_partitions = partition_bmv_json(actual_filename, temporary_directory, 'actual', partitions)
+        for expected_partition, actual_partition in zip(expected_partitions, actual_partitions):
+            yield from hash_join_lines(iter_bmv_json_keys(expected_partition), iter_bmv_json_keys(actual_partition))
+            os.remove(expected_partition)
+            os.remove(actual_partition)
+
+
+def join_bmv_jsons(expected_filename: str, actual_filename: str, join: str = 'auto',
+                   memory_limit: int = BMV_JOIN_MEMORY_LIMIT, directory: str = None):
+    '''Joins two json lines files by key, with merge_join_bmv_jsons or hash_join_bmv_jsons.
+    join 'auto' uses the merge when both files are sorted by key, and the hash join otherwise.'''
+    assert join in BMV_JOINS, f'Unknown join {join}, use one of {BMV_JOINS}'
+    if join == 'auto':
+        join = 'merge' if is_sorted_by_bmv_key(expected_filename) and is_sorted_by_bmv_key(actual_filename) else 'hash'
+    if join == 'merge':
+        return merge_join_bmv_jsons(expected_filename, actual_filename)
+    return hash_join_bmv_jsons(expected_filename, actual_filename, memory_limit, directory)
+
+
+
+#
+# Differences as data, to compare big files in parallel and summarize them.
+#
+
+BMV_COMPARE_CATEGORIES = ('equal', 'different', 'missing', 'extra')
+
+
+def new_bmv_compare_summary() -> dict:
+    '''Counters of a comparison: messages by category and tipoMensaje, differences by tipoMensaje and field,
+    and the first differences found as examples'''
+    return {'counts': dict.fromkeys(BMV_COMPARE_CATEGORIES, 0), 'by tipo': {}, 'by field': {}, 'examples': []}
+
+
+def compare_bmv_joined_lines(joined, max_examples: int = 100, comparers: dict = None) -> dict:
+    '''Compares the (key, expected_line, actual_line) of a join. Returns a summary, see new_bmv_compare_summary'''
+    summary = new_bmv_compare_summary()
+    counts, by_tipo, by_field, examples = summary['counts'], summary['by tipo'], summary['by field'], summary['examples']
+    for key, expected_line, actual_line in joined:
+        if actual_line is None:
+            category, tipo_mensaje, differences = 'missing', read_bmv_tipo_mensaje(expected_line), ()
+        elif expected_line is None:
+            category, tipo_mensaje, differences = 'extra', read_bmv_tipo_mensaje(actual_line), ()
+        else:
+            expected_json = json.loads(expected_line)
+            tipo_mensaje = expected_json.get('tipoMensaje')
+            differences = diff_bmv_message_json(expected_json, json.loads(actual_line), comparers)
+            category = 'different' if differences else 'equal'
+        counts[category] += 1
+        tipo_counts = by_tipo.get(tipo_mensaje)
+        if tipo_counts is None:
+            tipo_counts = by_tipo[tipo_mensaje] = dict.fromkeys(BMV_COMPARE_CATEGORIES, 0)
+        tipo_counts[category] += 1
+        if category == 'equal':
+            continue
+        if differences:
+            field_counts = by_field.setdefault(tipo_mensaje, {})
+            for field, expected_value, actual_value in differences:
+                field_counts[field] = field_counts.get(field, 0) + 1
+        if len(examples) < max_examples:
+            examples.append({'key': key[1], 'grupo_market_data': key[0], 'tipoMensaje': tipo_mensaje,
+                             'category': category, 'differences': [list(difference) for difference in differences]})
+    return summary
+
+
+def merge_bmv_compare_summaries(summaries, max_examples: int = 100) -> dict:
+    '''Adds up the summaries of the parts of a comparison, keeping the examples in the order of the parts'''
+    merged = new_bmv_compare_summary()
+    for summary in summaries:
+        for category, count in summary['counts'].items():
+            merged['counts'][category] += count
+        for tipo_mensaje, tipo_counts in summary['by tipo'].items():
+            merged_counts = merged['by tipo'].setdefault(tipo_mensaje, dict.fromkeys(BMV_COMPARE_CATEGORIES, 0))
+            for category, count in tipo_counts.items():
+                merged_counts[category] += count
+        for tipo_mensaje, field_counts in summary['by field'].items():
+            merged_fields = merged['by field'].setdefault(tipo_mensaje, {})
+            for field, count in field_counts.items():
+                merged_fields[field] = merged_fields.get(field, 0) + count
+        merged['examples'].extend(summary['examples'][:max_examples - len(merged['examples'])])
+    return merged
+
+
+def next_line_start(input_file, offset: int) -> int:
+    '''Offset of the first line that starts at or after offset'''
+    if offset == 0:
+        return 0
+    input_file.seek(offset - 1)
+    input_file.readline()
+    return input_file.tell()
+
+
+def find_bmv_key_offset(input_file, size: int, order: tuple) -> int:
+    '''Binary search of the offset of the first line with a key not lower than order, in a file sorted by key'''
+    low, high = 0, size
+    while low < high:
+        middle = (low + high) // 2
+        start = next_line_start(input_file, middle)
+        if start >= high:
+            high = middle
+            continue
+        input_file.seek(start)
+        raw_line = input_file.readline()
+        line = raw_line.decode()
+        if not line.strip() or bmv_key_order(read_bmv_key(line)) < order:
+            low = start + len(raw_line)
+        else:
+            high = start
+    return low
+
+
+def split_bmv_json_ranges(expected_filename: str, actual_filename: str, parts: int) -> list:
+    '''Splits two json lines files sorted by key in up to parts pairs of aligned byte ranges,
+    (expected range, actual range), so every key is in the same pair of ranges in both files'''
+    expected_size = os.path.getsize(expected_filename)
+    actual_size = os.path.getsize(actual_filename)
+    with open(expected_filename, 'rb') as expected_file, open(actual_filename, 'rb') as actual_file:
+        boundaries = [(0, 0)]
+        for part in range(1, parts):
+            start = next_line_start(expected_file, expected_size * part // parts)
+            expected_file.seek(start)
+            line = expected_file.readline().decode()
+            if not line.strip():
+                continue
+            order = bmv_key_order(read_bmv_key(line))
+            # Both files are cut at the first line of the key, so its repetitions don't end in different parts.
+            boundary = (find_bmv_key_offset(expected_file, expected_size, order),
+                        find_bmv_key_offset(actual_file, actual_size, order))
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    boundaries.append((expected_size, actual_size))
+    return [((start[0], end[0]), (start[1], end[1])) for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+
+def compare_bmv_json_ranges(expected_filename: str, actual_filename: str, expected_range: tuple, actual_range: tuple,
+                            max_examples: int = 100, comparers: dict = None) -> dict:
+    '''Compares a pair of ranges of two files sorted by key, see split_bmv_json_ranges'''
+    return compare_bmv_joined_lines(
+        merge_join_bmv_jsons(expected_filename, actual_filename, expected_range, actual_range), max_examples, comparers)
+
+
+def compare_bmv_json_partitions(expected_partition: str, actual_partition: str, max_examples: int = 100,
+                                comparers: dict = None) -> dict:
+    '''Compares a pair of partitions of two files split by partition_bmv_json'''
+    return compare_bmv_joined_lines(
+        hash_join_lines(iter_bmv_json_keys(expected_partition), iter_bmv_json_keys(actual_partition)), max_examples,
+        comparers)
+
+
+def compare_bmv_jsons_parallel(expected_filename: str, actual_filename: str, workers: int, join: str = 'auto',
+                               memory_limit: int = BMV_JOIN_MEMORY_LIMIT, directory: str = None,
+                               max_examples: int = 100, comparers: dict = None) -> dict:
+    '''Compares two json lines files by key in a pool of workers processes. Returns the merged summary.
+    comparers are the ones of compile_bmv_comparers, the default ones if not given.
+    Files sorted by key are split in aligned byte ranges, and files in any order in partitions by key on disk
+    (at least one per worker, and small enough for memory_limit).'''
+    assert join in BMV_JOINS, f'Unknown join {join}, use one of {BMV_JOINS}'
+    if join == 'auto':
+        join = 'merge' if is_sorted_by_bmv_key(expected_filename) and is_sorted_by_bmv_key(actual_filename) else 'hash'
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if join == 'merge':
+            ranges = split_bmv_json_ranges(expected_filename, actual_filename, workers * 4)
+            summaries = executor.map(compare_bmv_json_ranges, repeat(expected_filename), repeat(actual_filename),
+                                     [expected_range for expected_range, actual_range in ranges],
+                                     [actual_range for expected_range, actual_range in ranges], repeat(max_examples),
+                                     repeat(comparers))
+            return merge_bmv_compare_summaries(summaries, max_examples)
+        partitions = count_bmv_join_partitions(actual_filename, memory_limit, workers)
+        with tempfile.TemporaryDirectory(dir=directory) as temporary_directory:
+            expected_partitions = partition_bmv_json(expected_filename, temporary_directory, 'expected', partitions)
+            actual_partitions = partition_bmv_json(actual_filename, temporary_directory, 'actual', partitions)
+            summaries = executor.map(compare_bmv_json_partitions, expected_partitions, actual_partitions,
+                                     repeat(max_examples), repeat(comparers))
+            return merge_bmv_compare_summaries(summaries, max_examples)
@@ -0,0 +1,215 @@
+'''
+Compares two captures of BMV traffic packet by packet, without parsing them to json.
+
+Both captures are walked in the order of their sequence indexes (see bmv_utils.index), so packets are paired by
+grupo_market_data, sesion and secuencia wherever they are in the capture. Paired payloads are compared as bytes,
+and only the packets that differ are split in messages, which are paired again by their own secuencia, so a stream
+packed in other packets is still compared message by message. Only the messages that differ are decoded, to report
+which fields changed.
+'''
+import mmap
+import os
+import tempfile
+from contextlib import ExitStack
+
+from bmv_utils.compare import BMV_COMPARE_CATEGORIES, diff_bmv_message_json, new_bmv_compare_summary
+from bmv_utils.index import BmvIndex, bmv_index_filename, build_bmv_index
+from bmv_utils.parse import (BMV_HEADER_STRUCT, BMV_LONGITUD_STRUCT, BMV_TIPO_MENSAJE_SIZES, HEADER_SIZE,
+                             parse_by_message_type)
+from bmv_utils.pcap import extract_udp_payload, iter_capture_records
+
+BMV_PACKET_CATEGORIES = ('equal', 'different', 'missing', 'extra', 'duplicated expected', 'duplicated actual')
+
+
+def open_bmv_pcap_index(pcap_filename: str, directory: str) -> BmvIndex:
+    '''Opens the index next to the capture, or builds one in directory if there is none or it is stale.
+    directory is created if it does not exist.'''
+    index_filename = bmv_index_filename(pcap_filename)
+    if os.path.exists(index_filename):
+        try:
+            return BmvIndex(index_filename, pcap_filename)
+        except AssertionError:
+            pass
+    os.makedirs(directory, exist_ok=True)
+    index_filename = os.path.join(directory, os.path.basename(index_filename))
+    return BmvIndex(build_bmv_index(pcap_filename, index_filename))
+
+
+def read_bmv_payload(view, offset: int):
+    '''The UDP payload of the capture record at offset, a slice of view'''
+    for record_offset, timestamp, frame_start, frame_length in iter_capture_records(view, offset):
+        return extract_udp_payload(view[frame_start:frame_start + frame_length])
+
+
+def iter_bmv_indexed_payloads(index: BmvIndex, view):
+    '''Yields ((grupo_market_data, secuencia), {sesion: [payloads]}) in the order of the index,
+    one item for all the copies of a packet (from feed A and B, or retransmitted)'''
+    current, by_sesion = None, {}
+    for position in range(len(index)):
+        entry = index[position]
+        key = (entry.grupo_market_data, entry.secuencia)
+        if key != current:
+            if by_sesion:
+                yield current, by_sesion
+            current, by_sesion = key, {}
+        payload = read_bmv_payload(view, entry.offset)
+        by_sesion.setdefault(payload[4], []).append(payload)
+    if by_sesion:
+        yield current, by_sesion
+
+
+def merge_bmv_indexed_payloads(expected_payloads, actual_payloads):
+    '''Merge join of two iter_bmv_indexed_payloads. Yields (key, expected by sesion, actual by sesion),
+    with an empty dictionary on the side that does not have the packet'''
+    expected = next(expected_payloads, None)
+    actual = next(actual_payloads, None)
+    while expected is not None or actual is not None:
+        if actual is None or (expected is not None and expected[0] < actual[0]):
+            yield expected[0], expected[1], {}
+            expected = next(expected_payloads, None)
+        elif expected is None or actual[0] < expected[0]:
+            yield actual[0], {}, actual[1]
+            actual = next(actual_payloads, None)
+        else:
+            yield expected[0], expected[1], actual[1]
+            expected = next(expected_payloads, None)
+            actual = next(actual_payloads, None)
+
+
+def iter_bmv_raw_messages(payload):
+    '''Yields (grupo_market_data, sesion, secuencia, raw message) for each message of a BMV packet'''
+    longitud, total_mensajes, grupo_market_data, sesion, secuencia, fecha_hora = BMV_HEADER_STRUCT.unpack_from(payload)
+    start = HEADER_SIZE
+    for i in range(total_mensajes):
+        longitud_msg = BMV_LONGITUD_STRUCT.unpack_from(payload, start)[0]
+        yield grupo_market_data, sesion, secuencia + i, bytes(payload[start + 2:start + 2 + longitud_msg])
+        start += longitud_msg + 2
+
+
+def format_bmv_message_key(key: tuple) -> str:
+    grupo_market_data, sesion, secuencia = key
+    return f'{grupo_market_data}/{sesion}/{secuencia}'
+
+
+def read_bmv_raw_tipo_mensaje(grupo_market_data: int, raw_message: bytes) -> str:
+    return raw_message[:BMV_TIPO_MENSAJE_SIZES.get(grupo_market_data, 1)].decode('iso-8859-1')
+
+
+def diff_bmv_raw_messages(grupo_market_data: int, expected_message: bytes, actual_message: bytes,
+                          comparers: dict = None) -> list:
+    '''Decodes two messages that are not the same bytes, and returns their differences like diff_bmv_message_json.
+    Messages that can not be decoded are reported as their bytes in hex.'''
+    try:
+        expected_json = parse_by_message_type(grupo_market_data, expected_message, False)
+        actual_json = parse_by_message_type(grupo_market_data, actual_message, False)
+        differences = diff_bmv_message_json(expected_json, actual_json, comparers)
+    except Exception:
+        differences = None
+    # The same fields with other bytes, like a filler or a field that is not compared.
+    return differences or [('bytes', expected_message.hex(), actual_message.hex())]
+
+
+class BmvCaptureDiff:
+    '''Counts the differences between two captures, see diff_bmv_pcaps.
+    Messages of packets that did not match are kept pending until their pair in the other capture shows up.'''
+
+    def __init__(self, max_examples: int = 100, comparers: dict = None):
+        self.max_examples = max_examples
+        self.comparers = comparers
+        self.summary = new_bmv_compare_summary()
+        self.summary['packets'] = dict.fromkeys(BMV_PACKET_CATEGORIES, 0)
+        self.pending_expected = {}
+        self.pending_actual = {}
+
+    def count(self, category: str, key: tuple, tipo_mensaje: str, differences=()) -> None:
+        summary = self.summary
+        summary['counts'][category] += 1
+        tipo_counts = summary['by tipo'].get(tipo_mensaje)
+        if tipo_counts is None:
+            tipo_counts = summary['by tipo'][tipo_mensaje] = dict.fromkeys(BMV_COMPARE_CATEGORIES, 0)
+        tipo_counts[category] += 1
+        if category == 'equal':
+            return
+        if differences:
+            field_counts = summary['by field'].setdefault(tipo_mensaje, {})
+            for field, expected_value, actual_value in differences:
+                field_counts[field] = field_counts.get(field, 0) + 1
+        if len(summary['examples']) < self.max_examples:
+            summary['examples'].append({'key': format_bmv_message_key(key), 'tipoMensaje': tipo_mensaje,
+                                        'category': category,
+                                        'differences': [list(difference) for difference in differences]})
+
+    def compare_messages(self, payload, pending: dict, other_pending: dict, is_expected: bool) -> None:
+        for grupo_market_data, sesion, secuencia, raw_message in iter_bmv_raw_messages(payload):
+            key = (grupo_market_data, sesion, secuencia)
+            other_message = other_pending.pop(key, None)
+            if other_message is None:
+                pending.setdefault(key, raw_message)
+                continue
+            expected_message, actual_message = (raw_message, other_message) if is_expected else (other_message, raw_message)
+            tipo_mensaje = read_bmv_raw_tipo_mensaje(grupo_market_data, expected_message)
+            if expected_message == actual_message:
+                self.count('equal', key, tipo_mensaje)
+            else:
+                self.count('different', key, tipo_mensaje, diff_bmv_raw_messages(
+                    grupo_market_data, expected_message, actual_message, self.comparers))
+
+    def compare_packets(self, expected_by_sesion: dict, actual_by_sesion: dict) -> None:
+        '''Compares the copies of a packet of both captures, by sesion'''
+        packets = self.summary['packets']
+        for sesion, expected_payloads in expected_by_sesion.items():
+            packets['duplicated expected'] += len(expected_payloads) - 1
+            actual_payloads = actual_by_sesion.get(sesion)
+            if actual_payloads is None:
+                packets['missing'] += 1
+                self.compare_messages(expected_payloads[0], self.pending_expected, self.pending_actual, True)
+                continue
+            if expected_payloads[0] == actual_payloads[0]:
+                # The fast path, the same bytes are the same messages.
+                packets['equal'] += 1
+                self.summary['counts']['equal'] += BMV_HEADER_STRUCT.unpack_from(expected_payloads[0])[1]
+                continue
+            packets['different'] += 1
+            self.compare_messages(expected_payloads[0], self.pending_expected, self.pending_actual, True)
+            self.compare_messages(actual_payloads[0], self.pending_actual, self.pending_expected, False)
+        for sesion, actual_payloads in actual_by_sesion.items():
+            packets['duplicated actual'] += len(actual_payloads) - 1
+            if sesion not in expected_by_sesion:
+                packets['extra'] += 1
+                self.compare_messages(actual_payloads[0], self.pending_actual, self.pending_expected, False)
+
+    def finish(self) -> dict:
+        '''Counts the messages that never found their pair as missing or extra, and returns the summary'''
+        for category, pending in (('missing', self.pending_expected), ('extra', self.pending_actual)):
+            for key in sorted(pending):
+                self.count(category, key, read_bmv_raw_tipo_mensaje(key[0], pending[key]))
+            pending.clear()
+        return self.summary
+
+
+def diff_bmv_pcaps(expected_filename: str, actual_filename: str, max_examples: int = 100, comparers: dict = None,
+                   directory: str = None) -> dict:
+    '''Compares the BMV packets of two pcap or pcapng files. Returns a summary like the one of
+    bmv_utils.compare.compare_bmv_joined_lines, plus the counts of 'packets'.
+    Only the messages compared one by one are counted by tipo, the ones of equal packets are only in the counts.
+    Captures without an up to date index get one built in directory, a temporary directory by default.'''
+    with ExitStack() as stack:
+        temporary_directory = directory or stack.enter_context(tempfile.TemporaryDirectory())
+        payloads = []
+        for pcap_filename in (expected_filename, actual_filename):
+            index = stack.enter_context(open_bmv_pcap_index(pcap_filename, temporary_directory))
+            input_file = stack.enter_context(open(pcap_filename, 'rb'))
+            buffer = stack.enter_context(mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ))
+            view = memoryview(buffer)
+            stack.callback(view.release)
+            payloads.append(iter_bmv_indexed_payloads(index, view))
+        capture_diff = BmvCaptureDiff(max_examples, comparers)
+        try:
+            for key, expected_by_sesion, actual_by_sesion in merge_bmv_indexed_payloads(*payloads):
+                capture_diff.compare_packets(expected_by_sesion, actual_by_sesion)
+        finally:
+            # The payloads are slices of the maps, they are dropped before the maps are closed.
+            expected_by_sesion = actual_by_sesion = None
+            for generator in payloads:
+                generator.close()
+        return capture_diff.finish()
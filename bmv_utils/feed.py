@@ -0,0 +1,255 @@
+'''
+Receives the live multicast feeds of BMV and keeps the health of each one: sequence gaps, packets out of order,
+duplicated packets and latency from the fecha_hora of the exchange to the time the packet was received.
+
+A receiver thread only reads the sockets into preallocated buffers and hands them to a worker thread that decodes
+them with parse_bmv_udp_packet and updates the statistics, so a slow decode never keeps the sockets from being read.
+When every buffer is waiting to be decoded, new packets are read into a scratch buffer and counted as dropped.
+'''
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from queue import SimpleQueue
+
+from bmv_utils.parse import (BMV_HEADER_STRUCT, BMV_SEQUENCE_GAP, BMV_SEQUENCE_OUT_OF_ORDER, check_bmv_sequence,
+                             parse_bmv_udp_packet)
+
+# Buffers preallocated for packets waiting to be decoded, and the size of each one.
+# BMV packets fit in an ethernet frame, the size leaves room for jumbo frames.
+BMV_FEED_SLOTS = 4096
+BMV_FEED_SLOT_SIZE = 9216
+# Latencies kept to compute the percentiles, the most recent ones.
+BMV_FEED_LATENCY_WINDOW = 100000
+# Gaps still open (not filled by late packets) that are remembered, the oldest ones are forgotten.
+BMV_FEED_OPEN_GAPS = 1000
+
+
+def make_bmv_receiver_socket(group: str, port: int, interface: str = '0.0.0.0',
+                             receive_buffer: int = 1 << 24) -> socket.socket:
+    '''Returns a non blocking UDP socket that joined the multicast group on interface and receives on port'''
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    except AttributeError:
+        pass
+    try:
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    except OSError:
+        pass  # The system keeps its maximum
+    try:
+        # Bound to the group, so feeds of other groups on the same port are not received here.
+        udp_socket.bind((group, port))
+    except OSError:
+        udp_socket.bind(('', port))  # Windows does not bind to multicast addresses
+    udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                          socket.inet_aton(group) + socket.inet_aton(interface))
+    udp_socket.setblocking(False)
+    return udp_socket
+
+
+class BmvFeedStats:
+    '''Statistics of a feed, updated by the worker and read by anyone with snapshot'''
+
+    def __init__(self, latency_window: int = BMV_FEED_LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(('packets', 'messages', 'bytes', 'gaps', 'missing', 'out of order',
+                                       'recovered', 'duplicates', 'errors', 'dropped'), 0)
+        self.by_tipo = {}
+        self.latencies = deque(maxlen=latency_window)
+        self.max_latency = None
+        self.open_gaps = deque(maxlen=BMV_FEED_OPEN_GAPS)
+        self.sesion = None
+        self.last_sequence = None
+        self.last_error = None
+        self.last_received = None
+
+    def fill_gaps(self, start: int, end: int) -> int:
+        '''Removes the messages from start to end from the open gaps. Returns how many of them were missing'''
+        filled = 0
+        for gap in list(self.open_gaps):
+            gap_start, gap_end = gap
+            low, high = max(start, gap_start), min(end, gap_end)
+            if low >= high:
+                continue
+            filled += high - low
+            self.open_gaps.remove(gap)
+            if gap_start < low:
+                self.open_gaps.append((gap_start, low))
+            if high < gap_end:
+                self.open_gaps.append((high, gap_end))
+        return filled
+
+    def update(self, paquete: dict, fecha_hora: int, size: int, received: float) -> None:
+        '''Counts a decoded packet received at the epoch seconds received.
+        The secuencia is checked like process_bmv_udp_packet does, but a packet behind the expected secuencia
+        never moves it back: it either fills a gap (out of order) or was already received (duplicate).'''
+        with self.lock:
+            counters = self.counters
+            counters['packets'] += 1
+            counters['bytes'] += size
+            self.last_received = received
+            latency = received * 1000 - fecha_hora
+            self.latencies.append(latency)
+            if self.max_latency is None or latency > self.max_latency:
+                self.max_latency = latency
+            if paquete['sesion'] != self.sesion:
+                self.sesion, self.last_sequence = paquete['sesion'], None  # A new sesion starts its own secuencia
+                self.open_gaps.clear()
+            secuencia, total_mensajes = paquete['secuencia'], paquete['total_mensajes']
+            state, next_sequence = check_bmv_sequence(self.last_sequence, secuencia, total_mensajes)
+            if state == BMV_SEQUENCE_GAP:
+                counters['gaps'] += 1
+                counters['missing'] += secuencia - self.last_sequence
+                self.open_gaps.append((self.last_sequence, secuencia))
+            elif state == BMV_SEQUENCE_OUT_OF_ORDER:
+                filled = self.fill_gaps(secuencia, min(next_sequence, self.last_sequence))
+                if filled:
+                    counters['out of order'] += 1
+                    counters['recovered'] += filled
+                    counters['missing'] -= filled
+                elif next_sequence <= self.last_sequence:
+                    counters['duplicates'] += 1
+                    return  # Its messages were already counted
+                next_sequence = max(next_sequence, self.last_sequence)
+            self.last_sequence = next_sequence
+            counters['messages'] += len(paquete['mensajes'])
+            by_tipo = self.by_tipo
+            for mensaje in paquete['mensajes']:
+                tipo_mensaje = mensaje['tipoMensaje']
+                by_tipo[tipo_mensaje] = by_tipo.get(tipo_mensaje, 0) + 1
+
+    def count_error(self, error: Exception) -> None:
+        with self.lock:
+            self.counters['errors'] += 1
+            self.last_error = str(error)
+
+    def count_dropped(self) -> None:
+        with self.lock:
+            self.counters['dropped'] += 1
+
+    def snapshot(self) -> dict:
+        '''A copy of the statistics, with the latency percentiles in milliseconds'''
+        with self.lock:
+            latencies = list(self.latencies)
+            snapshot = dict(self.counters)
+            snapshot['by tipo'] = dict(self.by_tipo)
+            snapshot['sesion'] = self.sesion
+            snapshot['last sequence'] = self.last_sequence
+            snapshot['open gaps'] = list(self.open_gaps)
+            snapshot['last error'] = self.last_error
+            snapshot['last received'] = self.last_received
+            max_latency = self.max_latency
+        latencies.sort()
+        if latencies:
+            snapshot['latency ms'] = {'p50': latencies[len(latencies) // 2],
+                                      'p99': latencies[min(len(latencies) * 99 // 100, len(latencies) - 1)],
+                                      'max': max_latency}
+        return snapshot
+
+
+class BmvFeedHandler:
+    '''Receives and decodes the multicast feeds {label: (group, port)}, keeping a BmvFeedStats per label.
+    Use it as a context manager, or call start and stop.'''
+
+    def __init__(self, feeds: dict, interface: str = '0.0.0.0', validate: bool = True, slots: int = BMV_FEED_SLOTS,
+                 slot_size: int = BMV_FEED_SLOT_SIZE, receive_buffer: int = 1 << 24,
+                 latency_window: int = BMV_FEED_LATENCY_WINDOW):
+        self.feeds = dict(feeds)
+        self.interface = interface
+        self.validate = validate
+        self.receive_buffer = receive_buffer
+        self.stats = {label: BmvFeedStats(latency_window) for label in self.feeds}
+        self.buffer = bytearray(slots * slot_size)
+        view = memoryview(self.buffer)
+        self.slots = [view[slot * slot_size:(slot + 1) * slot_size] for slot in range(slots)]
+        self.scratch = bytearray(slot_size)
+        # Indexes of the slots free to receive into, and the (label, slot, size, received) waiting to be decoded.
+        self.free = deque(range(slots))
+        self.ready = SimpleQueue()
+        self.stopped = threading.Event()
+        self.sockets = []
+        self.threads = []
+
+    def start(self) -> None:
+        for label, (group, port) in self.feeds.items():
+            self.sockets.append((label, make_bmv_receiver_socket(group, port, self.interface, self.receive_buffer)))
+        self.threads = [threading.Thread(target=self.receive, name='bmv-feed-receiver', daemon=True),
+                        threading.Thread(target=self.decode, name='bmv-feed-decoder', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.threads:
+            self.threads[0].join()
+            self.ready.put(None)
+            self.threads[1].join()
+            self.threads = []
+        for label, udp_socket in self.sockets:
+            udp_socket.close()
+        self.sockets = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def receive(self) -> None:
+        '''Reads every socket until it would block, each packet into a free slot.
+        Errors of a socket are counted in the statistics of its feed, they do not stop the receiver.'''
+        free, ready, slots, scratch = self.free, self.ready, self.slots, self.scratch
+        with selectors.DefaultSelector() as selector:
+            for label, udp_socket in self.sockets:
+                selector.register(udp_socket, selectors.EVENT_READ, label)
+            while not self.stopped.is_set():
+                for key, events in selector.select(timeout=0.1):
+                    udp_socket, label = key.fileobj, key.data
+                    while True:
+                        try:
+                            slot = free.popleft()
+                        except IndexError:
+                            slot = None  # All the slots wait for the decoder
+                        try:
+                            size = udp_socket.recv_into(scratch if slot is None else slots[slot])
+                        except (BlockingIOError, InterruptedError):
+                            if slot is not None:
+                                free.appendleft(slot)
+                            break
+                        except OSError as e:
+                            # Counted as an error of its feed, so the thread keeps receiving the others.
+                            if slot is not None:
+                                free.appendleft(slot)
+                            self.stats[label].count_error(e)
+                            break
+                        if slot is None:
+                            self.stats[label].count_dropped()
+                        else:
+                            ready.put((label, slot, size, time.time()))
+
+    def decode(self) -> None:
+        '''Decodes the received packets and updates the statistics of their feeds, until stop'''
+        free, ready, slots = self.free, self.ready, self.slots
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            label, slot, size, received = item
+            stats = self.stats[label]
+            try:
+                packet = slots[slot][:size]
+                paquete = parse_bmv_udp_packet(packet, self.validate)
+                stats.update(paquete, BMV_HEADER_STRUCT.unpack_from(packet)[5], size, received)
+            except Exception as e:
+                # Same as parse_bmv_pcap_file, what we can not understand is counted and we continue.
+                stats.count_error(e)
+            finally:
+                packet = None
+                free.append(slot)
+
+    def snapshot(self) -> dict:
+        '''The statistics of every feed, by label'''
+        return {label: stats.snapshot() for label, stats in self.stats.items()}
@@ -0,0 +1,177 @@
+'''
+Sequence index of pcap files from BMV, to read a range of messages without parsing the capture from the start.
+
+The index is a binary sidecar file (by default the name of the capture plus .idx) with one fixed size entry per
+packet: its offset in the capture, fecha_hora, secuencia, total_mensajes and grupo_market_data. Entries are sorted
+by grupo_market_data and secuencia, so the index is searched with a binary search straight over the mapped file.
+'''
+import mmap
+import os
+import struct
+from collections import namedtuple
+from contextlib import nullcontext
+
+from bmv_utils.parse import BMV_HEADER_STRUCT, HEADER_SIZE, make_bmv_filter, parse_bmv_udp_packet
+from bmv_utils.pcap import extract_udp_payload, iter_capture_records
+
+BMV_INDEX_MAGIC = b'BMVIDX01'
+# Header: magic and size of the indexed capture, to know if the index is stale.
+BMV_INDEX_HEADER_STRUCT = struct.Struct('<8sQ')
+# Entry: offset, fecha_hora (timestamp3), secuencia, total_mensajes and grupo_market_data.
+BMV_INDEX_ENTRY_STRUCT = struct.Struct('<QqibB')
+
+BmvIndexEntry = namedtuple('BmvIndexEntry', ['offset', 'fecha_hora', 'secuencia', 'total_mensajes', 'grupo_market_data'])
+
+
+def bmv_index_filename(pcap_filename: str) -> str:
+    return pcap_filename + '.idx'
+
+
+def iter_bmv_pcap_headers(buffer, start: int = None):
+    '''Yields (offset, secuencia, total_mensajes, grupo_market_data, fecha_hora) for every BMV packet of a capture'''
+    for offset, timestamp, frame_start, frame_length in iter_capture_records(buffer, start):
+        payload = extract_udp_payload(buffer[frame_start:frame_start + frame_length])
+        if payload is None or len(payload) < HEADER_SIZE:
+            continue
+        longitud, total_mensajes, grupo_market_data, sesion, secuencia, fecha_hora = BMV_HEADER_STRUCT.unpack_from(payload)
+        if longitud == len(payload):
+            yield offset, secuencia, total_mensajes, grupo_market_data, fecha_hora
+
+
+def build_bmv_index(pcap_filename: str, index_filename: str = None) -> str:
+    '''Indexes every BMV packet of a pcap or pcapng file. Returns the name of the index file'''
+    if index_filename is None:
+        index_filename = bmv_index_filename(pcap_filename)
+    with open(pcap_filename, 'rb') as input_file:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            pcap_size = len(buffer)
+            view = memoryview(buffer)
+            entries = [(grupo_market_data, secuencia, offset, fecha_hora, total_mensajes)
+                       for offset, secuencia, total_mensajes, grupo_market_data, fecha_hora
+                       in iter_bmv_pcap_headers(view)]
+            view.release()
+    entries.sort()
+    output = bytearray(BMV_INDEX_HEADER_STRUCT.pack(BMV_INDEX_MAGIC, pcap_size))
+    for grupo_market_data, secuencia, offset, fecha_hora, total_mensajes in entries:
+        output += BMV_INDEX_ENTRY_STRUCT.pack(offset, fecha_hora, secuencia, total_mensajes, grupo_market_data)
+    with open(index_filename, 'wb') as index_file:
+        index_file.write(output)
+    return index_filename
+
+
+class BmvIndex:
+    '''Reads an index built by build_bmv_index. Entries are read from the mapped file only when they are needed'''
+
+    def __init__(self, index_filename: str, pcap_filename: str = None):
+        with open(index_filename, 'rb') as index_file:
+            self.buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.pcap_size = BMV_INDEX_HEADER_STRUCT.unpack_from(self.buffer)
+        assert magic == BMV_INDEX_MAGIC, f'{index_filename} is not an index of a BMV capture'
+        if pcap_filename is not None:
+            assert os.path.getsize(pcap_filename) == self.pcap_size, f'{index_filename} is not the index of {pcap_filename}'
+        self.length = (len(self.buffer) - BMV_INDEX_HEADER_STRUCT.size) // BMV_INDEX_ENTRY_STRUCT.size
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, position: int) -> BmvIndexEntry:
+        if not 0 <= position < self.length:
+            raise IndexError(position)
+        return BmvIndexEntry._make(BMV_INDEX_ENTRY_STRUCT.unpack_from(
+            self.buffer, BMV_INDEX_HEADER_STRUCT.size + position * BMV_INDEX_ENTRY_STRUCT.size))
+
+    def bisect(self, key, value, lo: int = 0, hi: int = None) -> int:
+        '''Position of the first entry between lo and hi whose key(entry) is not lower than value'''
+        hi = self.length if hi is None else hi
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if key(self[middle]) < value:
+                lo = middle + 1
+            else:
+                hi = middle
+        return lo
+
+    def grupo_range(self, grupo_market_data: int) -> tuple:
+        '''Positions (start, end) of the entries of a grupo_market_data'''
+        start = self.bisect(lambda entry: entry.grupo_market_data, grupo_market_data)
+        end = self.bisect(lambda entry: entry.grupo_market_data, grupo_market_data + 1, start)
+        return start, end
+
+    def find_sequence(self, secuencia: int, grupo_market_data: int = 18) -> int:
+        '''Position of the packet that has the message secuencia, or of the first one after it'''
+        start, end = self.grupo_range(grupo_market_data)
+        # The first packet that ends after secuencia, also the first of its copies when it is repeated.
+        return self.bisect(lambda entry: entry.secuencia + entry.total_mensajes, secuencia + 1, start, end)
+
+    def find_time(self, fecha_hora: int, grupo_market_data: int = 18) -> int:
+        '''Position of the first packet with a fecha_hora (epoch milliseconds) not lower than the given one.
+        It assumes that fecha_hora grows with the secuencia, as BMV sends them.'''
+        start, end = self.grupo_range(grupo_market_data)
+        return self.bisect(lambda entry: entry.fecha_hora, fecha_hora, start, end)
+
+    def offsets(self, start: int, end: int) -> tuple:
+        '''Lowest and highest offsets of the packets between the positions start and end, or None if there are none'''
+        offsets = [self[position].offset for position in range(start, end)]
+        if not offsets:
+            return None
+        return min(offsets), max(offsets)
+
+    def close(self) -> None:
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_bmv_indexed_messages(pcap_filename: str, first_sequence: int = None, last_sequence: int = None,
+                              start_time=None, end_time=None, grupo_market_data: int = 18, types=None,
+                              instruments=None, index=None, validate: bool = True):
+    '''Yields the messages of a grupo_market_data in a secuencia and/or time range, like iter_bmv_messages,
+    reading only the part of the capture where the index says they are.
+    index is a BmvIndex, by default the one next to the capture (built with build_bmv_index).'''
+    bmv_filter = make_bmv_filter(types, instruments, first_sequence, last_sequence, start_time, end_time)
+    with BmvIndex(bmv_index_filename(pcap_filename), pcap_filename) if index is None else nullcontext(index) as index:
+        start, end = index.grupo_range(grupo_market_data)
+        if first_sequence is not None:
+            start = max(start, index.find_sequence(first_sequence, grupo_market_data))
+        if last_sequence is not None:
+            # Up to the last packet that starts at or before last_sequence.
+            end = min(end, index.bisect(lambda entry: entry.secuencia, last_sequence + 1, start, end))
+        if bmv_filter is not None and bmv_filter.start_time is not None:
+            start = max(start, index.find_time(bmv_filter.start_time, grupo_market_data))
+        if bmv_filter is not None and bmv_filter.end_time is not None:
+            end = min(end, index.find_time(bmv_filter.end_time, grupo_market_data))
+        offsets = index.offsets(start, end)
+    if offsets is None:
+        return
+    first_offset, last_offset = offsets
+    with open(pcap_filename, 'rb') as input_file:
+        buffer = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buffer)
+        records = iter_capture_records(view, first_offset)
+        try:
+            for offset, timestamp, frame_start, frame_length in records:
+                if offset > last_offset:
+                    break
+                payload = extract_udp_payload(view[frame_start:frame_start + frame_length])
+                if payload is None:
+                    continue
+                try:
+                    paquete = parse_bmv_udp_packet(payload, validate, bmv_filter)
+                except Exception as e:
+                    # Same as parse_bmv_pcap_file, we skip what we can not understand and continue.
+                    print(e)
+                    continue
+                if paquete['grupo_market_data'] == grupo_market_data:
+                    yield from paquete['mensajes']
+        finally:
+            records.close()
+            payload = None
+            try:
+                view.release()
+                buffer.close()
+            except BufferError:
+                pass  # Same as iter_pcap_udp_payloads, the map is closed by the garbage collector.
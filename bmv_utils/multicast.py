@@ -0,0 +1,160 @@
+'''
+Publishes the BMV packets of a capture as a live multicast feed, at the recorded rate, scaled, or as fast as possible.
+
+Packets are sent with their recorded UDP payloads, so whoever listens to the feed gets the same bytes that BMV sent.
+'''
+import mmap
+import os
+import socket
+from time import perf_counter, sleep
+
+from bmv_utils.index import BmvIndex, bmv_index_filename
+from bmv_utils.parse import BMV_HEADER_STRUCT, BMV_LAYOUTS, HEADER_SIZE
+from bmv_utils.pcap import extract_udp_payload, iter_capture_records
+
+# Groups and ports of the BMV feeds, by environment, grupo_market_data and feed (A or B).
+BMV_MULTICAST_FEEDS = {
+    ('PROD', 18, 'A'): ('239.100.100.18', 12121),
+    ('PROD', 18, 'B'): ('239.100.200.18', 12122),
+    ('DRP', 18, 'A'): ('239.150.100.18', 12131),
+    ('DRP', 18, 'B'): ('239.150.200.18', 12132),
+    ('TEST', 18, 'A'): ('239.200.100.18', 12141),
+    ('TEST', 18, 'B'): ('239.200.200.18', 12142),
+    ('PROD', 40, 'A'): ('239.100.100.40', 12121),
+    ('PROD', 40, 'B'): ('239.100.200.40', 12122),
+    ('DRP', 40, 'A'): ('239.150.100.40', 12131),
+    ('DRP', 40, 'B'): ('239.150.200.40', 12132),
+    ('TEST', 40, 'A'): ('239.200.100.40', 12141),
+    ('TEST', 40, 'B'): ('239.200.200.40', 12142),
+}
+
+# Below this many seconds the pacing loop spins on the clock instead of sleeping, sleep() is not that precise.
+BMV_PACING_SPIN = 0.001
+
+
+def iter_bmv_feed_packets(pcap_filename: str, grupos=None, first_sequence: int = None, last_sequence: int = None):
+    '''Yields (timestamp, grupo_market_data, payload) for the BMV packets of a capture, in the order they were captured.
+    With first_sequence or last_sequence only the packets that have messages in that range are yielded, and if the
+    capture has its index (see bmv_utils.index) only the part of the capture where they are is read.'''
+    start = end = None
+    index_filename = bmv_index_filename(pcap_filename)
+    if (first_sequence is not None or last_sequence is not None) and os.path.exists(index_filename):
+        with BmvIndex(index_filename, pcap_filename) as index:
+            ranges = []
+            for grupo_market_data in grupos or BMV_LAYOUTS:
+                first, last = index.grupo_range(grupo_market_data)
+                if first_sequence is not None:
+                    first = max(first, index.find_sequence(first_sequence, grupo_market_data))
+                if last_sequence is not None:
+                    last = min(last, index.bisect(lambda entry: entry.secuencia, last_sequence + 1, first, last))
+                offsets = index.offsets(first, last)
+                if offsets is not None:
+                    ranges.append(offsets)
+        if not ranges:
+            return
+        start = min(offsets[0] for offsets in ranges)
+        end = max(offsets[1] for offsets in ranges) + 1
+    with open(pcap_filename, 'rb') as input_file:
+        buffer = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buffer)
+    records = iter_capture_records(view, start, end)
+    payload = None
+    last_timestamp = 0.0
+    try:
+        for offset, timestamp, frame_start, frame_length in records:
+            payload = extract_udp_payload(view[frame_start:frame_start + frame_length])
+            if payload is None or len(payload) < HEADER_SIZE:
+                continue
+            longitud, total_mensajes, grupo_market_data, sesion, secuencia, fecha_hora = \
+                BMV_HEADER_STRUCT.unpack_from(payload)
+            if longitud != len(payload) or (grupos is not None and grupo_market_data not in grupos):
+                continue
+            if first_sequence is not None and secuencia + total_mensajes <= first_sequence:
+                continue
+            if last_sequence is not None and secuencia > last_sequence:
+                continue
+            if timestamp is None:
+                timestamp = last_timestamp  # pcapng simple packet blocks have no timestamp
+            last_timestamp = timestamp
+            yield timestamp, grupo_market_data, payload
+    finally:
+        records.close()
+        payload = None
+        try:
+            view.release()
+            buffer.close()
+        except BufferError:
+            pass  # Same as iter_pcap_udp_payloads, the map is closed by the garbage collector.
+
+
+def iter_bmv_packet_batches(packets, speed: float = 1.0, batch_window: float = 0.0002, batch_size: int = 64):
+    '''Groups the (timestamp, grupo_market_data, payload) packets in lists that are sent together.
+    A batch has the consecutive packets due within batch_window seconds (after dividing by speed) of its first one,
+    up to batch_size packets. Without speed (as fast as possible) batches are of batch_size packets.
+    Yields (due, batch), where due is the seconds from the first packet when the batch must be sent.'''
+    first_timestamp = None
+    batch = []
+    batch_due = 0.0
+    for packet in packets:
+        if speed:
+            if first_timestamp is None:
+                first_timestamp = packet[0]
+            due = (packet[0] - first_timestamp) / speed
+        else:
+            due = 0.0
+        if batch and (len(batch) >= batch_size or due - batch_due > batch_window):
+            yield batch_due, batch
+            batch = []
+        if not batch:
+            batch_due = due
+        batch.append(packet)
+    if batch:
+        yield batch_due, batch
+
+
+def make_bmv_multicast_socket(ttl: int = 1, loop: bool = True, interface: str = None,
+                              send_buffer: int = 1 << 22) -> socket.socket:
+    '''Returns an UDP socket to send multicast packets, with loopback on so local listeners get them'''
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1 if loop else 0)
+    if interface is not None:
+        udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+    try:
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+    except OSError:
+        pass  # The system keeps its maximum
+    return udp_socket
+
+
+def publish_bmv_packets(packets, destinations: dict, udp_socket: socket.socket, speed: float = 1.0,
+                        batch_window: float = 0.0002, batch_size: int = 64) -> dict:
+    '''Sends the (timestamp, grupo_market_data, payload) packets to the (group, port) destinations of their grupo.
+    speed 1.0 keeps the recorded time between packets, 5.0 sends five times faster and 0 (or None) as fast as possible.
+    Returns the counters of what was sent: packets, bytes, seconds, packets/sec and the worst delay behind schedule.'''
+    sendto = udp_socket.sendto
+    sent = sent_bytes = skipped = 0
+    max_delay = 0.0
+    start = perf_counter()
+    for due, batch in iter_bmv_packet_batches(packets, speed, batch_window, batch_size):
+        if speed:
+            wait = start + due - perf_counter()
+            if wait > BMV_PACING_SPIN:
+                sleep(wait - BMV_PACING_SPIN)
+            if wait > 0:
+                while perf_counter() < start + due:
+                    pass
+            elif -wait > max_delay:
+                max_delay = -wait
+        for timestamp, grupo_market_data, payload in batch:
+            targets = destinations.get(grupo_market_data)
+            if not targets:
+                skipped += 1
+                continue
+            for destination in targets:
+                sendto(payload, destination)
+            sent += 1
+            sent_bytes += len(payload)
+    seconds = perf_counter() - start
+    return {'packets': sent, 'bytes': sent_bytes, 'skipped': skipped, 'seconds': seconds,
+            'packets/sec': sent / seconds if seconds else 0.0, 'max delay': max_delay}
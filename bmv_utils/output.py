@@ -0,0 +1,82 @@
+'''
+Writers for the parsed BMV messages.
+
+Every writer has write_mensaje(mensaje), flush() and close(), so the parsing functions don't need to know
+where or how the messages end up.
+'''
+import json
+
+# Formats accepted by open_bmv_writer.
+BMV_OUTPUT_FORMATS = ('jsonl', 'parquet', 'arrow')
+# Encoders that can be used for the json lines. Only 'json' writes exactly the same lines as json.dumps,
+# 'orjson' is much faster but writes compact json (no spaces after separators, short exponents and utf-8).
+BMV_JSON_ENCODERS = ('json', 'orjson')
+
+
+def make_json_encoder(name: str = 'json'):
+    '''Returns a function that encodes a message as a json string, using the encoder named name if it is installed'''
+    assert name in BMV_JSON_ENCODERS, f'Unknown json encoder {name}, use one of {BMV_JSON_ENCODERS}'
+    if name == 'orjson':
+        try:
+            import orjson
+        except ImportError:
+            print('orjson is not installed, using json instead')
+        else:
+            dumps = orjson.dumps
+            return lambda mensaje: dumps(mensaje).decode()
+    # Same encoder json.dumps uses when called without options, without checking them on every call.
+    return json.JSONEncoder().encode
+
+
+class BmvJsonlWriter:
+    '''Writes every message as a json line in a text file.
+    Lines are kept in memory and written together once they reach buffer_size characters.'''
+
+    def __init__(self, output_file, json_encoder: str = 'json', buffer_size: int = 1 << 20):
+        self.output_file = output_file
+        self.encode = make_json_encoder(json_encoder)
+        self.buffer_size = buffer_size
+        self.lines = []
+        self.pending_size = 0
+
+    def write_mensaje(self, mensaje: dict) -> None:
+        line = self.encode(mensaje)
+        self.lines.append(line)
+        self.pending_size += len(line) + 1
+        if self.pending_size >= self.buffer_size:
+            self.write_lines()
+
+    def write_lines(self) -> None:
+        '''Writes all the pending lines with a single write'''
+        if self.lines:
+            self.lines.append('')  # So the last line also ends with a new line
+            self.output_file.write('\n'.join(self.lines))
+            self.lines = []
+            self.pending_size = 0
+
+    def flush(self) -> None:
+        self.write_lines()
+        self.output_file.flush()
+
+    def close(self) -> None:
+        self.write_lines()
+        self.output_file.close()
+
+
+def as_bmv_writer(output):
+    '''Returns output if it is already a writer, otherwise assumes it is a text file and writes json lines to it'''
+    if hasattr(output, 'write_mensaje'):
+        return output
+    return BmvJsonlWriter(output)
+
+
+def open_bmv_writer(output_filename: str, output_format: str = 'jsonl', part: int = 0, json_encoder: str = 'json'):
+    '''Opens a writer for output_filename in one of BMV_OUTPUT_FORMATS.
+    For parquet and arrow, output_filename is a directory with one table per tipoMensaje, and part
+    identifies the file of each table that this writer creates.'''
+    assert output_format in BMV_OUTPUT_FORMATS, f'Unknown format {output_format}, use one of {BMV_OUTPUT_FORMATS}'
+    if output_format == 'jsonl':
+        return BmvJsonlWriter(open(output_filename, 'wt'), json_encoder)
+    # pyarrow is optional, we only need it for the columnar formats.
+    from bmv_utils.arrow import BmvArrowWriter
+    return BmvArrowWriter(output_filename, output_format, part)
@@ -1,12 +1,20 @@
 '''
 Utilities to parse BMV messages from multicast.
 '''
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from io import BufferedReader
+from itertools import chain, repeat
 
-import dpkt
-import json
 import struct
+from collections import namedtuple
 from datetime import datetime
+from functools import lru_cache
+
+from bmv_utils.output import as_bmv_writer, open_bmv_writer
+from bmv_utils.pcap import iter_pcap_udp_payloads, split_pcap_ranges
 
 HEADER_SIZE = 17
 
@@ -31,29 +39,38 @@ BMV_INT64_FORMAT = '>q'
 BMV_PRECIO4_FORMAT = '>i'
 BMV_PRECIO8_FORMAT = '>q'
 
+# Header: longitud, total_mensajes, grupo_market_data, sesion, secuencia and fecha_hora (timestamp3).
+BMV_HEADER_STRUCT = struct.Struct('>hbbbiq')
+assert BMV_HEADER_STRUCT.size == HEADER_SIZE, 'The header must have 17 bytes'
+# Every message in a packet is prefixed by its longitud, which does not include itself.
+BMV_LONGITUD_STRUCT = struct.Struct(BMV_INT16_FORMAT)
+
 
 #
 # BMV catalogos
 #
-BMV_TIPOS_VALOR = ('1','1A', '1I', 'CF', '1R', '1B', '0', '1E', '1C', 'FF', 'FE', '41', '3', 'FH')
-BMV_BOLSA_ORIGEN = ('M','I')
-BMV_TIPOS_CONCERTACION = ('C', 'O', 'H', 'D', 'M', 'P', 'X', 'v', 'w', '%', 'x', 'y', 'A', 'B', 'E', 'F', 'J', 'K', 'L', 'N', 'Q')
-BMV_TIPOS_OPERACION = ('E', 'C', 'B', 'D', 'W', 'X')
-BMV_TIPOS_LIQUIDACION = ('M', '2', '4', '7', '9', '1')
-BMV_INDICADORES_SUBASTA = ('P', 'S', ' ', 'N', '')
-
-BMV_TIPOS_WARRANT = ('C','V')
-BMV_TIPOS_BOLSA_ORIGEN = ('M', 'I')
-BMV_TIPOS_OPERA_TASA_PRECIO=['P','T']
-BMV_TIPOS_OPCION = ('C', 'P')
-BMV_TIPOS_VENCIMIENTO_DIARIO = ('1', '0')
-BMV_TIPOS_ESTRATEGIA = ('R', 'E', 'F')
+# frozensets, as they are only used to check that a value is in the catalog.
+BMV_TIPOS_VALOR = frozenset(('1','1A', '1I', 'CF', '1R', '1B', '0', '1E', '1C', 'FF', 'FE', '41', '3', 'FH'))
+BMV_BOLSA_ORIGEN = frozenset(('M','I'))
+BMV_TIPOS_CONCERTACION = frozenset(('C', 'O', 'H', 'D', 'M', 'P', 'X', 'v', 'w', '%', 'x', 'y', 'A', 'B', 'E', 'F', 'J', 'K', 'L', 'N', 'Q'))
+BMV_TIPOS_OPERACION = frozenset(('E', 'C', 'B', 'D', 'W', 'X'))
+BMV_TIPOS_LIQUIDACION = frozenset(('M', '2', '4', '7', '9', '1'))
+BMV_INDICADORES_SUBASTA = frozenset(('P', 'S', ' ', 'N', ''))
+
+BMV_TIPOS_WARRANT = frozenset(('C','V'))
+BMV_TIPOS_BOLSA_ORIGEN = frozenset(('M', 'I'))
+BMV_TIPOS_OPERA_TASA_PRECIO = frozenset(('P','T'))
+BMV_TIPOS_OPCION = frozenset(('C', 'P'))
+BMV_TIPOS_VENCIMIENTO_DIARIO = frozenset(('1', '0'))
+BMV_TIPOS_ESTRATEGIA = frozenset(('R', 'E', 'F'))
+BMV_SENTIDO_OPERACION = frozenset(('C', 'V'))
+BMV_TIPO_OPERACION_MSG_O = frozenset(('C', 'H', 'P', 'N'))
 
 # Catálogo de referencia
 # https://tecnologia.bmv.com.mx/especificacion/multicast/msg/structure/catalogs.html#cat_referencia
-BMV_CATALOGO_REFERENCIA = ('AN', 'AJ', '', 'VA')
-BMV_BURSATILIDAD = ('AL', 'ME', 'BA', 'MI', 'RC', 'NU')
-BMV_MERCADOS = ('L', 'G', 'D', 'F', 'E', 'M', 'X', 'V', 'J', 'B', 'T', 'I', 'W', ' ')
+BMV_CATALOGO_REFERENCIA = frozenset(('AN', 'AJ', '', 'VA'))
+BMV_BURSATILIDAD = frozenset(('AL', 'ME', 'BA', 'MI', 'RC', 'NU'))
+BMV_MERCADOS = frozenset(('L', 'G', 'D', 'F', 'E', 'M', 'X', 'V', 'J', 'B', 'T', 'I', 'W', ' '))
 
 
 #
@@ -62,9 +79,9 @@ BMV_MERCADOS = ('L', 'G', 'D', 'F', 'E', 'M', 'X', 'V', 'J', 'B', 'T', 'I', 'W',
 
 
 def parse_alfa(bytes_array: bytes):
-    '''Parses an array of bytes as a string as specified by BMV'''
+    '''Parses an array of bytes (or any buffer, like a memoryview) as a string as specified by BMV'''
     # All ALPHA fields are ISO 8859-1, left aligned and filled on the right with spaces.
-    return bytes_array.decode('iso-8859-1').rstrip()
+    return str(bytes_array, 'iso-8859-1').rstrip()
 
 
 def parse_bmv_timestamp1(bytes_array: bytes) -> datetime:
@@ -90,9 +107,43 @@ def parse_bmv_timestamp3(bytes_array: bytes) -> datetime:
     assert len(bytes_array) == 8, 'Only apply to arrays of 8 bytes'
     assert struct.calcsize(BMV_TIMESTAMP_FORMAT) == 8, 'Format length is 8 bytes'
     data = struct.unpack(BMV_TIMESTAMP_FORMAT, bytes_array)[0]
+    return bmv_timestamp3_to_datetime(data)  # Return date, time and seconds with milliseconds precision.
+
+
+def bmv_timestamp3_to_datetime(data: int) -> datetime:
+    '''Converts the already unpacked milliseconds of a timestamp of type 3 to a datetime'''
     timestamp = datetime.fromtimestamp(data // 1000)  # Eliminate 3 last digits that signify milliseconds
-    timestamp = timestamp.replace(microsecond=(data % 1000) * 1000)
-    return timestamp  # Return date, time and seconds with milliseconds precision.
+    return timestamp.replace(microsecond=(data % 1000) * 1000)
+
+
+#
+# Formatting of timestamps
+#
+# The parsed messages have their timestamps as iso strings. Timestamps are kept as the epoch milliseconds
+# of the wire, and the part up to the seconds is formatted once per second and cached, as all the messages
+# of a packet and most of the packets in a second share it.
+#
+
+
+@lru_cache(maxsize=4096)
+def format_bmv_seconds(seconds: int) -> str:
+    '''Returns the local time of epoch seconds in iso format, like datetime.fromtimestamp(seconds).isoformat()'''
+    return datetime.fromtimestamp(seconds).isoformat()
+
+
+def format_bmv_timestamp2(data: int) -> str:
+    '''Formats the milliseconds of a timestamp of type 1 or 2, without the milliseconds'''
+    return format_bmv_seconds(data // 1000)
+
+
+def format_bmv_timestamp3(data: int) -> str:
+    '''Formats the milliseconds of a timestamp of type 3, like isoformat(timespec='milliseconds')'''
+    return f'{format_bmv_seconds(data // 1000)}.{data % 1000:03d}'
+
+
+def format_bmv_key_date(data: int) -> str:
+    '''Returns the date of a timestamp of type 3 as used in the key of the messages, like strftime('%Y%m%d')'''
+    return format_bmv_seconds(data // 1000)[:10].replace('-', '')
 
 
 def parse_bmv_int8(bytes_array: bytes) -> int:
@@ -139,42 +190,346 @@ def parse_bmv_precio8(bytes_array: bytes) -> float:
     return precio / 100000000.0
 
 
+#
+# BMV message layouts
+#
+# Each layout lists the fields of a message as (name, tipo, size) in the order they come in the wire.
+# Layouts are compiled once into a single struct.Struct, so a whole message is decoded with one
+# unpack_from call, and then only the fields that are not plain integers get converted.
+# Fields named None are fillers and are skipped.
+#
+
+BMV_LAYOUT_FORMATS = {
+    'alfa': 's',
+    'bandera': 's',
+    'int8': BMV_INT8_FORMAT[1:],
+    'int16': BMV_INT16_FORMAT[1:],
+    'int32': BMV_INT32_FORMAT[1:],
+    'int64': BMV_INT64_FORMAT[1:],
+    'precio4': BMV_PRECIO4_FORMAT[1:],
+    'precio8': BMV_PRECIO8_FORMAT[1:],
+    'timestamp1': BMV_TIMESTAMP_FORMAT[1:],
+    'timestamp2': BMV_TIMESTAMP_FORMAT[1:],
+    'filler': 'x',
+}
+
+# Conversions applied after unpacking. Integer types are returned as unpacked.
+BMV_LAYOUT_CONVERSIONS = {
+    'alfa': parse_alfa,
+    'bandera': lambda value: parse_alfa(value) == '1',
+    'precio4': lambda value: value / 1000.0,
+    'precio8': lambda value: value / 100000000.0,
+    'timestamp1': format_bmv_timestamp2,
+    'timestamp2': format_bmv_timestamp2,
+}
+
+BmvLayout = namedtuple('BmvLayout', ['tipo_mensaje', 'fields', 'length', 'struct', 'names', 'conversions'])
+
+
+def compile_bmv_layout(tipo_mensaje: str, fields: tuple) -> BmvLayout:
+    '''Compiles a layout description into a single struct.Struct plus the conversions to apply to its values'''
+    struct_format = '>'
+    names = ['key']
+    conversions = []
+    for name, tipo, size in fields:
+        code = BMV_LAYOUT_FORMATS[tipo]
+        if code in ('s', 'x'):
+            struct_format += f'{size}{code}'
+        else:
+            assert struct.calcsize('>' + code) == size, f'{name} of type {tipo} can not have {size} bytes'
+            struct_format += code
+        if name is None:
+            continue
+        if tipo in BMV_LAYOUT_CONVERSIONS:
+            # Position 0 of the decoded values is always the 'key'
+            conversions.append((len(names), BMV_LAYOUT_CONVERSIONS[tipo]))
+        names.append(name)
+    compiled = struct.Struct(struct_format)
+    return BmvLayout(tipo_mensaje, fields, compiled.size, compiled, tuple(names), tuple(conversions))
+
+
+def decode_bmv_layout(layout: BmvLayout, buffer, offset: int = 0) -> dict:
+    '''Decodes a message that starts at offset in buffer using a compiled layout. Returns the fields in a dictionary'''
+    values = [None, *layout.struct.unpack_from(buffer, offset)]
+    for position, conversion in layout.conversions:
+        values[position] = conversion(values[position])
+    return dict(zip(layout.names, values))
+
+
+BMV_LAYOUT_MENSAJE_M = compile_bmv_layout('M', (
+    ('tipoMensaje', 'alfa', 1),
+    ('numeroInstrumento', 'int32', 4),
+    ('precioPromedioPonderado', 'precio8', 8),
+    ('volatilidad', 'precio8', 8),
+))
+
+BMV_LAYOUT_MENSAJE_H = compile_bmv_layout('H', (
+    ('tipoMensaje', 'alfa', 1),
+    ('numeroInstrumento', 'int32', 4),
+    ('folioHecho', 'int32', 4),
+))
+
+BMV_LAYOUT_MENSAJE_O = compile_bmv_layout('O', (
+    ('tipoMensaje', 'alfa', 1),
+    ('numeroInstrumento', 'int32', 4),
+    ('volumen', 'int32', 4),
+    ('precio', 'precio8', 8),
+    ('sentido', 'alfa', 1),
+    ('tipo', 'alfa', 1),
+))
+
+BMV_LAYOUT_MENSAJE_E = compile_bmv_layout('E', (
+    ('tipoMensaje', 'alfa', 1),
+    ('numeroInstrumento', 'int32', 4),
+    ('numeroOperaciones', 'int32', 4),
+    ('volumen', 'int64', 8),
+    ('importe', 'precio8', 8),
+    ('apertura', 'precio8', 8),
+    ('maximo', 'precio8', 8),
+    ('minimo', 'precio8', 8),
+    ('promedio', 'precio8', 8),
+    ('last', 'precio8', 8),
+))
+
+BMV_LAYOUT_MENSAJE_P = compile_bmv_layout('P', (
+    ('tipoMensaje', 'alfa', 1),
+    ('numeroInstrumento', 'int32', 4),
+    ('horaHecho', 'timestamp2', 8),
+    ('volumen', 'int32', 4),
+    ('precio', 'precio8', 8),
+    ('tipoConcertacion', 'alfa', 1),
+    ('folioHecho', 'int32', 4),
+    ('fijaPrecio', 'bandera', 1),
+    ('tipoOperacion', 'alfa', 1),
+    ('importe', 'precio8', 8),
+    ('compra', 'alfa', 5),
+    ('vende', 'alfa', 5),
+    ('liquidacion', 'alfa', 1),
+    ('indicadorSubasta', 'alfa', 1),
+))
+
+BMV_LAYOUT_CATALOGO_CA = compile_bmv_layout('ca', (
+    ('tipoMensaje', 'alfa', 2),
+    ('numeroInstrumento', 'int32', 4),
+    ('tipoValor', 'alfa', 2),
+    ('emisora', 'alfa', 7),
+    ('serie', 'alfa', 6),
+    ('ultimoPrecio', 'precio8', 8),
+    ('PPP', 'precio8', 8),
+    ('precioCierre', 'precio8', 8),
+    ('fechaReferencia', 'timestamp1', 8),
+    ('referencia', 'alfa', 2),
+    ('cuponVigente', 'int16', 2),
+    ('bursatilidad', 'alfa', 2),
+    ('bursatilidadNumerica', 'precio4', 4),
+    ('ISIN', 'alfa', 12),
+    ('mercado', 'alfa', 1),
+    ('valoresInscritos', 'int64', 8),
+    ('importeBloques', 'precio8', 8),
+    ('bolsaOrigen', 'alfa', 1),
+    (None, 'filler', 20),
+))
+
+BMV_LAYOUT_CATALOGO_CE = compile_bmv_layout('ce', (
+    ('tipoMensaje', 'alfa', 2),
+    ('numeroTrac', 'int32', 4),
+    ('nombreTrac', 'alfa', 8),
+    ('emisoraSubyascente', 'alfa', 7),
+    ('serieSubyacente', 'alfa', 6),
+    ('titulos', 'int64', 8),
+    ('titulosExcluidos', 'int64', 8),
+    ('precio', 'precio8', 8),
+    ('componenteEfectivo', 'precio8', 8),
+    ('valorExcluido', 'precio8', 8),
+    ('numeroCertificados', 'int64', 8),
+    ('precioTeorico', 'precio8', 8),
+    (None, 'filler', 20),
+))
+
+BMV_LAYOUT_CATALOGO_CC = compile_bmv_layout('cc', (
+    ('tipoMensaje', 'alfa', 2),
+    ('numeroInstrumento', 'int32', 4),
+    ('tipoValor', 'alfa', 2),
+    ('emisora', 'alfa', 7),
+    ('serie', 'alfa', 6),
+    ('tipoWarrant', 'alfa', 1),
+    ('fechaVencimiento', 'timestamp2', 8),
+    ('precioEjercicio', 'precio8', 8),
+    ('precioReferencia', 'precio8', 8),
+    ('fechaReferencia', 'timestamp2', 8),
+    ('referencia', 'alfa', 2),
+    ('ISIN', 'alfa', 12),
+    ('bolsaOrigen', 'alfa', 1),
+    (None, 'filler', 20),
+))
+
+BMV_LAYOUT_CATALOGO_CF = compile_bmv_layout('cf', (
+    ('tipoMensaje', 'alfa', 2),
+    ('numeroInstrumento', 'int32', 4),
+    ('tipoValor', 'alfa', 2),
+    ('emisora', 'alfa', 7),
+    ('serie', 'alfa', 6),
+    ('sector', 'alfa', 1),
+    ('subsector', 'alfa', 1),
+    ('ramo', 'alfa', 1),
+    ('subramo', 'alfa', 1),
+    ('operadora', 'alfa', 10),
+    ('precioReferencia', 'precio8', 8),
+    ('fechaReferencia', 'timestamp1', 8),
+    ('referencia', 'alfa', 2),
+    ('ISIN', 'alfa', 12),
+    ('calificacion', 'alfa', 15),
+    (None, 'filler', 20),
+))
+
+BMV_LAYOUT_CATALOGO_CB = compile_bmv_layout('cb', (
+    ('tipoMensaje', 'alfa', 2),
+    ('numeroInstrumento', 'int32', 4),
+    ('tipoValor', 'alfa', 2),
+    ('emisora', 'alfa', 7),
+    ('emision', 'alfa', 6),
+    ('fechaEmision', 'timestamp1', 8),
+    ('fechaVencimiento', 'timestamp1', 8),
+    ('precioOtasaReferencia', 'precio8', 8),
+    ('fechaReferencia', 'timestamp1', 8),
+    ('referencia', 'alfa', 2),
+    ('diasPlazo', 'int16', 2),
+    ('cuponOperiodo', 'int16', 2),
+    ('ISIN', 'alfa', 12),
+    ('mercado', 'alfa', 1),
+    ('valorNominalActual', 'precio8', 8),
+    ('valorNominalOriginal', 'precio8', 8),
+    ('accionesEnCirculacion', 'int64', 8),
+    ('montoColocado', 'int64', 8),
+    ('operaTasaPrecio', 'alfa', 1),
+    ('bolsaOrigen', 'alfa', 1),
+    (None, 'filler', 20),
+))
+
+BMV_LAYOUT_CATALOGO_CY = compile_bmv_layout('cy', (
+    ('tipoMensaje', 'alfa', 2),
+    ('numeroInstrumento', 'int32', 4),
+    ('emisora', 'alfa', 7),
+    ('serie', 'alfa', 6),
+    ('tipoValor', 'alfa', 2),
+    ('emisoraSubyacente', 'alfa', 7),
+    ('serieSubyacente', 'alfa', 6),
+    ('tipoValorSubyacente', 'alfa', 2),
+    ('numeroValoresInscritos', 'int64', 8),
+    ('bolsaOrigen', 'alfa', 1),
+    (None, 'filler', 20),
+))
+
+BMV_LAYOUT_CATALOGO_CD = compile_bmv_layout('cd', (
+    ('tipoMensaje', 'alfa', 2),
+    ('numeroInstrumento', 'int32', 4),
+    ('tipoValor', 'alfa', 2),
+    ('clase', 'alfa', 7),
+    ('vencimiento', 'alfa', 6),
+    ('tipoOpcion', 'alfa', 1),
+    ('precioEjercicio', 'precio8', 8),
+    ('puja', 'precio8', 8),
+    ('precioLiquidacionDiaAnterior', 'precio8', 8),
+    ('ultimaFechaOperacion', 'timestamp1', 8),
+    ('fechaVencimiento', 'timestamp1', 8),
+    ('contratosAbiertos', 'int32', 4),
+    ('tamanoContrato', 'int32', 4),
+    ('codigoProducto', 'alfa', 12),
+    ('vencimientoDiario', 'alfa', 1),
+    ('clavePrecioEjercicio', 'alfa', 6),
+    ('codigoCFI', 'alfa', 6),
+    (None, 'filler', 20),
+))
+
+BMV_LAYOUT_CATALOGO_CG = compile_bmv_layout('cg', (
+    ('tipoMensaje', 'alfa', 2),
+    ('numeroInstrumento', 'int32', 4),
+    ('tipoValor', 'alfa', 2),
+    ('clase', 'alfa', 7),
+    ('vencimiento', 'alfa', 6),
+    ('tipoEstrategia', 'alfa', 1),
+    ('puja', 'precio8', 8),
+    ('ultimaFechaOperacion', 'timestamp1', 8),
+    ('fechaVencimiento', 'timestamp1', 8),
+    ('identificadorPataCorta', 'int32', 4),
+    ('identificadorPataLarga', 'int32', 4),
+    ('periodicidad', 'int8', 1),
+    ('numeroVencimientos', 'int8', 1),
+    (None, 'filler', 20),
+))
+
+# All the layouts, by grupo_market_data and then by tipoMensaje.
+BMV_LAYOUTS = {
+    18: {layout.tipo_mensaje: layout for layout in (
+        BMV_LAYOUT_MENSAJE_P, BMV_LAYOUT_MENSAJE_E, BMV_LAYOUT_MENSAJE_H, BMV_LAYOUT_MENSAJE_O, BMV_LAYOUT_MENSAJE_M)},
+    40: {layout.tipo_mensaje: layout for layout in (
+        BMV_LAYOUT_CATALOGO_CA, BMV_LAYOUT_CATALOGO_CB, BMV_LAYOUT_CATALOGO_CC, BMV_LAYOUT_CATALOGO_CD,
+        BMV_LAYOUT_CATALOGO_CE, BMV_LAYOUT_CATALOGO_CF, BMV_LAYOUT_CATALOGO_CG, BMV_LAYOUT_CATALOGO_CY)},
+}
+# How many bytes of the message make its tipoMensaje, by grupo_market_data.
+BMV_TIPO_MENSAJE_SIZES = {18: 1, 40: 2}
+# The tipoMensaje of both grupos don't overlap, so we can also find the layouts only by tipoMensaje.
+BMV_LAYOUTS_BY_TIPO = {tipo_mensaje: layout for layouts in BMV_LAYOUTS.values() for tipo_mensaje, layout in layouts.items()}
+# Raw tipoMensaje of the messages that have the numeroInstrumento (int32) right after the tipoMensaje.
+# A set, as register_bmv_parser adds the ones registered with con_instrumento.
+BMV_TIPOS_CON_INSTRUMENTO = {tipo_mensaje.encode('iso-8859-1') for tipo_mensaje, layout in BMV_LAYOUTS_BY_TIPO.items()
+                             if layout.fields[1][:2] == ('numeroInstrumento', 'int32')}
+BMV_INSTRUMENTO_STRUCT = struct.Struct(BMV_INT32_FORMAT)
+# Fields that parse_bmv_udp_packet adds to every message from its packet, as (name, tipo) like in the layouts.
+# 'timestamp' is when the message was parsed, not something that came from BMV.
+BMV_MESSAGE_FIELDS = (
+    ('key', 'alfa'),
+    ('fechaHora', 'timestamp3'),
+    ('timestamp', 'timestamp'),
+    ('longitud', 'int16'),
+)
+
+
 #
 # Utility assert functions
 #
+# How much of the fields are checked after parsing them:
+#   strict: every message, for certification runs.
+#   sampled: the messages of 1 in every sample_every packets, for production.
+#   off: none, for bulk backfills.
+# The length and type of the messages are always checked, as the decoding depends on them.
+BMV_VALIDATION_LEVELS = ('strict', 'sampled', 'off')
+BMV_VALIDATION_SAMPLE_EVERY = 1000
+
+
+# The values are already ints and floats from the layouts, so they are compared as they are.
 
 
 def assert_nonzero_float(source, field):
-    assert float(source[field]) >= 0.0, f"{field} {source['field']} must be >= 0.0"
+    assert source[field] >= 0.0, f"{field} {source[field]} must be >= 0.0"
 
 
 def assert_positive_integer(source, field):
-    assert int(source[field]) > 0, f"{field} {source['field']} must be a positive integer."
+    assert source[field] > 0, f"{field} {source[field]} must be a positive integer."
 
 
 def assert_in_catalog(source, field, catalog):
-    assert source[field] in catalog, f"{field} {source['field']} unknown in the catalog."
+    assert source[field] in catalog, f"{field} {source[field]} unknown in the catalog."
 
 
 def assert_is_valid_price(source, field):
-    assert float(source[field]) >= 0.0, f"{field} must be >= 0.0 to be a valid price."
+    assert source[field] >= 0.0, f"{field} must be >= 0.0 to be a valid price."
 
 
 def check_message_type(bytes_array, expected_type, expected_length):
     '''message type checks JUST THE FIRST byte to figure out the type of the message'''
     assert len(bytes_array) == expected_length, f'{expected_type} has length ${len(bytes_array)} but must have {expected_length} '
-    tipo_mensaje = parse_alfa(bytes_array[:1])
-    assert tipo_mensaje == expected_type, f'This parsing only works for mensaje {expected_type}'
-    print(f'Message type is {tipo_mensaje}')
-    return tipo_mensaje
+    # Compared as bytes, usually the dispatch in parse_by_message_type already did it, so it has to be cheap.
+    assert bytes_array[0] == ord(expected_type), f'This parsing only works for mensaje {expected_type}'
+    return expected_type
 
 
 def check_catalog_type(bytes_array, expected_type, expected_length):
     '''catalog type checks the first two bytes to figure out the type of the message'''
     assert len(bytes_array) == expected_length, f'{expected_type} has length ${len(bytes_array)} but must have {expected_length} '
-    tipo_mensaje = parse_alfa(bytes_array[:2])
-    assert tipo_mensaje == expected_type, f'This parsing only works for catalogo {expected_type}'
-    return tipo_mensaje
+    assert bytes_array[0] == ord(expected_type[0]) and bytes_array[1] == ord(expected_type[1]), \
+        f'This parsing only works for catalogo {expected_type}'
+    return expected_type
 
 
 #
@@ -182,108 +537,74 @@ def check_catalog_type(bytes_array, expected_type, expected_length):
 #
 
 
-def parse_bmv_mensaje_M(bytes_array: bytes) -> dict:
+def parse_bmv_mensaje_M(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 21 bytes as a 'mensaje M' as specified by BMV'''
-    tipo_mensaje = check_message_type(bytes_array, 'M', 9)
-    msg_M = {'key': None, 'tipoMensaje': tipo_mensaje,
-             'numeroInstrumento': parse_bmv_int32(bytes_array[1:5]),
-             'precioPromedioPonderado': parse_bmv_precio8(bytes_array[5:13]),
-             'volatilidad': parse_bmv_precio8(bytes_array[13:21])
-             }
-    assert_positive_integer(msg_M, 'numeroInstrumento')
-    assert_is_valid_price(msg_M, 'precioPromedioPonderado')
-    assert_nonzero_float(msg_M, 'volatilidad')
-    # Done with checks
+    check_message_type(bytes_array, 'M', 21)
+    msg_M = decode_bmv_layout(BMV_LAYOUT_MENSAJE_M, bytes_array)
+    if validate:
+        assert_positive_integer(msg_M, 'numeroInstrumento')
+        assert_is_valid_price(msg_M, 'precioPromedioPonderado')
+        assert_nonzero_float(msg_M, 'volatilidad')
+        # Done with checks
     return msg_M
 
 
-def parse_bmv_mensaje_H(bytes_array: bytes) -> dict:
+def parse_bmv_mensaje_H(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 9 bytes as a 'Mensaje H' as specified by BMV'''
-    tipo_mensaje = check_message_type(bytes_array, 'H', 9)
-    msg_H = {'key': None, 'tipoMensaje': tipo_mensaje,
-             'numeroInstrumento': parse_bmv_int32(bytes_array[1:5]),
-             'folioHecho': parse_bmv_int32(bytes_array[5:9]),
-             }
-    assert_positive_integer(msg_H, 'numeroInstrumento')
-    assert_positive_integer(msg_H, 'folioHecho')
+    check_message_type(bytes_array, 'H', 9)
+    msg_H = decode_bmv_layout(BMV_LAYOUT_MENSAJE_H, bytes_array)
+    if validate:
+        assert_positive_integer(msg_H, 'numeroInstrumento')
+        assert_positive_integer(msg_H, 'folioHecho')
     return msg_H
 
 
-def parse_bmv_mensaje_O(bytes_array: bytes) -> dict:
+def parse_bmv_mensaje_O(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 19 bytes as a 'Mensaje O' as specified by BMV'''
-    tipo_mensaje = check_message_type(bytes_array, 'O', 19)
-    msg_O = {'key': None, 'tipoMensaje': tipo_mensaje,
-             'numeroInstrumento': parse_bmv_int32(bytes_array[1:5]),
-             'volumen': parse_bmv_int32(bytes_array[5:9]),
-             'precio': parse_bmv_precio8(bytes_array[9:17]),
-             'sentido': parse_alfa(bytes_array[17:18]),
-             'tipo': parse_alfa(bytes_array[18:19])
-             }
-    assert_positive_integer(msg_O, 'numeroInstrumento')
-    assert_positive_integer(msg_O, 'volumen')
-    assert_is_valid_price(msg_O, 'precio')
-    BMV_SENTIDO_OPERACION = ('C', 'V')
-    BMV_TIPO_OPERACION_MSG_O = ('C', 'H', 'P', 'N')
-    assert_in_catalog(msg_O, 'sentido', BMV_SENTIDO_OPERACION)
-    assert_in_catalog(msg_O, 'tipo', BMV_TIPO_OPERACION_MSG_O)
+    check_message_type(bytes_array, 'O', 19)
+    msg_O = decode_bmv_layout(BMV_LAYOUT_MENSAJE_O, bytes_array)
+    if validate:
+        assert_positive_integer(msg_O, 'numeroInstrumento')
+        assert_positive_integer(msg_O, 'volumen')
+        assert_is_valid_price(msg_O, 'precio')
+        assert_in_catalog(msg_O, 'sentido', BMV_SENTIDO_OPERACION)
+        assert_in_catalog(msg_O, 'tipo', BMV_TIPO_OPERACION_MSG_O)
     return msg_O
 
-def parse_bmv_mensaje_E(bytes_array: bytes) -> dict:
+def parse_bmv_mensaje_E(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 65 bytes as a 'Mensaje E' as specified by BMV'''
-    tipo_mensaje = check_message_type(bytes_array, 'E', 65)
-    msg_E = {'key': None, 'tipoMensaje': tipo_mensaje,
-             'numeroInstrumento': parse_bmv_int32(bytes_array[1:5]),
-             'numeroOperaciones': parse_bmv_int32(bytes_array[5:9]),
-             'volumen': parse_bmv_int64(bytes_array[9:17]),
-             'importe': parse_bmv_precio8(bytes_array[17:25]),
-             'apertura': parse_bmv_precio8(bytes_array[25:33]),
-             'maximo': parse_bmv_precio8(bytes_array[33:41]),
-             'minimo': parse_bmv_precio8(bytes_array[41:49]),
-             'promedio': parse_bmv_precio8(bytes_array[49:57]),
-             'last': parse_bmv_precio8(bytes_array[57:65])
-             }
-    assert_positive_integer(msg_E, 'numeroInstrumento')
-    assert_positive_integer(msg_E, 'numeroOperaciones')
-    assert_positive_integer(msg_E, 'volumen')
-    assert_is_valid_price(msg_E, 'importe')
-    assert_is_valid_price(msg_E, 'apertura')
-    assert_is_valid_price(msg_E, 'maximo')
-    assert_is_valid_price(msg_E, 'minimo')
-    assert_is_valid_price(msg_E, 'promedio')
-    assert_is_valid_price(msg_E, 'last')
+    check_message_type(bytes_array, 'E', 65)
+    msg_E = decode_bmv_layout(BMV_LAYOUT_MENSAJE_E, bytes_array)
+    if validate:
+        assert_positive_integer(msg_E, 'numeroInstrumento')
+        assert_positive_integer(msg_E, 'numeroOperaciones')
+        assert_positive_integer(msg_E, 'volumen')
+        assert_is_valid_price(msg_E, 'importe')
+        assert_is_valid_price(msg_E, 'apertura')
+        assert_is_valid_price(msg_E, 'maximo')
+        assert_is_valid_price(msg_E, 'minimo')
+        assert_is_valid_price(msg_E, 'promedio')
+        assert_is_valid_price(msg_E, 'last')
     return msg_E
 
 
 
-def parse_bmv_mensaje_P(bytes_array: bytes) -> dict:
+def parse_bmv_mensaje_P(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 52 bytes as a 'Mensaje P' as specified by BMV'''
-    tipo_mensaje = check_message_type(bytes_array, 'P', 52)
-    msg_P = {'key': None, 'tipoMensaje': tipo_mensaje,
-             'numeroInstrumento': parse_bmv_int32(bytes_array[1:5]),
-             'horaHecho': parse_bmv_timestamp2(bytes_array[5:13]).isoformat(),
-             'volumen': parse_bmv_int32(bytes_array[13:17]),
-             'precio': parse_bmv_precio8(bytes_array[17:25]),
-             'tipoConcertacion': parse_alfa(bytes_array[25:26]),
-             'folioHecho': parse_bmv_int32(bytes_array[26:30]),
-             'fijaPrecio': parse_alfa(bytes_array[30:31]) == '1',
-             'tipoOperacion': parse_alfa(bytes_array[31:32]),
-             'importe': parse_bmv_precio8(bytes_array[32:40]),
-             'compra': parse_alfa(bytes_array[40:45]),
-             'vende': parse_alfa(bytes_array[45:50]),
-             'liquidacion': parse_alfa(bytes_array[50:51]),
-             'indicadorSubasta': parse_alfa(bytes_array[51:52])
-             }
-    assert_positive_integer(msg_P, 'numeroInstrumento')
-    assert_positive_integer(msg_P, 'volumen')
-    assert_is_valid_price(msg_P, 'precio')
-    assert_in_catalog(msg_P, 'tipoConcertacion', BMV_TIPOS_CONCERTACION)
-    assert_positive_integer(msg_P, 'folioHecho')
-    assert_in_catalog(msg_P, 'tipoOperacion', BMV_TIPOS_OPERACION)
-    # X es nuevo
-    assert_nonzero_float(msg_P, 'importe')
-    assert_in_catalog(msg_P, 'liquidacion', BMV_TIPOS_LIQUIDACION)
-    assert_in_catalog(msg_P, 'indicadorSubasta', BMV_INDICADORES_SUBASTA) 
-    # '' es nuevo.
+    check_message_type(bytes_array, 'P', 52)
+    msg_P = decode_bmv_layout(BMV_LAYOUT_MENSAJE_P, bytes_array)
+    if validate:
+        assert_positive_integer(msg_P, 'numeroInstrumento')
+        assert_positive_integer(msg_P, 'volumen')
+        assert_is_valid_price(msg_P, 'precio')
+        assert_in_catalog(msg_P, 'tipoConcertacion', BMV_TIPOS_CONCERTACION)
+        assert_positive_integer(msg_P, 'folioHecho')
+        assert_in_catalog(msg_P, 'tipoOperacion', BMV_TIPOS_OPERACION)
+        # X es nuevo
+        assert_nonzero_float(msg_P, 'importe')
+        assert_in_catalog(msg_P, 'liquidacion', BMV_TIPOS_LIQUIDACION)
+        assert_in_catalog(msg_P, 'indicadorSubasta', BMV_INDICADORES_SUBASTA)
+        # '' es nuevo.
     return msg_P
 
 
@@ -292,343 +613,368 @@ def parse_bmv_mensaje_P(bytes_array: bytes) -> dict:
 #
 
 
-def parse_bmv_catalogo_ca(bytes_array: bytes) -> dict:
+def parse_bmv_catalogo_ca(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 113 bytes as a 'catalogo ca' as specified by BMV'''
-    tipo_mensaje = check_catalog_type(bytes_array, 'ca', 113)
-    cat_ca = {'key': None, 'tipoMensaje': tipo_mensaje,
-             'numeroInstrumento': parse_bmv_int32(bytes_array[2:6]),
-             'tipoValor': parse_alfa(bytes_array[6:8]),
-             'emisora': parse_alfa(bytes_array[8:15]),
-             'serie': parse_alfa(bytes_array[15:21]),
-             'ultimoPrecio': parse_bmv_precio8(bytes_array[21:29]),
-             'PPP': parse_bmv_precio8(bytes_array[29:37]),
-             'precioCierre': parse_bmv_precio8(bytes_array[37:45]),
-             'fechaReferencia': parse_bmv_timestamp1(bytes_array[45:53]).isoformat(),
-             'referencia': parse_alfa(bytes_array[53:55]),
-             'cuponVigente': parse_bmv_int16(bytes_array[55:57]),
-             'bursatilidad': parse_alfa(bytes_array[57:59]),
-             'bursatilidadNumerica': parse_bmv_precio4(bytes_array[59:63]),
-             'ISIN': parse_alfa(bytes_array[63:75]),
-             'mercado': parse_alfa(bytes_array[75:76]),
-             'valoresInscritos': parse_bmv_int64(bytes_array[76:84]),
-             'importeBloques': parse_bmv_precio8(bytes_array[84:92]),
-             'bolsaOrigen': parse_alfa(bytes_array[92:93]),
-             # There's a filler of 20 bytes, from 93 to 113 that we ignore.
-             }
-    assert_positive_integer(cat_ca, 'numeroInstrumento')
-    assert_in_catalog(cat_ca,'tipoValor', BMV_TIPOS_VALOR)
-    assert_is_valid_price(cat_ca, 'ultimoPrecio')
-    assert_is_valid_price(cat_ca, 'PPP')
-    assert_is_valid_price(cat_ca, 'precioCierre')
-    # assert cat_ca['fechaReferencia'] is True, 'ToDo'
-    assert_in_catalog(cat_ca,'referencia', BMV_CATALOGO_REFERENCIA)
-    assert_positive_integer(cat_ca, 'cuponVigente')
-    assert_in_catalog(cat_ca,'bursatilidad', BMV_BURSATILIDAD)
-    assert_nonzero_float(cat_ca, 'bursatilidadNumerica')
-    assert_in_catalog(cat_ca,'mercado', BMV_MERCADOS)
-    assert_positive_integer(cat_ca, 'valoresInscritos')
-    assert_nonzero_float(cat_ca, 'importeBloques')
-    assert cat_ca['bolsaOrigen'] != None, 'La Bolsa origen debe estar definida.'
-    assert_in_catalog(cat_ca,'bolsaOrigen', BMV_BOLSA_ORIGEN)
+    check_catalog_type(bytes_array, 'ca', 113)
+    cat_ca = decode_bmv_layout(BMV_LAYOUT_CATALOGO_CA, bytes_array)
+    if validate:
+        assert_positive_integer(cat_ca, 'numeroInstrumento')
+        assert_in_catalog(cat_ca,'tipoValor', BMV_TIPOS_VALOR)
+        assert_is_valid_price(cat_ca, 'ultimoPrecio')
+        assert_is_valid_price(cat_ca, 'PPP')
+        assert_is_valid_price(cat_ca, 'precioCierre')
+        # assert cat_ca['fechaReferencia'] is True, 'ToDo'
+        assert_in_catalog(cat_ca,'referencia', BMV_CATALOGO_REFERENCIA)
+        assert_positive_integer(cat_ca, 'cuponVigente')
+        assert_in_catalog(cat_ca,'bursatilidad', BMV_BURSATILIDAD)
+        assert_nonzero_float(cat_ca, 'bursatilidadNumerica')
+        assert_in_catalog(cat_ca,'mercado', BMV_MERCADOS)
+        assert_positive_integer(cat_ca, 'valoresInscritos')
+        assert_nonzero_float(cat_ca, 'importeBloques')
+        assert cat_ca['bolsaOrigen'] != None, 'La Bolsa origen debe estar definida.'
+        assert_in_catalog(cat_ca,'bolsaOrigen', BMV_BOLSA_ORIGEN)
     return cat_ca
 
 
-def parse_bmv_catalogo_ce(bytes_array:bytes) -> dict:
+def parse_bmv_catalogo_ce(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 103 bytes as a 'catalogo ce' as specified by BMV'''
-    tipo_mensaje = check_catalog_type(bytes_array, 'ce', 103)
-    cat_ce = {'key': None, 'tipoMensaje': tipo_mensaje,
-              'numeroTrac': parse_bmv_int32(bytes_array[2:6]),
-              'nombreTrac': parse_alfa(bytes_array[6:14]),
-              'emisoraSubyascente': parse_alfa(bytes_array[14:21]),
-              'serieSubyacente': parse_alfa(bytes_array[21:27]),
-              'titulos': parse_bmv_int64(bytes_array[27:35]),
-              'titulosExcluidos': parse_bmv_int64(bytes_array[35:43]),
-              'precio': parse_bmv_precio8(bytes_array[43:51]),
-              'componenteEfectivo': parse_bmv_precio8(bytes_array[51:59]),
-              'valorExcluido': parse_bmv_precio8(bytes_array[59:67]),
-              'numeroCertificados': parse_bmv_int64(bytes_array[67:75]),
-              'precioTeorico': parse_bmv_precio8(bytes_array[75:83]),
-    }
-    assert_positive_integer(cat_ce, 'numeroTrac')
-    assert_is_valid_price(cat_ce, 'titulos')
-    assert_is_valid_price(cat_ce, 'titulosExcluidos')
-    assert_is_valid_price(cat_ce, 'precio')
-    assert_is_valid_price(cat_ce, 'componenteEfectivo')
-    assert_is_valid_price(cat_ce, 'valorExcluido')
-    assert_positive_integer(cat_ce, 'numeroCertificados')
-    assert_is_valid_price(cat_ce, 'precioTeorico')
+    check_catalog_type(bytes_array, 'ce', 103)
+    cat_ce = decode_bmv_layout(BMV_LAYOUT_CATALOGO_CE, bytes_array)
+    if validate:
+        assert_positive_integer(cat_ce, 'numeroTrac')
+        assert_is_valid_price(cat_ce, 'titulos')
+        assert_is_valid_price(cat_ce, 'titulosExcluidos')
+        assert_is_valid_price(cat_ce, 'precio')
+        assert_is_valid_price(cat_ce, 'componenteEfectivo')
+        assert_is_valid_price(cat_ce, 'valorExcluido')
+        assert_positive_integer(cat_ce, 'numeroCertificados')
+        assert_is_valid_price(cat_ce, 'precioTeorico')
     return cat_ce
               
               
               
 
-def parse_bmv_catalogo_cc(bytes_array:bytes) -> dict:
+def parse_bmv_catalogo_cc(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 89 bytes as a 'catalogo cc' as specified by BMV'''
-    tipo_mensaje = check_catalog_type(bytes_array, 'cc', 89)
-    cat_cc = {'key': None, 'tipoMensaje': tipo_mensaje,
-            'numeroInstrumento': parse_bmv_int32(bytes_array[2:6]),
-            'tipoValor': parse_alfa(bytes_array[6:8]),
-            'emisora': parse_alfa(bytes_array[8:15]),
-            'serie': parse_alfa(bytes_array[15:21]),
-            'tipoWarrant': parse_alfa(bytes_array[21:22]),
-            'fechaVencimiento': parse_bmv_timestamp2(bytes_array[22:30]).isoformat(),
-            'precioEjercicio': parse_bmv_precio8(bytes_array[30:38]),
-            'precioReferencia': parse_bmv_precio8(bytes_array[38:46]),
-            'fechaReferencia': parse_bmv_timestamp2(bytes_array[46:54]).isoformat(),
-            'referencia': parse_alfa(bytes_array[54:56]),
-            'ISIN': parse_alfa(bytes_array[56:68]),
-            'bolsaOrigen': parse_alfa(bytes_array[68:69]),
-            # There's a filler of 20 bytes, from 69 to 89 that we ignore.
-    }
-    assert_positive_integer(cat_cc, 'numeroInstrumento')
-    assert_in_catalog(cat_cc,'tipoValor', BMV_TIPOS_VALOR)
-    assert_in_catalog(cat_cc,'tipoWarrant', BMV_TIPOS_WARRANT)
-    assert_is_valid_price(cat_cc, 'precioEjercicio')
-    assert_is_valid_price(cat_cc, 'precioReferencia')
-    assert_in_catalog(cat_cc,'bolsaOrigen', BMV_TIPOS_BOLSA_ORIGEN)
+    check_catalog_type(bytes_array, 'cc', 89)
+    cat_cc = decode_bmv_layout(BMV_LAYOUT_CATALOGO_CC, bytes_array)
+    if validate:
+        assert_positive_integer(cat_cc, 'numeroInstrumento')
+        assert_in_catalog(cat_cc,'tipoValor', BMV_TIPOS_VALOR)
+        assert_in_catalog(cat_cc,'tipoWarrant', BMV_TIPOS_WARRANT)
+        assert_is_valid_price(cat_cc, 'precioEjercicio')
+        assert_is_valid_price(cat_cc, 'precioReferencia')
+        assert_in_catalog(cat_cc,'bolsaOrigen', BMV_TIPOS_BOLSA_ORIGEN)
     return cat_cc
 
 
-def parse_bmv_catalogo_cf(bytes_array:bytes) -> dict:
+def parse_bmv_catalogo_cf(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 100 bytes as a 'catalogo cf' as specified by BMV'''
-    tipo_mensaje = check_catalog_type(bytes_array, 'cf', 100)
-    cat_cf = {'key': None, 'tipoMensaje': tipo_mensaje,
-              'numeroInstrumento': parse_bmv_int32(bytes_array[2:6]),
-              'tipoValor': parse_alfa(bytes_array[6:8]),
-              'emisora': parse_alfa(bytes_array[8:15]),
-              'serie': parse_alfa(bytes_array[15:21]),
-              'sector': parse_alfa(bytes_array[21:22]),
-              'subsector': parse_alfa(bytes_array[22:23]),
-              'ramo': parse_alfa(bytes_array[23:24]),
-              'subramo': parse_alfa(bytes_array[24:25]),
-              'operadora': parse_alfa(bytes_array[25:35]),
-              'precioReferencia': parse_bmv_precio8(bytes_array[35:43]),
-              'fechaReferencia': parse_bmv_timestamp1(bytes_array[43:51]).isoformat(),
-              'referencia': parse_alfa(bytes_array[51:53]),
-              'ISIN': parse_alfa(bytes_array[53:65]),
-              'calificacion': parse_alfa(bytes_array[65:80]),
-              # FIlling of 20 from 80 to 100
-    }
-    assert_positive_integer(cat_cf, 'numeroInstrumento')
-    assert_in_catalog(cat_cf,'tipoValor', BMV_TIPOS_VALOR)
-    assert_is_valid_price(cat_cf, 'precioReferencia')
+    check_catalog_type(bytes_array, 'cf', 100)
+    cat_cf = decode_bmv_layout(BMV_LAYOUT_CATALOGO_CF, bytes_array)
+    if validate:
+        assert_positive_integer(cat_cf, 'numeroInstrumento')
+        assert_in_catalog(cat_cf,'tipoValor', BMV_TIPOS_VALOR)
+        assert_is_valid_price(cat_cf, 'precioReferencia')
     return cat_cf
     
     
 
-def parse_bmv_catalogo_cb(bytes_array:bytes) -> dict:
+def parse_bmv_catalogo_cb(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 126 bytes as a 'catalogo cb' as specified by BMV'''
-    tipo_mensaje = check_catalog_type(bytes_array, 'cb', 126)
-    cat_cb = {'key': None, 'tipoMensaje': tipo_mensaje,
-              'numeroInstrumento': parse_bmv_int32(bytes_array[2:6]),
-              'tipoValor': parse_alfa(bytes_array[6:8]),
-              'emisora': parse_alfa(bytes_array[8:15]),
-              'emision': parse_alfa(bytes_array[15:21]),
-              'fechaEmision': parse_bmv_timestamp1(bytes_array[21:29]).isoformat(),
-              'fechaVencimiento': parse_bmv_timestamp1(bytes_array[29:37]).isoformat(),
-              'precioOtasaReferencia': parse_bmv_precio8(bytes_array[37:45]),
-              'fechaReferencia': parse_bmv_timestamp1(bytes_array[45:53]).isoformat(),
-              'referencia': parse_alfa(bytes_array[53:55]),
-              'diasPlazo': parse_bmv_int16(bytes_array[55:57]),
-              'cuponOperiodo': parse_bmv_int16(bytes_array[57:59]),
-              'ISIN': parse_alfa(bytes_array[59:71]),
-              'mercado': parse_alfa(bytes_array[71:72]),
-              'valorNominalActual': parse_bmv_precio8(bytes_array[72:80]),
-              'valorNominalOriginal': parse_bmv_precio8(bytes_array[80:88]),
-              'accionesEnCirculacion': parse_bmv_int64(bytes_array[88:96]),
-              'montoColocado': parse_bmv_int64(bytes_array[96:104]),
-              'operaTasaPrecio': parse_alfa(bytes_array[104:105]),
-              'bolsaOrigen': parse_alfa(bytes_array[105:106]),
-              # Filler of 20 from 106 to 126
-    }
-    assert_positive_integer(cat_cb, 'numeroInstrumento')
-    assert_in_catalog(cat_cb,'tipoValor', BMV_TIPOS_VALOR)
-    assert_is_valid_price(cat_cb, 'precioOtasaReferencia')
-    assert_is_valid_price(cat_cb, 'valorNominalActual')
-    assert_is_valid_price(cat_cb, 'valorNominalOriginal')
-    assert_positive_integer(cat_cb, 'accionesEnCirculacion')
-    assert_positive_integer(cat_cb, 'montoColocado')
-    assert_in_catalog(cat_cb,'operaTasaPrecio', BMV_TIPOS_OPERA_TASA_PRECIO)
-    assert_in_catalog(cat_cb,'bolsaOrigen', BMV_TIPOS_BOLSA_ORIGEN)
+    check_catalog_type(bytes_array, 'cb', 126)
+    cat_cb = decode_bmv_layout(BMV_LAYOUT_CATALOGO_CB, bytes_array)
+    if validate:
+        assert_positive_integer(cat_cb, 'numeroInstrumento')
+        assert_in_catalog(cat_cb,'tipoValor', BMV_TIPOS_VALOR)
+        assert_is_valid_price(cat_cb, 'precioOtasaReferencia')
+        assert_is_valid_price(cat_cb, 'valorNominalActual')
+        assert_is_valid_price(cat_cb, 'valorNominalOriginal')
+        assert_positive_integer(cat_cb, 'accionesEnCirculacion')
+        assert_positive_integer(cat_cb, 'montoColocado')
+        assert_in_catalog(cat_cb,'operaTasaPrecio', BMV_TIPOS_OPERA_TASA_PRECIO)
+        assert_in_catalog(cat_cb,'bolsaOrigen', BMV_TIPOS_BOLSA_ORIGEN)
     return cat_cb
            
     
-def parse_bmv_catalogo_cy(bytes_array:bytes) -> dict:
+def parse_bmv_catalogo_cy(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 65 bytes as a 'catalogo cy' as specified by BMV'''
-    tipo_mensaje = check_catalog_type(bytes_array, 'cy', 65)
-    cat_cy = {'key': None, 'tipoMensaje': tipo_mensaje,
-              'numeroInstrumento': parse_bmv_int32(bytes_array[2:6]),
-              'emisora': parse_alfa(bytes_array[6:13]),
-              'serie': parse_alfa(bytes_array[13:19]),
-              'tipoValor': parse_alfa(bytes_array[19:21]),
-              'emisoraSubyacente': parse_alfa(bytes_array[21:28]),
-              'serieSubyacente': parse_alfa(bytes_array[28:34]),
-              'tipoValorSubyacente': parse_alfa(bytes_array[34:36]),
-              'numeroValoresInscritos': parse_bmv_int64(bytes_array[36:44]),
-              'bolsaOrigen': parse_alfa(bytes_array[44:45]),
-              # Filler of 20 from 45 to 65
-    }
-    assert_positive_integer(cat_cy, 'numeroInstrumento')
-    assert_in_catalog(cat_cy,'tipoValor', BMV_TIPOS_VALOR)
-    assert_in_catalog(cat_cy,'tipoValorSubyacente', BMV_TIPOS_VALOR)
-    assert_positive_integer(cat_cy, 'numeroValoresInscritos')
-    assert_in_catalog(cat_cy,'bolsaOrigen', BMV_TIPOS_BOLSA_ORIGEN)
+    check_catalog_type(bytes_array, 'cy', 65)
+    cat_cy = decode_bmv_layout(BMV_LAYOUT_CATALOGO_CY, bytes_array)
+    if validate:
+        assert_positive_integer(cat_cy, 'numeroInstrumento')
+        assert_in_catalog(cat_cy,'tipoValor', BMV_TIPOS_VALOR)
+        assert_in_catalog(cat_cy,'tipoValorSubyacente', BMV_TIPOS_VALOR)
+        assert_positive_integer(cat_cy, 'numeroValoresInscritos')
+        assert_in_catalog(cat_cy,'bolsaOrigen', BMV_TIPOS_BOLSA_ORIGEN)
     return cat_cy
            
     
-def parse_bmv_catalogo_cd(bytes_array:bytes) -> dict:
+def parse_bmv_catalogo_cd(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 115 bytes as a 'catalogo cd' as specified by BMV'''
-    tipo_mensaje = check_catalog_type(bytes_array, 'cd', 115)
-    cat_cd = {'key': None, 'tipoMensaje': tipo_mensaje,
-              'numeroInstrumento': parse_bmv_int32(bytes_array[2:6]),
-              'tipoValor': parse_alfa(bytes_array[6:8]),
-              'clase': parse_alfa(bytes_array[8:15]),
-              'vencimiento': parse_alfa(bytes_array[15:21]),
-              'tipoOpcion': parse_alfa(bytes_array[21:22]),
-              'precioEjercicio': parse_bmv_precio8(bytes_array[22:30]),
-              'puja': parse_bmv_precio8(bytes_array[30:38]),
-              'precioLiquidacionDiaAnterior': parse_bmv_precio8(bytes_array[38:46]),
-              'ultimaFechaOperacion': parse_bmv_timestamp1(bytes_array[46:54]).isoformat(),
-              'fechaVencimiento': parse_bmv_timestamp1(bytes_array[54:62]).isoformat(),
-              'contratosAbiertos': parse_bmv_int32(bytes_array[62:66]),
-              'tamanoContrato': parse_bmv_int32(bytes_array[66:70]),
-              'codigoProducto': parse_alfa(bytes_array[70:82]), 
-              'vencimientoDiario': parse_alfa(bytes_array[82:83]),
-              'clavePrecioEjercicio': parse_alfa(bytes_array[83:89]),
-              'codigoCFI': parse_alfa(bytes_array[89:95]),
-              # Filler from 95 to 115
-    }
-    assert_positive_integer(cat_cd, 'numeroInstrumento')
-    assert_in_catalog(cat_cd,'tipoValor', BMV_TIPOS_VALOR)
-    assert_in_catalog(cat_cd,'tipoOpcion', BMV_TIPOS_OPCION)
-    assert_is_valid_price(cat_cd, 'precioEjercicio')
-    assert_is_valid_price(cat_cd, 'puja')
-    assert_is_valid_price(cat_cd, 'precioLiquidacionDiaAnterior')
-    assert_positive_integer(cat_cd, 'contratosAbiertos')
-    assert_positive_integer(cat_cd, 'tamanoContrato')
-    assert_in_catalog(cat_cd,'vencimientoDiario', BMV_TIPOS_VENCIMIENTO_DIARIO)
+    check_catalog_type(bytes_array, 'cd', 115)
+    cat_cd = decode_bmv_layout(BMV_LAYOUT_CATALOGO_CD, bytes_array)
+    if validate:
+        assert_positive_integer(cat_cd, 'numeroInstrumento')
+        assert_in_catalog(cat_cd,'tipoValor', BMV_TIPOS_VALOR)
+        assert_in_catalog(cat_cd,'tipoOpcion', BMV_TIPOS_OPCION)
+        assert_is_valid_price(cat_cd, 'precioEjercicio')
+        assert_is_valid_price(cat_cd, 'puja')
+        assert_is_valid_price(cat_cd, 'precioLiquidacionDiaAnterior')
+        assert_positive_integer(cat_cd, 'contratosAbiertos')
+        assert_positive_integer(cat_cd, 'tamanoContrato')
+        assert_in_catalog(cat_cd,'vencimientoDiario', BMV_TIPOS_VENCIMIENTO_DIARIO)
     return cat_cd
 
 
 
-def parse_bmv_catalogo_cg(bytes_array:bytes) -> dict:
+def parse_bmv_catalogo_cg(bytes_array: bytes, validate: bool = True) -> dict:
     '''Parses an array of 76 bytes as a 'catalogo cg' as specified by BMV'''
-    tipo_mensaje = check_catalog_type(bytes_array, 'cg', 76)
-    cat_cg = {'key': None, 'tipoMensaje': tipo_mensaje,
-              'numeroInstrumento': parse_bmv_int32(bytes_array[2:6]),
-              'tipoValor': parse_alfa(bytes_array[6:8]),
-              'clase': parse_alfa(bytes_array[8:15]),
-              'vencimiento': parse_alfa(bytes_array[15:21]),
-              'tipoEstrategia': parse_alfa(bytes_array[21:22]),
-              'puja': parse_bmv_precio8(bytes_array[22:30]),
-              'ultimaFechaOperacion': parse_bmv_timestamp1(bytes_array[30:38]).isoformat(),
-              'fechaVencimiento': parse_bmv_timestamp1(bytes_array[38:46]).isoformat(),
-              'identificadorPataCorta': parse_bmv_int32(bytes_array[46:50]),
-              'identificadorPataLarga': parse_bmv_int32(bytes_array[50:54]),
-              'periodicidad': parse_bmv_int8(bytes_array[54:55]),
-              'numeroVencimientos': parse_bmv_int8(bytes_array[55:56]),
-              # Filler of 20 from 56 to 76
-    }
-    assert_positive_integer(cat_cg, 'numeroInstrumento')
-    assert_in_catalog(cat_cg,'tipoValor', BMV_TIPOS_VALOR)
-    assert_in_catalog(cat_cg,'tipoEstrategia', BMV_TIPOS_ESTRATEGIA)   
-    assert_is_valid_price(cat_cg, 'puja')
+    check_catalog_type(bytes_array, 'cg', 76)
+    cat_cg = decode_bmv_layout(BMV_LAYOUT_CATALOGO_CG, bytes_array)
+    if validate:
+        assert_positive_integer(cat_cg, 'numeroInstrumento')
+        assert_in_catalog(cat_cg,'tipoValor', BMV_TIPOS_VALOR)
+        assert_in_catalog(cat_cg,'tipoEstrategia', BMV_TIPOS_ESTRATEGIA)
+        assert_is_valid_price(cat_cg, 'puja')
     return cat_cg
 
 
-def parse_by_message_type(grupo_market_data: int, to_parse: bytes) -> dict:
-    '''Given a tipo_mensaje we assume matches the bytes array, we call the appropiate parsing function
+#
+# Dispatch of the messages to their parsers
+#
+# Parsers by grupo_market_data and then by the raw bytes of the tipoMensaje, so finding the parser of a message
+# is a single lookup without decoding its type. A parser receives the bytes of the message (without its longitud)
+# and validate, and returns a dictionary with its fields.
+#
+BMV_PARSERS = {
+    18: {
+        b'P': parse_bmv_mensaje_P,
+        b'E': parse_bmv_mensaje_E,
+        b'H': parse_bmv_mensaje_H,
+        b'O': parse_bmv_mensaje_O,
+        b'M': parse_bmv_mensaje_M,
+    },
+    40: {
+        b'ca': parse_bmv_catalogo_ca,
+        b'cb': parse_bmv_catalogo_cb,
+        b'cc': parse_bmv_catalogo_cc,
+        b'cd': parse_bmv_catalogo_cd,
+        b'ce': parse_bmv_catalogo_ce,
+        b'cf': parse_bmv_catalogo_cf,
+        b'cg': parse_bmv_catalogo_cg,
+        b'cy': parse_bmv_catalogo_cy,
+    },
+}
+
+
+def register_bmv_parser(grupo_market_data: int, tipo_mensaje, parser, tipo_mensaje_size: int = None,
+                        con_instrumento: bool = None) -> None:
+    '''Registers the parser of a tipoMensaje of a grupo_market_data, replacing the existing one if there is any.
+    tipo_mensaje_size is how many bytes make the tipoMensaje, only needed the first time a grupo is registered.
+    con_instrumento tells if the message has the numeroInstrumento (int32) right after the tipoMensaje, so filters
+    by instrument can accept it. None keeps what is known of the tipoMensaje, a new one has no numeroInstrumento.'''
+    if isinstance(tipo_mensaje, str):
+        tipo_mensaje = tipo_mensaje.encode('iso-8859-1')
+    if grupo_market_data not in BMV_PARSERS:
+        assert tipo_mensaje_size, f'The size of the tipoMensaje of grupo {grupo_market_data} is needed'
+        BMV_PARSERS[grupo_market_data] = {}
+        BMV_TIPO_MENSAJE_SIZES[grupo_market_data] = tipo_mensaje_size
+    assert len(tipo_mensaje) == BMV_TIPO_MENSAJE_SIZES[grupo_market_data], \
+        f'tipoMensaje of grupo {grupo_market_data} must have {BMV_TIPO_MENSAJE_SIZES[grupo_market_data]} bytes'
+    BMV_PARSERS[grupo_market_data][tipo_mensaje] = parser
+    if con_instrumento:
+        BMV_TIPOS_CON_INSTRUMENTO.add(tipo_mensaje)
+    elif con_instrumento is not None:
+        BMV_TIPOS_CON_INSTRUMENTO.discard(tipo_mensaje)
+
+
+def parse_by_message_type(grupo_market_data: int, to_parse: bytes, validate: bool = True) -> dict:
+    '''Calls the parser registered for the grupo_market_data and the tipoMensaje in the first bytes of to_parse
+    validate tells if the fields are checked after parsing them, the length and type are always checked.
     Returns:
-        mensaje: A dictionary with the parsed fields
+        mensaje: A dictionary with the parsed fields, or None if the message has no parser
     '''
-    mensaje = None
-    tipo_mensaje: str
-    # Select how big is the tipo_mensaje field based on the grupo_market_data
-    if grupo_market_data == 18:
-        tipo_mensaje = parse_alfa(to_parse[0:1])
-    elif grupo_market_data == 40:
-        tipo_mensaje = parse_alfa(to_parse[0:2])
-    else:
-        tipo_mensaje = ''
-    # Based on the tipo_mensaje, parse the message
-    if tipo_mensaje == 'P':
-            mensaje = parse_bmv_mensaje_P(to_parse)
-    elif tipo_mensaje == 'E':
-         mensaje = parse_bmv_mensaje_E(to_parse)
-    elif tipo_mensaje == 'H':
-            mensaje = parse_bmv_mensaje_H(to_parse)
-    elif tipo_mensaje == 'O':
-            mensaje = parse_bmv_mensaje_O(to_parse)
-    elif tipo_mensaje == 'M':
-            mensaje = parse_bmv_mensaje_M(to_parse)
-    elif tipo_mensaje == 'ca':
-            mensaje = parse_bmv_catalogo_ca(to_parse)
-    elif tipo_mensaje == 'cb':
-            mensaje = parse_bmv_catalogo_cb(to_parse)
-    elif tipo_mensaje == 'cc':
-            mensaje = parse_bmv_catalogo_cc(to_parse)
-    elif tipo_mensaje == 'cd':
-            mensaje = parse_bmv_catalogo_cd(to_parse)
-    elif tipo_mensaje == 'ce':
-            mensaje = parse_bmv_catalogo_ce(to_parse)
-    elif tipo_mensaje == 'cf':
-            mensaje = parse_bmv_catalogo_cf(to_parse)
-    elif tipo_mensaje == 'cg':
-            mensaje = parse_bmv_catalogo_cg(to_parse)
-    elif tipo_mensaje == 'cy':
-            mensaje = parse_bmv_catalogo_cy(to_parse)
-    return mensaje       
-        
-
-def parse_bmv_udp_packet(packet_data: bytes) -> dict:
-    '''Parses an udp packet as containing a header and 1 or more messages, as specified by BMV'''
+    parsers = BMV_PARSERS.get(grupo_market_data)
+    if parsers is None:
+        return None
+    parser = parsers.get(bytes(to_parse[:BMV_TIPO_MENSAJE_SIZES[grupo_market_data]]))
+    if parser is None:
+        return None
+    return parser(to_parse, validate)
+
+
+#
+# Filters
+#
+# A filter is checked against the raw bytes, before anything is decoded: the secuencia and fecha_hora of the
+# packet header before walking its messages, and the tipoMensaje and numeroInstrumento of each message before
+# calling its parser. Every part is optional, None accepts everything.
+#
+BmvFilter = namedtuple('BmvFilter', ['types', 'instruments', 'first_sequence', 'last_sequence', 'start_time', 'end_time'])
+
+
+def bmv_epoch_milliseconds(value) -> int:
+    '''Converts a datetime (naive ones are local time, like the parsed messages) to epoch milliseconds'''
+    if value is None or isinstance(value, int):
+        return value
+    return round(value.timestamp() * 1000)
+
+
+def make_bmv_filter(types=None, instruments=None, first_sequence: int = None, last_sequence: int = None,
+                    start_time=None, end_time=None) -> BmvFilter:
+    '''Builds a filter of messages, or returns None if it would accept everything.
+        types: tipoMensaje of the messages, like 'P' or 'ca'.
+        instruments: numeroInstrumento of the messages. Messages without one (like ce, or the ones registered
+            without con_instrumento, see register_bmv_parser) are not accepted.
+        first_sequence, last_sequence: range of secuencia of the messages, both included.
+        start_time, end_time: range of fechaHora of the packets, as datetimes or epoch milliseconds, end excluded.
+    '''
+    if all(value is None for value in (types, instruments, first_sequence, last_sequence, start_time, end_time)):
+        return None
+    return BmvFilter(None if types is None else frozenset(tipo.encode('iso-8859-1') for tipo in types),
+                     None if instruments is None else frozenset(instruments),
+                     first_sequence, last_sequence, bmv_epoch_milliseconds(start_time), bmv_epoch_milliseconds(end_time))
+
+
+def bmv_filter_accepts_packet(bmv_filter: BmvFilter, secuencia: int, total_mensajes: int, fecha_hora: int) -> bool:
+    '''Tells if any message of a packet can be accepted by the filter, only from its header'''
+    if bmv_filter.start_time is not None and fecha_hora < bmv_filter.start_time:
+        return False
+    if bmv_filter.end_time is not None and fecha_hora >= bmv_filter.end_time:
+        return False
+    if bmv_filter.first_sequence is not None and secuencia + total_mensajes <= bmv_filter.first_sequence:
+        return False
+    if bmv_filter.last_sequence is not None and secuencia > bmv_filter.last_sequence:
+        return False
+    return True
+
+
+def bmv_filter_accepts_message(bmv_filter: BmvFilter, buffer, offset: int, tipo_size: int, secuencia: int) -> bool:
+    '''Tells if the filter accepts the message that starts at offset in buffer, without decoding it'''
+    if bmv_filter.first_sequence is not None and secuencia < bmv_filter.first_sequence:
+        return False
+    if bmv_filter.last_sequence is not None and secuencia > bmv_filter.last_sequence:
+        return False
+    if bmv_filter.types is None and bmv_filter.instruments is None:
+        return True
+    tipo_mensaje = bytes(buffer[offset:offset + tipo_size])
+    if bmv_filter.types is not None and tipo_mensaje not in bmv_filter.types:
+        return False
+    if bmv_filter.instruments is not None:
+        if tipo_mensaje not in BMV_TIPOS_CON_INSTRUMENTO:
+            return False
+        return BMV_INSTRUMENTO_STRUCT.unpack_from(buffer, offset + tipo_size)[0] in bmv_filter.instruments
+    return True
+
+
+def parse_bmv_udp_packet(packet_data: bytes, validate: bool = True, bmv_filter: BmvFilter = None) -> dict:
+    '''Parses an udp packet as containing a header and 1 or more messages, as specified by BMV
+    Only the messages accepted by bmv_filter (see make_bmv_filter) are decoded, if it is given.
+    A packet rejected by the filter from its header is returned without 'timestamp' and with no mensajes.
+    '''
+    # All the decoding is done over a single memoryview with offsets, so no bytes are copied per field or message.
+    packet_view = memoryview(packet_data)
     paquete = {}
-    longitud:int = parse_bmv_int16(packet_data[:2])
-    assert longitud == len(packet_data), f'Longitud {longitud} must be equal to the packet size {len(packet_data)})'
+    longitud, total_mensajes, grupo_market_data, sesion, secuencia, fecha_hora = BMV_HEADER_STRUCT.unpack_from(packet_view)
+    assert longitud == len(packet_view), f'Longitud {longitud} must be equal to the packet size {len(packet_view)})'
     paquete['longitud'] = longitud
-    total_mensajes = parse_bmv_int8(packet_data[2:3])
     assert total_mensajes >= 0, 'We need a 0 or positive number'
     paquete['total_mensajes'] = total_mensajes
-    paquete['grupo_market_data'] = parse_bmv_int8(packet_data[3:4])
-    assert paquete['grupo_market_data'] in (18,40), 'We only deal with grupo 18 or grupo 40 BMV messages'
-    paquete['sesion'] = parse_bmv_int8(packet_data[4:5])
+    paquete['grupo_market_data'] = grupo_market_data
+    assert paquete['grupo_market_data'] in BMV_PARSERS, 'We only deal with grupo 18, grupo 40 or registered grupos'
+    paquete['sesion'] = sesion
     # http://tecnologia.bmv.com.mx:6503/especificacion/multicast/msg/structure/catalogs.html#cat_grupo_market_data
     assert 0 <= paquete['sesion'] <= 40, 'La sesion debe estar entre 0, y 40'
-    paquete['secuencia'] = secuencia = parse_bmv_int32(packet_data[5:9])
+    paquete['secuencia'] = secuencia
     assert 0 <= paquete['secuencia'], 'La secuencia debe ser mayor a cero.'
-    paquete['timestamp'] = timestamp = parse_bmv_timestamp3(packet_data[9:HEADER_SIZE])
     mensajes = []
+    paquete['mensajes'] = mensajes
+    if bmv_filter is not None and not bmv_filter_accepts_packet(bmv_filter, secuencia, total_mensajes, fecha_hora):
+        return paquete  # None of its messages are walked, and its timestamps are not formatted
+    paquete['timestamp'] = bmv_timestamp3_to_datetime(fecha_hora)
+    # The strings shared by all the messages of the packet are formatted once, including when it was parsed.
+    key_date = format_bmv_key_date(fecha_hora)
+    fecha_hora_iso = format_bmv_timestamp3(fecha_hora)
+    parsed_iso = datetime.now().isoformat()
+    tipo_size = BMV_TIPO_MENSAJE_SIZES[grupo_market_data]
     start = HEADER_SIZE
     for i in range(0, total_mensajes):
         # Longitude does not include the longitude field
-        longitud_msg = parse_bmv_int16(packet_data[start:start + 2])
-        to_parse = packet_data[start + 2:start + longitud_msg + 2]
-        mensaje = parse_by_message_type(paquete['grupo_market_data'], to_parse)
+        longitud_msg = BMV_LONGITUD_STRUCT.unpack_from(packet_view, start)[0]
+        if bmv_filter is not None and not bmv_filter_accepts_message(bmv_filter, packet_view, start + 2, tipo_size,
+                                                                     secuencia + i):
+            start += longitud_msg + 2  # Skipped by its longitud, without decoding it
+            continue
+        # Slicing a memoryview does not copy, the parsers decode straight from the packet buffer.
+        to_parse = packet_view[start + 2:start + longitud_msg + 2]
+        mensaje = parse_by_message_type(grupo_market_data, to_parse, validate)
         if mensaje:
-            mensaje['key'] = f"{timestamp.strftime('%Y%m%d')}-{secuencia + i}"
-            mensaje['fechaHora'] = timestamp.isoformat(timespec='milliseconds')
-            mensaje['timestamp'] = timestamp.now().isoformat()
+            mensaje['key'] = f'{key_date}-{secuencia + i}'
+            mensaje['fechaHora'] = fecha_hora_iso
+            mensaje['timestamp'] = parsed_iso
             mensaje['longitud'] = longitud_msg
             mensajes.append(mensaje)
         start += longitud_msg + 2  # add 2 to account the longitude field
-    paquete['mensajes'] = mensajes
     return paquete
 
 
-def parse_bmv_pcap_file(input_file: BufferedReader, output_file) -> dict:
-    '''Parses a complete cap file assuming it has only udp packets from BMV 'producto 18' or 'producto 40'''
-    pcap = dpkt.pcap.Reader(input_file)
+def iter_bmv_packets(source, validate: bool = True, bmv_filter: BmvFilter = None):
+    '''Yields the packets of a pcap file from BMV as parsed by parse_bmv_udp_packet, one at a time.
+    source is the name of the pcap file or the file opened in binary mode.
+    Only the messages accepted by bmv_filter are decoded. Packets that can not be parsed are skipped.'''
+    with nullcontext(source) if hasattr(source, 'fileno') else open(source, 'rb') as input_file:
+        for timestamp, udp_payload in iter_pcap_udp_payloads(input_file):
+            try:
+                paquete = parse_bmv_udp_packet(udp_payload, validate, bmv_filter)
+            except Exception as e:
+                # Same as parse_bmv_pcap_file, we skip what we can not understand and continue.
+                print(e)
+                continue
+            yield paquete
+
+
+def iter_bmv_messages(source, types=None, instruments=None, first_sequence: int = None, last_sequence: int = None,
+                      start_time=None, end_time=None, validate: bool = True):
+    '''Yields the messages of a pcap file from BMV as dictionaries, one at a time and in the order of the capture.
+    Only the messages accepted by the filter described by the other arguments are decoded, see make_bmv_filter.
+    Example:
+        for mensaje in iter_bmv_messages('capture.pcap', types=['P'], instruments=[1833, 2012]):
+            ...
+    '''
+    bmv_filter = make_bmv_filter(types, instruments, first_sequence, last_sequence, start_time, end_time)
+    for paquete in iter_bmv_packets(source, validate, bmv_filter):
+        yield from paquete['mensajes']
+
+
+def parse_bmv_pcap_file(input_file: BufferedReader, output_file, validation: str = 'strict',
+                        sample_every: int = BMV_VALIDATION_SAMPLE_EVERY, bmv_filter: BmvFilter = None) -> dict:
+    '''Parses a complete cap file assuming it has only udp packets from BMV 'producto 18' or 'producto 40'
+    output_file is either a text file, where the messages are written as json lines, or a writer from bmv_utils.output
+    validation is one of BMV_VALIDATION_LEVELS, and only the messages accepted by bmv_filter are written'''
     # We will keep basic statistics of how many messages we process per each type.
     counter_msgs = {}
+    writer = as_bmv_writer(output_file)
+    last_sequence = parse_bmv_udp_payloads(iter_pcap_udp_payloads(input_file), writer, counter_msgs,
+                                           validation=validation, sample_every=sample_every, bmv_filter=bmv_filter)
+    writer.flush()
+    print(f'Last found sequence is {last_sequence}')
+    return counter_msgs
 
-    last_sequence = None
-    for timestamp, pkt in pcap:
+
+def parse_bmv_udp_payloads(payloads, writer, counter_msgs: dict, last_sequence: int = None,
+                           validation: str = 'strict', sample_every: int = BMV_VALIDATION_SAMPLE_EVERY,
+                           bmv_filter: BmvFilter = None) -> int:
+    '''Parses the (timestamp, udp payload) pairs read from a pcap file and writes their messages with writer
+    Returns:
+        last_sequence: The sequence expected after the last parsed packet, or None if the last one failed.
+    '''
+    assert validation in BMV_VALIDATION_LEVELS, f'Unknown validation {validation}, use one of {BMV_VALIDATION_LEVELS}'
+    for number, (timestamp, udp_payload) in enumerate(payloads):
+        validate = validation == 'strict' or (validation == 'sampled' and number % sample_every == 0)
         try:
-            eth:dpkt.ethernet.Ethernet = dpkt.ethernet.Ethernet(pkt)
-            ip:dpkt.ip.IP = eth.data  # type: ignore 
-            if ip.p == dpkt.ip.IP_PROTO_UDP:  # We make sure is UDP.  # type: ignore  
-                udp_packet = ip.data
-                last_sequence = process_bmv_udp_packet(output_file, counter_msgs, last_sequence, udp_packet)
+            last_sequence = process_bmv_udp_packet(writer, counter_msgs, last_sequence, udp_payload, validate,
+                                                   bmv_filter)
         except Exception as e:
             # We will try to continue parsing the file, even if we have an error
             # Until now we find that the last sequence is incomplete or corrupted so 
@@ -637,20 +983,112 @@ def parse_bmv_pcap_file(input_file: BufferedReader, output_file) -> dict:
             print(f'Unexpected error on sequence {last_sequence}, trying to continue...')
             last_sequence = None
             continue
+    return last_sequence
+
+
+def parse_bmv_pcap_range(pcap_filename: str, start: int, end: int, output_filename: str,
+                         output_format: str = 'jsonl', part: int = 0, json_encoder: str = 'json',
+                         validation: str = 'strict', sample_every: int = BMV_VALIDATION_SAMPLE_EVERY,
+                         bmv_filter: BmvFilter = None) -> tuple:
+    '''Parses the records of a pcap file between the start and end offsets, into output_filename.
+    Returns:
+        counter_msgs: Statistics of the messages found in the range.
+        first_sequence: secuencia of the first packet in the range, or None if it couldn't be read.
+        last_sequence: The sequence expected after the last packet in the range.
+    '''
+    counter_msgs = {}
+    writer = open_bmv_writer(output_filename, output_format, part, json_encoder)
+    with open(pcap_filename, 'rb') as input_file:
+        payloads = iter_pcap_udp_payloads(input_file, start, end)
+        first_payload = next(payloads, None)
+        if first_payload is None:
+            writer.close()
+            return counter_msgs, None, None
+        try:
+            first_sequence = BMV_HEADER_STRUCT.unpack_from(first_payload[1])[4]
+        except struct.error:
+            first_sequence = None
+        # The sequence check against the previous range is done when merging, so we start as if we came from it.
+        last_sequence = parse_bmv_udp_payloads(chain([first_payload], payloads), writer, counter_msgs,
+                                               first_sequence, validation, sample_every, bmv_filter)
+    writer.close()
+    return counter_msgs, first_sequence, last_sequence
+
+
+def parse_bmv_pcap_file_parallel(pcap_filename: str, output_filename: str, workers: int,
+                                 output_format: str = 'jsonl', json_encoder: str = 'json',
+                                 validation: str = 'strict', sample_every: int = BMV_VALIDATION_SAMPLE_EVERY,
+                                 bmv_filter: BmvFilter = None) -> dict:
+    '''Parses a complete cap file like parse_bmv_pcap_file, splitting it in byte ranges parsed by a pool of processes.
+    For jsonl, the output of each range is merged into output_filename in the same order of the capture.
+    The columnar formats keep the output of each range as a numbered part of every table.'''
+    ranges = split_pcap_ranges(pcap_filename, workers)
+    if output_format == 'jsonl':
+        part_filenames = [f'{output_filename}.{i}.part' for i in range(len(ranges))]
+    else:
+        part_filenames = [output_filename] * len(ranges)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(parse_bmv_pcap_range, repeat(pcap_filename),
+                                    [start for start, end in ranges], [end for start, end in ranges], part_filenames,
+                                    repeat(output_format), range(len(ranges)), repeat(json_encoder),
+                                    repeat(validation), repeat(sample_every), repeat(bmv_filter)))
+    counter_msgs = {}
+    last_sequence = None
+    with open(output_filename, 'wb') if output_format == 'jsonl' else nullcontext() as output_file:
+        for part_filename, (range_counter_msgs, first_sequence, range_last_sequence) in zip(part_filenames, results):
+            # Same sequence checks as process_bmv_udp_packet, but between the end of a range and the start of the next.
+            if first_sequence is not None:
+                if not last_sequence:
+                    print(f'Primera secuencia es {first_sequence}')
+                elif last_sequence < first_sequence:
+                    print(f"Salto de secuencia: de {last_sequence} a {first_sequence}")
+                elif last_sequence > first_sequence:
+                    print(f"Mensajes en desorden: {last_sequence} a {first_sequence}")
+            last_sequence = range_last_sequence
+            for tipo_msg, counter in range_counter_msgs.items():
+                if tipo_msg not in counter_msgs:
+                    counter_msgs[tipo_msg] = {'total': 0, 'bytes': 0}
+                counter_msgs[tipo_msg]['total'] += counter['total']
+                counter_msgs[tipo_msg]['bytes'] += counter['bytes']
+            if output_file is not None:
+                with open(part_filename, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, output_file)
+                os.remove(part_filename)
     print(f'Last found sequence is {last_sequence}')
     return counter_msgs
 
-def process_bmv_udp_packet(output_file, counter_msgs, last_sequence, udp_packet) -> int:
-    paquete = parse_bmv_udp_packet(udp_packet.data)
+
+# How the secuencia of a packet follows the one expected after the previous packet, see check_bmv_sequence.
+BMV_SEQUENCE_FIRST = 'first'
+BMV_SEQUENCE_IN_ORDER = 'in order'
+BMV_SEQUENCE_GAP = 'gap'
+BMV_SEQUENCE_OUT_OF_ORDER = 'out of order'
+
+
+def check_bmv_sequence(last_sequence: int, secuencia: int, total_mensajes: int) -> tuple:
+    '''Checks the secuencia of a packet against last_sequence, the one expected after the previous packet
+    (None or 0 for the first packet). Returns (one of the BMV_SEQUENCE_* states, the secuencia expected next)'''
+    next_sequence = secuencia + total_mensajes
     if not last_sequence:
-        last_sequence = paquete['secuencia'] + paquete['total_mensajes']
-        print(f'Primera secuencia es {last_sequence}')
-    else:
-        if last_sequence < paquete['secuencia']:  # ToDo - check the pcaps
-            print(f"Salto de secuencia: de {last_sequence} a {paquete['secuencia']}")
-        elif last_sequence > paquete['secuencia']:
-            print(f"Mensajes en desorden: {last_sequence} a {paquete['secuencia']}")
-        last_sequence = paquete['secuencia'] + paquete['total_mensajes']
+        return BMV_SEQUENCE_FIRST, next_sequence
+    if last_sequence < secuencia:
+        return BMV_SEQUENCE_GAP, next_sequence
+    if last_sequence > secuencia:
+        return BMV_SEQUENCE_OUT_OF_ORDER, next_sequence
+    return BMV_SEQUENCE_IN_ORDER, next_sequence
+
+
+def process_bmv_udp_packet(writer, counter_msgs, last_sequence, udp_payload, validate: bool = True,
+                           bmv_filter: BmvFilter = None) -> int:
+    paquete = parse_bmv_udp_packet(udp_payload, validate, bmv_filter)
+    state, next_sequence = check_bmv_sequence(last_sequence, paquete['secuencia'], paquete['total_mensajes'])
+    if state == BMV_SEQUENCE_FIRST:
+        print(f"Primera secuencia es {paquete['secuencia']}")
+    elif state == BMV_SEQUENCE_GAP:  # ToDo - check the pcaps
+        print(f"Salto de secuencia: de {last_sequence} a {paquete['secuencia']}")
+    elif state == BMV_SEQUENCE_OUT_OF_ORDER:
+        print(f"Mensajes en desorden: {last_sequence} a {paquete['secuencia']}")
+    last_sequence = next_sequence
     for mensaje in paquete['mensajes']:
         tipo_msg = mensaje['tipoMensaje']
         if tipo_msg not in counter_msgs:
@@ -660,5 +1098,5 @@ def process_bmv_udp_packet(output_file, counter_msgs, last_sequence, udp_packet)
         else:
             counter_msgs[tipo_msg]['total'] += 1
             counter_msgs[tipo_msg]['bytes'] += mensaje['longitud']
-        print(json.dumps(mensaje), file=output_file)
+        writer.write_mensaje(mensaje)
     return last_sequence
@@ -0,0 +1,224 @@
+'''
+Utilities to walk pcap and pcapng files at the record level, without building an object per frame.
+
+Files are memory-mapped, and the UDP payloads are returned as memoryviews over the map, so nothing is copied
+until a parser decodes it.
+'''
+import mmap
+import socket
+import struct
+
+# Based on https://wiki.wireshark.org/Development/LibpcapFileFormat
+PCAP_GLOBAL_HEADER_SIZE = 24
+PCAP_RECORD_HEADER_SIZE = 16
+# Magic number as read in little-endian, and the byte order it means for the rest of the file.
+PCAP_MAGIC_NUMBERS = {
+    0xa1b2c3d4: '<',  # Microseconds, little-endian
+    0xa1b23c4d: '<',  # Nanoseconds, little-endian
+    0xd4c3b2a1: '>',  # Microseconds, big-endian
+    0x4d3cb2a1: '>',  # Nanoseconds, big-endian
+}
+PCAP_NANOSECONDS_MAGIC_NUMBERS = (0xa1b23c4d, 0x4d3cb2a1)
+
+# Based on https://www.ietf.org/archive/id/draft-tuexen-opsawg-pcapng-05.html
+# Timestamps are assumed with the default resolution of microseconds.
+PCAPNG_SECTION_HEADER_BLOCK = 0x0a0d0d0a
+PCAPNG_SIMPLE_PACKET_BLOCK = 0x00000003
+PCAPNG_ENHANCED_PACKET_BLOCK = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+
+# Ethernet, IPv4 and UDP offsets. The common case has no VLAN tags and an IP header without options.
+ETH_HEADER_SIZE = 14
+ETH_TYPE_OFFSET = 12
+ETH_TYPE_IP = 0x0800
+ETH_TYPES_VLAN = (0x8100, 0x88a8, 0x9100)
+VLAN_TAG_SIZE = 4
+IP_PROTO_UDP = 17
+UDP_HEADER_SIZE = 8
+UINT16_STRUCT = struct.Struct('>H')
+
+# To write pcap files: microseconds, little-endian, ethernet frames.
+PCAP_GLOBAL_HEADER_STRUCT = struct.Struct('<IHHiIII')
+PCAP_RECORD_HEADER_STRUCT = struct.Struct('<IIII')
+PCAP_LINKTYPE_ETHERNET = 1
+IP_HEADER_STRUCT = struct.Struct('>BBHHHBBH4s4s')
+UDP_HEADER_STRUCT = struct.Struct('>HHHH')
+
+
+def read_pcap_global_header(buffer) -> tuple:
+    '''Reads the global header of a pcap file
+    Returns:
+        byte_order: '<' or '>' to use with struct for the record headers.
+        ts_divisor: what divides the fraction of the timestamps to get seconds.
+    '''
+    assert len(buffer) >= PCAP_GLOBAL_HEADER_SIZE, 'The file is too short to be a pcap'
+    magic = struct.unpack_from('<I', buffer)[0]
+    assert magic in PCAP_MAGIC_NUMBERS, f'Unknown pcap magic number {magic:#x}, only pcap files are supported'
+    ts_divisor = 1000000000.0 if magic in PCAP_NANOSECONDS_MAGIC_NUMBERS else 1000000.0
+    return PCAP_MAGIC_NUMBERS[magic], ts_divisor
+
+
+def read_pcapng_byte_order(buffer, offset: int = 0) -> str:
+    '''Reads the byte order of the pcapng section that starts at offset'''
+    if struct.unpack_from('<I', buffer, offset + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+        return '<'
+    assert struct.unpack_from('>I', buffer, offset + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC, 'Invalid pcapng section header'
+    return '>'
+
+
+def is_pcapng(buffer) -> bool:
+    '''Tells if the buffer has a pcapng file (starting by a section header block) instead of a pcap one'''
+    return len(buffer) >= 12 and struct.unpack_from('<I', buffer)[0] == PCAPNG_SECTION_HEADER_BLOCK
+
+
+def iter_capture_records(buffer, start: int = None, end: int = None):
+    '''Yields (offset, timestamp, frame_start, frame_length) for every packet of a pcap or pcapng buffer
+    between the start and end offsets. start must be a record boundary.'''
+    size = len(buffer) if end is None else min(end, len(buffer))
+    if is_pcapng(buffer):
+        yield from iter_pcapng_records(buffer, 0 if start is None else start, size)
+        return
+    byte_order, ts_divisor = read_pcap_global_header(buffer)
+    record_header = struct.Struct(byte_order + 'IIII')
+    offset = PCAP_GLOBAL_HEADER_SIZE if start is None else start
+    total_size = len(buffer)
+    while offset + PCAP_RECORD_HEADER_SIZE <= size:
+        ts_sec, ts_fraction, incl_len, orig_len = record_header.unpack_from(buffer, offset)
+        frame_start = offset + PCAP_RECORD_HEADER_SIZE
+        if frame_start + incl_len > total_size:
+            break  # Truncated capture
+        yield offset, ts_sec + ts_fraction / ts_divisor, frame_start, incl_len
+        offset = frame_start + incl_len
+
+
+def iter_pcapng_records(buffer, start: int, end: int):
+    '''Yields (offset, timestamp, frame_start, frame_length) for the enhanced and simple packet blocks of a pcapng buffer'''
+    byte_order = read_pcapng_byte_order(buffer)
+    block_header = struct.Struct(byte_order + 'II')
+    enhanced_header = struct.Struct(byte_order + 'IIIII')
+    offset = start
+    while offset + 12 <= end:
+        block_type, block_length = block_header.unpack_from(buffer, offset)
+        if block_type == PCAPNG_SECTION_HEADER_BLOCK:
+            byte_order = read_pcapng_byte_order(buffer, offset)
+            block_header = struct.Struct(byte_order + 'II')
+            enhanced_header = struct.Struct(byte_order + 'IIIII')
+            block_length = block_header.unpack_from(buffer, offset)[1]
+        elif block_type == PCAPNG_ENHANCED_PACKET_BLOCK:
+            interface_id, ts_high, ts_low, captured_len, packet_len = enhanced_header.unpack_from(buffer, offset + 8)
+            frame_start = offset + 28
+            yield offset, ((ts_high << 32) | ts_low) / 1000000.0, frame_start, captured_len
+        elif block_type == PCAPNG_SIMPLE_PACKET_BLOCK:
+            frame_start = offset + 12
+            # Simple packet blocks have no timestamp.
+            yield offset, None, frame_start, block_length - 16
+        if block_length < 12 or offset + block_length > len(buffer):
+            break  # Corrupted or truncated capture
+        offset += block_length
+
+
+def find_udp_payload(frame) -> tuple:
+    '''Returns the (start, end) offsets of the UDP payload of an ethernet frame with an IPv4 packet,
+    or None if it has something else.'''
+    if len(frame) < ETH_HEADER_SIZE:
+        return None
+    offset = ETH_HEADER_SIZE
+    eth_type = UINT16_STRUCT.unpack_from(frame, ETH_TYPE_OFFSET)[0]
+    while eth_type in ETH_TYPES_VLAN and len(frame) >= offset + VLAN_TAG_SIZE:
+        # 802.1Q (or QinQ) tags go before the real ether type.
+        eth_type = UINT16_STRUCT.unpack_from(frame, offset + 2)[0]
+        offset += VLAN_TAG_SIZE
+    if eth_type != ETH_TYPE_IP or len(frame) < offset + 20:
+        return None
+    version_ihl = frame[offset]
+    if version_ihl >> 4 != 4 or frame[offset + 9] != IP_PROTO_UDP:
+        return None
+    if UINT16_STRUCT.unpack_from(frame, offset + 6)[0] & 0x3fff:
+        return None  # IP fragments are not reassembled
+    udp_offset = offset + (version_ihl & 0x0f) * 4
+    if len(frame) < udp_offset + UDP_HEADER_SIZE:
+        return None
+    # The UDP length excludes the ethernet padding that short frames have.
+    udp_length = UINT16_STRUCT.unpack_from(frame, udp_offset + 4)[0]
+    return udp_offset + UDP_HEADER_SIZE, min(udp_offset + udp_length, len(frame))
+
+
+def extract_udp_payload(frame):
+    '''Returns the UDP payload of an ethernet frame with an IPv4 packet, or None if it has something else.
+    The payload is a slice of frame, so it is a memoryview when frame is one.'''
+    bounds = find_udp_payload(frame)
+    if bounds is None:
+        return None
+    return frame[bounds[0]:bounds[1]]
+
+
+def iter_pcap_udp_payloads(input_file, start: int = None, end: int = None):
+    '''Memory maps a pcap or pcapng file and yields (timestamp, payload) for each of its UDP packets.
+    Payloads are memoryviews over the map, valid while they are referenced.'''
+    buffer = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buffer)
+    records = iter_capture_records(view, start, end)
+    payload = None
+    try:
+        for offset, timestamp, frame_start, frame_length in records:
+            payload = extract_udp_payload(view[frame_start:frame_start + frame_length])
+            if payload is not None:
+                yield timestamp, payload
+    finally:
+        records.close()
+        payload = None
+        try:
+            view.release()
+            buffer.close()
+        except BufferError:
+            pass  # Someone still has a payload, the map is closed by the garbage collector once it is released.
+
+
+def pack_pcap_global_header(snaplen: int = 65535) -> bytes:
+    '''Returns the global header of a pcap file with microsecond timestamps and ethernet frames'''
+    return PCAP_GLOBAL_HEADER_STRUCT.pack(0xa1b2c3d4, 2, 4, 0, 0, snaplen, PCAP_LINKTYPE_ETHERNET)
+
+
+def pack_pcap_record(timestamp: float, frame) -> bytes:
+    '''Returns the record of a frame captured at timestamp (seconds since the epoch), header and frame'''
+    microseconds = round(timestamp * 1000000)
+    return PCAP_RECORD_HEADER_STRUCT.pack(microseconds // 1000000, microseconds % 1000000, len(frame), len(frame)) \
+        + bytes(frame)
+
+
+def build_udp_frame(payload, destination: tuple, source: tuple = ('10.0.0.1', 10000)) -> bytes:
+    '''Returns an ethernet frame with an IPv4 UDP packet from source to destination, both (address, port).
+    When destination is a multicast group the frame goes to its multicast MAC address, as a switch would see it.'''
+    destination_ip = socket.inet_aton(destination[0])
+    if 224 <= destination_ip[0] <= 239:
+        destination_mac = b'\x01\x00\x5e' + bytes((destination_ip[1] & 0x7f, destination_ip[2], destination_ip[3]))
+    else:
+        destination_mac = b'\x02\x00\x00\x00\x00\x02'
+    udp_length = UDP_HEADER_SIZE + len(payload)
+    ip_header = bytearray(IP_HEADER_STRUCT.pack(0x45, 0, 20 + udp_length, 0, 0x4000, 1, IP_PROTO_UDP, 0,
+                                                socket.inet_aton(source[0]), destination_ip))
+    checksum = sum(struct.unpack('>10H', ip_header))
+    checksum = (checksum & 0xffff) + (checksum >> 16)
+    checksum = (checksum & 0xffff) + (checksum >> 16)
+    ip_header[10:12] = UINT16_STRUCT.pack(~checksum & 0xffff)
+    # UDP checksum 0 means that it was not calculated, valid in IPv4.
+    return destination_mac + b'\x02\x00\x00\x00\x00\x01' + UINT16_STRUCT.pack(ETH_TYPE_IP) + ip_header \
+        + UDP_HEADER_STRUCT.pack(source[1], destination[1], udp_length, 0) + bytes(payload)
+
+
+def split_pcap_ranges(pcap_filename: str, parts: int) -> list:
+    '''Splits a pcap or pcapng file in up to parts byte ranges of similar size, that start at record boundaries.
+    Returns:
+        A list of (start, end) offsets.
+    '''
+    with open(pcap_filename, 'rb') as input_file:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            size = len(buffer)
+            first = 0 if is_pcapng(buffer) else PCAP_GLOBAL_HEADER_SIZE
+            target = (size - first) / parts
+            boundaries = [first]
+            for offset, timestamp, frame_start, frame_length in iter_capture_records(buffer):
+                if offset - boundaries[-1] >= target:
+                    boundaries.append(offset)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
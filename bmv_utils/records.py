@@ -0,0 +1,129 @@
+'''
+Compact records of BMV messages, as an alternative to the dictionaries of bmv_utils.parse.
+
+A record only keeps the raw bytes of its message plus the secuencia and fechaHora of its packet, in __slots__,
+and decodes each field when it is accessed. This keeps a whole day of messages in memory at a fraction of
+the size of the dictionaries, which are still available with to_dict().
+'''
+import struct
+import time
+from datetime import datetime
+from io import BufferedReader
+
+from bmv_utils.parse import (BMV_HEADER_STRUCT, BMV_LAYOUT_CONVERSIONS, BMV_LAYOUT_FORMATS, BMV_LAYOUTS,
+                             BMV_LONGITUD_STRUCT, BMV_TIPO_MENSAJE_SIZES, HEADER_SIZE, BmvLayout,
+                             decode_bmv_layout, format_bmv_key_date, format_bmv_timestamp3, parse_alfa)
+from bmv_utils.pcap import iter_pcap_udp_payloads
+
+
+class BmvRecord:
+    '''Base class of the records, there is one subclass per layout with a property per field'''
+    __slots__ = ('raw', 'secuencia', 'fecha_hora', 'recibido')
+    layout: BmvLayout = None
+
+    def __init__(self, raw: bytes, secuencia: int, fecha_hora: int, recibido: float = None):
+        self.raw = raw  # Bytes of the message, without its longitud
+        self.secuencia = secuencia  # secuencia of the message, the one of the packet plus its position in it
+        self.fecha_hora = fecha_hora  # fecha_hora of the packet, in milliseconds (timestamp3)
+        self.recibido = recibido  # When the packet was parsed, as returned by time.time()
+
+    @property
+    def longitud(self) -> int:
+        return len(self.raw)
+
+    @property
+    def key(self) -> str:
+        return f'{format_bmv_key_date(self.fecha_hora)}-{self.secuencia}'
+
+    @property
+    def fechaHora(self) -> str:
+        return format_bmv_timestamp3(self.fecha_hora)
+
+    @property
+    def timestamp(self) -> str:
+        return datetime.fromtimestamp(self.recibido).isoformat()
+
+    def __getitem__(self, name: str):
+        '''So records can be used where a mensaje dictionary is expected, like mensaje['numeroInstrumento']'''
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def to_dict(self) -> dict:
+        '''Returns the same dictionary that parse_bmv_udp_packet returns for this message'''
+        mensaje = decode_bmv_layout(self.layout, self.raw)
+        mensaje['key'] = self.key
+        mensaje['fechaHora'] = self.fechaHora
+        mensaje['timestamp'] = self.timestamp
+        mensaje['longitud'] = self.longitud
+        return mensaje
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(key={self.key!r}, tipoMensaje={self.layout.tipo_mensaje!r})'
+
+
+def make_bmv_field_property(tipo: str, size: int, offset: int) -> property:
+    '''Returns a property that decodes a field of type tipo from the raw bytes of a record'''
+    code = BMV_LAYOUT_FORMATS[tipo]
+    if code == 's':
+        end = offset + size
+        if tipo == 'alfa':
+            return property(lambda record: parse_alfa(record.raw[offset:end]))
+        conversion = BMV_LAYOUT_CONVERSIONS[tipo]
+        return property(lambda record: conversion(record.raw[offset:end]))
+    unpack_from = struct.Struct('>' + code).unpack_from
+    conversion = BMV_LAYOUT_CONVERSIONS.get(tipo)
+    if conversion is None:
+        return property(lambda record: unpack_from(record.raw, offset)[0])
+    return property(lambda record: conversion(unpack_from(record.raw, offset)[0]))
+
+
+def make_bmv_record_class(layout: BmvLayout) -> type:
+    '''Creates the record class of a layout'''
+    namespace = {'__slots__': (), 'layout': layout}
+    offset = 0
+    for name, tipo, size in layout.fields:
+        if name is not None:
+            namespace[name] = make_bmv_field_property(tipo, size, offset)
+        offset += size
+    return type(f'BmvRecord_{layout.tipo_mensaje}', (BmvRecord,), namespace)
+
+
+# Record classes by grupo_market_data and then by tipoMensaje, same as BMV_LAYOUTS.
+BMV_RECORD_CLASSES = {grupo: {tipo_mensaje: make_bmv_record_class(layout) for tipo_mensaje, layout in layouts.items()}
+                      for grupo, layouts in BMV_LAYOUTS.items()}
+
+
+def parse_bmv_udp_packet_records(packet_data: bytes, recibido: float = None) -> list:
+    '''Splits an udp packet from BMV into records, one per message of a known tipoMensaje.
+    Only the header is checked, the fields of the messages are not decoded nor validated.'''
+    longitud, total_mensajes, grupo_market_data, sesion, secuencia, fecha_hora = BMV_HEADER_STRUCT.unpack_from(packet_data)
+    assert longitud == len(packet_data), f'Longitud {longitud} must be equal to the packet size {len(packet_data)})'
+    assert grupo_market_data in BMV_RECORD_CLASSES, 'We only deal with grupo 18 or grupo 40 BMV messages'
+    record_classes = BMV_RECORD_CLASSES[grupo_market_data]
+    tipo_size = BMV_TIPO_MENSAJE_SIZES[grupo_market_data]
+    if recibido is None:
+        recibido = time.time()
+    records = []
+    start = HEADER_SIZE
+    for i in range(total_mensajes):
+        longitud_msg = BMV_LONGITUD_STRUCT.unpack_from(packet_data, start)[0]
+        raw = bytes(packet_data[start + 2:start + 2 + longitud_msg])
+        record_class = record_classes.get(parse_alfa(raw[:tipo_size]))
+        if record_class is not None and record_class.layout.length == longitud_msg:
+            records.append(record_class(raw, secuencia + i, fecha_hora, recibido))
+        start += longitud_msg + 2
+    return records
+
+
+def load_bmv_pcap_records(input_file: BufferedReader) -> list:
+    '''Reads all the messages of a pcap file from BMV 'producto 18' or 'producto 40' as records'''
+    records = []
+    for timestamp, udp_payload in iter_pcap_udp_payloads(input_file):
+        try:
+            records += parse_bmv_udp_packet_records(udp_payload)
+        except Exception as e:
+            # Same as parse_bmv_pcap_file, we skip the packets we can not understand.
+            print(e)
+    return records
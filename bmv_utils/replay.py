@@ -0,0 +1,102 @@
+'''
+Recorded BMV packets, by secuencia, to answer retransmission requests with the real bytes of one or more captures.
+
+The captures are memory-mapped and only the position of every packet is kept, in arrays sorted by secuencia,
+so the packets are sent straight from the maps without copying them.
+'''
+import mmap
+import os
+from array import array
+from bisect import bisect_right
+
+from bmv_utils.parse import BMV_HEADER_STRUCT, HEADER_SIZE
+from bmv_utils.pcap import find_udp_payload, iter_capture_records
+
+try:
+    # Most buffers that a single sendmsg accepts
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+
+class BmvReplayCaptures:
+    '''Packets of one or more pcap or pcapng files, by grupo_market_data and secuencia.
+    When a secuencia is in more than one capture (or repeated in one), the first one loaded is kept.'''
+
+    def __init__(self, pcap_filenames):
+        self.buffers = []  # One memoryview over the map of each capture
+        self.packets = {}  # By grupo: (secuencias, ends, captures, starts, lengths) arrays sorted by secuencia
+        found = {}
+        for pcap_filename in pcap_filenames:
+            with open(pcap_filename, 'rb') as input_file:
+                buffer = memoryview(mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ))
+            capture = len(self.buffers)
+            self.buffers.append(buffer)
+            for offset, timestamp, frame_start, frame_length in iter_capture_records(buffer):
+                bounds = find_udp_payload(buffer[frame_start:frame_start + frame_length])
+                if bounds is None or bounds[1] - bounds[0] < HEADER_SIZE:
+                    continue
+                start = frame_start + bounds[0]
+                longitud, total_mensajes, grupo_market_data, sesion, secuencia, fecha_hora = \
+                    BMV_HEADER_STRUCT.unpack_from(buffer, start)
+                if longitud != bounds[1] - bounds[0]:
+                    continue
+                found.setdefault(grupo_market_data, {}).setdefault(secuencia, (total_mensajes, capture, start, longitud))
+        for grupo_market_data, packets in found.items():
+            secuencias, ends, captures, starts, lengths = array('q'), array('q'), array('i'), array('q'), array('i')
+            for secuencia in sorted(packets):
+                total_mensajes, capture, start, longitud = packets[secuencia]
+                secuencias.append(secuencia)
+                ends.append(secuencia + total_mensajes)
+                captures.append(capture)
+                starts.append(start)
+                lengths.append(longitud)
+            self.packets[grupo_market_data] = (secuencias, ends, captures, starts, lengths)
+
+    def grupos(self) -> tuple:
+        '''grupo_market_data of the recorded packets'''
+        return tuple(self.packets)
+
+    def __len__(self) -> int:
+        return sum(len(packets[0]) for packets in self.packets.values())
+
+    def iter_packets(self, grupo_market_data: int, first_message: int, quantity: int):
+        '''Yields the recorded packets (memoryviews over the captures) that have any message
+        from first_message to first_message + quantity - 1, in order of secuencia'''
+        if grupo_market_data not in self.packets:
+            return
+        secuencias, ends, captures, starts, lengths = self.packets[grupo_market_data]
+        last_message = first_message + quantity
+        # Starts by the last packet that begins at or before first_message, if it still has it.
+        position = max(bisect_right(secuencias, first_message) - 1, 0)
+        if position < len(secuencias) and ends[position] <= first_message:
+            position += 1
+        while position < len(secuencias) and secuencias[position] < last_message:
+            start = starts[position]
+            yield self.buffers[captures[position]][start:start + lengths[position]]
+            position += 1
+
+    def iter_packet_batches(self, grupo_market_data: int, first_message: int, quantity: int,
+                            batch_size: int = 1 << 16):
+        '''Same packets as iter_packets, grouped in lists of up to batch_size bytes (or IOV_MAX packets),
+        to be sent with one sendmsg or writelines per list instead of one send per packet'''
+        batch, batch_bytes = [], 0
+        for packet in self.iter_packets(grupo_market_data, first_message, quantity):
+            if batch and (batch_bytes + len(packet) > batch_size or len(batch) >= IOV_MAX):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(packet)
+            batch_bytes += len(packet)
+        if batch:
+            yield batch
+
+    def close(self) -> None:
+        for buffer in self.buffers:
+            mapped = buffer.obj
+            try:
+                buffer.release()
+                mapped.close()
+            except BufferError:
+                pass  # A packet is still referenced, the map is closed by the garbage collector once it is released.
+        self.buffers = []
+        self.packets = {}
@@ -0,0 +1,204 @@
+'''
+Synthetic BMV traffic for load tests, so benchmarks don't need real (licensed) captures.
+
+Messages are built from the same layouts that bmv_utils.parse decodes, with values that pass the strict validation.
+Everything comes from a random.Random with a seed, so the same seed and options always give the same packets.
+'''
+import random
+import string
+
+from bmv_utils.parse import (BMV_BOLSA_ORIGEN, BMV_BURSATILIDAD, BMV_CATALOGO_REFERENCIA, BMV_HEADER_STRUCT,
+                             BMV_INDICADORES_SUBASTA, BMV_LAYOUTS_BY_TIPO, BMV_LONGITUD_STRUCT, BMV_MERCADOS,
+                             BMV_SENTIDO_OPERACION, BMV_TIPO_OPERACION_MSG_O, BMV_TIPOS_CONCERTACION,
+                             BMV_TIPOS_ESTRATEGIA, BMV_TIPOS_LIQUIDACION, BMV_TIPOS_OPCION,
+                             BMV_TIPOS_OPERA_TASA_PRECIO, BMV_TIPOS_OPERACION, BMV_TIPOS_VALOR,
+                             BMV_TIPOS_VENCIMIENTO_DIARIO, BMV_TIPOS_WARRANT, HEADER_SIZE)
+from bmv_utils.pcap import build_udp_frame, pack_pcap_global_header, pack_pcap_record
+
+# Messages of grupo 18 and catalogs of grupo 40, with their weight in the generated traffic.
+BMV_SYNTHETIC_MIX = {'O': 50, 'P': 30, 'E': 10, 'H': 5, 'M': 5}
+BMV_SYNTHETIC_CATALOG_MIX = {'ca': 60, 'cb': 15, 'cd': 10, 'cc': 5, 'cf': 5, 'cg': 2, 'cy': 2, 'ce': 1}
+# Largest packet, to stay within the MTU of an ethernet network.
+BMV_SYNTHETIC_MAX_PACKET = 1400
+
+# Catalogs of the alfa fields, by name of the field.
+BMV_SYNTHETIC_CATALOGS = {
+    'tipoValor': BMV_TIPOS_VALOR,
+    'tipoValorSubyacente': BMV_TIPOS_VALOR,
+    'referencia': BMV_CATALOGO_REFERENCIA,
+    'bursatilidad': BMV_BURSATILIDAD,
+    'mercado': BMV_MERCADOS,
+    'bolsaOrigen': BMV_BOLSA_ORIGEN,
+    'tipoConcertacion': BMV_TIPOS_CONCERTACION,
+    'tipoOperacion': BMV_TIPOS_OPERACION,
+    'liquidacion': BMV_TIPOS_LIQUIDACION,
+    'indicadorSubasta': BMV_INDICADORES_SUBASTA,
+    'sentido': BMV_SENTIDO_OPERACION,
+    'tipo': BMV_TIPO_OPERACION_MSG_O,
+    'tipoWarrant': BMV_TIPOS_WARRANT,
+    'operaTasaPrecio': BMV_TIPOS_OPERA_TASA_PRECIO,
+    'tipoOpcion': BMV_TIPOS_OPCION,
+    'vencimientoDiario': BMV_TIPOS_VENCIMIENTO_DIARIO,
+    'tipoEstrategia': BMV_TIPOS_ESTRATEGIA,
+}
+# Largest value of the integer fields that are not an instrument, folio or volume, by tipo.
+BMV_SYNTHETIC_INT_LIMITS = {'int8': 100, 'int16': 1000, 'int32': 1000000, 'int64': 1000000000}
+# Units of the prices in the wire, by tipo.
+BMV_SYNTHETIC_PRICE_UNITS = {'precio4': 1000, 'precio8': 100000000}
+
+
+def alfa_choices(catalog, size: int) -> tuple:
+    '''Encoded values of a catalog that still are in it once parse_alfa strips them, sorted to be reproducible'''
+    return tuple(value.encode('iso-8859-1').ljust(size) for value in sorted(catalog)
+                 if value.rstrip() in catalog and len(value) <= size and value)
+
+
+class BmvSyntheticGenerator:
+    '''Generates grupo 18 and grupo 40 packets of a universe of instruments.
+
+    Each instrument has a price that moves in a random walk, and some instruments trade much more than others.
+    Grupo 40 packets (the catalogs of every instrument) go first, then the grupo 18 messages at an average rate
+    of rate messages per second, messages_per_packet = (minimum, maximum) in each packet.
+    '''
+
+    def __init__(self, seed: int = 0, instruments: int = 500, mix: dict = None, catalog_mix: dict = None,
+                 messages_per_packet: tuple = (1, 8), rate: float = 10000.0, start_time: int = 1666186200000,
+                 first_sequence: int = 1, sesion: int = 1):
+        self.rng = random.Random(seed)
+        self.mix = BMV_SYNTHETIC_MIX if mix is None else mix
+        self.catalog_mix = BMV_SYNTHETIC_CATALOG_MIX if catalog_mix is None else catalog_mix
+        self.messages_per_packet = messages_per_packet
+        self.rate = rate
+        self.time = start_time * 1000  # In microseconds, fecha_hora is in milliseconds
+        self.sequences = {18: first_sequence, 40: 1}
+        self.sesion = sesion
+        self.folio = 0
+        self.instruments = self.rng.sample(range(1, 100 * instruments + 1), instruments)
+        # Zipf weights, the first instruments trade the most.
+        self.instrument_weights = [1.0 / (rank + 1) for rank in range(instruments)]
+        self.prices = {instrument: round(self.rng.uniform(1.0, 1000.0), 2) for instrument in self.instruments}
+        self.makers = {tipo_mensaje: self.layout_makers(layout) for tipo_mensaje, layout in BMV_LAYOUTS_BY_TIPO.items()}
+
+    def layout_makers(self, layout) -> list:
+        '''Functions that make the wire value of each field of a layout, from the instrument and fecha_hora'''
+        rng = self.rng
+        makers = []
+        # The functions share rng, so the values only depend on the seed and the order of the messages.
+        for name, tipo, size in layout.fields:
+            if tipo == 'filler':
+                continue
+            if name == 'tipoMensaje':
+                value = layout.tipo_mensaje.encode('iso-8859-1')
+                makers.append(lambda instrument, fecha_hora, value=value: value)
+            elif name in BMV_SYNTHETIC_CATALOGS:
+                choices = alfa_choices(BMV_SYNTHETIC_CATALOGS[name], size)
+                makers.append(lambda instrument, fecha_hora, choices=choices: rng.choice(choices))
+            elif tipo == 'alfa':
+                makers.append(lambda instrument, fecha_hora, size=size: ''.join(
+                    rng.choices(string.ascii_uppercase, k=rng.randint(1, size))).encode('ascii').ljust(size))
+            elif tipo == 'bandera':
+                makers.append(lambda instrument, fecha_hora: rng.choice((b'0', b'1')))
+            elif tipo in ('timestamp1', 'timestamp2'):
+                makers.append(lambda instrument, fecha_hora: fecha_hora)
+            elif name in ('numeroInstrumento', 'numeroTrac'):
+                makers.append(lambda instrument, fecha_hora: instrument)
+            elif name == 'folioHecho':
+                makers.append(self.make_folio if layout.tipo_mensaje == 'P' else
+                              lambda instrument, fecha_hora: rng.randint(1, max(self.folio, 1)))
+            elif name == 'volumen':
+                makers.append(lambda instrument, fecha_hora: rng.randint(1, 100) * 100)
+            elif name == 'importe':
+                makers.append(lambda instrument, fecha_hora: rng.randint(1, 1000000) * 100000000)
+            elif tipo in BMV_SYNTHETIC_PRICE_UNITS:
+                units = BMV_SYNTHETIC_PRICE_UNITS[tipo]
+                makers.append(lambda instrument, fecha_hora, units=units:
+                              round(self.move_price(instrument) * units))
+            else:
+                limit = BMV_SYNTHETIC_INT_LIMITS[tipo]
+                makers.append(lambda instrument, fecha_hora, limit=limit: rng.randint(1, limit))
+        return makers
+
+    def make_folio(self, instrument, fecha_hora) -> int:
+        self.folio += 1
+        return self.folio
+
+    def move_price(self, instrument: int) -> float:
+        '''Moves the price of an instrument up to 0.1% and returns it'''
+        price = max(round(self.prices[instrument] * (1 + self.rng.uniform(-0.001, 0.001)), 2), 0.01)
+        self.prices[instrument] = price
+        return price
+
+    def message(self, tipo_mensaje: str, instrument: int, fecha_hora: int) -> bytes:
+        '''Returns the bytes of a message (without its longitud)'''
+        values = [maker(instrument, fecha_hora) for maker in self.makers[tipo_mensaje]]
+        if tipo_mensaje == 'P':
+            values[9] = values[3] * values[4]  # importe is volumen * precio, in precio8 units as precio
+        return BMV_LAYOUTS_BY_TIPO[tipo_mensaje].struct.pack(*values)
+
+    def packet(self, grupo_market_data: int, mensajes: list) -> bytes:
+        '''Returns a packet with the header and the given messages, and moves the secuencia of its grupo'''
+        body = b''.join(BMV_LONGITUD_STRUCT.pack(len(mensaje)) + mensaje for mensaje in mensajes)
+        secuencia = self.sequences[grupo_market_data]
+        self.sequences[grupo_market_data] += len(mensajes)
+        return BMV_HEADER_STRUCT.pack(HEADER_SIZE + len(body), len(mensajes), grupo_market_data, self.sesion,
+                                      secuencia, self.time // 1000) + body
+
+    def iter_pack(self, grupo_market_data: int, tipos):
+        '''Packs the (tipo_mensaje, instrument) messages in packets. Yields (timestamp, grupo_market_data, payload)'''
+        mensajes = []
+        size = HEADER_SIZE
+        count = self.rng.randint(*self.messages_per_packet)
+        for tipo_mensaje, instrument in tipos:
+            length = BMV_LAYOUTS_BY_TIPO[tipo_mensaje].length
+            if mensajes and (len(mensajes) >= count or size + length + 2 > BMV_SYNTHETIC_MAX_PACKET):
+                yield from self.flush(grupo_market_data, mensajes)
+                mensajes = []
+                size = HEADER_SIZE
+                count = self.rng.randint(*self.messages_per_packet)
+            mensajes.append(self.message(tipo_mensaje, instrument, self.time // 1000))
+            size += length + 2
+        if mensajes:
+            yield from self.flush(grupo_market_data, mensajes)
+
+    def flush(self, grupo_market_data: int, mensajes: list):
+        '''Yields the packet of the messages, then moves the time by the gap that rate gives to them'''
+        yield self.time / 1000000.0, grupo_market_data, self.packet(grupo_market_data, mensajes)
+        self.time += max(round(self.rng.expovariate(self.rate / len(mensajes)) * 1000000), 1)
+
+    def iter_catalog_packets(self):
+        '''Yields the grupo 40 packets with one catalog (by catalog_mix) per instrument'''
+        if not self.catalog_mix:
+            return
+        tipos = self.rng.choices(list(self.catalog_mix), list(self.catalog_mix.values()), k=len(self.instruments))
+        yield from self.iter_pack(40, zip(tipos, self.instruments))
+
+    def iter_messages(self, messages: int):
+        '''Yields (tipo_mensaje, instrument) for messages grupo 18 messages, by mix and instrument popularity'''
+        tipos = list(self.mix)
+        tipo_weights = list(self.mix.values())
+        for start in range(0, messages, 10000):
+            k = min(10000, messages - start)
+            yield from zip(self.rng.choices(tipos, tipo_weights, k=k),
+                           self.rng.choices(self.instruments, self.instrument_weights, k=k))
+
+    def iter_packets(self, messages: int):
+        '''Yields (timestamp, grupo_market_data, payload) for the catalogs and then messages grupo 18 messages,
+        same as bmv_utils.multicast.iter_bmv_feed_packets so they can be published'''
+        yield from self.iter_catalog_packets()
+        yield from self.iter_pack(18, self.iter_messages(messages))
+
+
+def write_bmv_pcap(output_file, packets, destinations: dict, source: tuple = ('10.0.0.1', 10000),
+                   buffer_size: int = 1 << 20) -> int:
+    '''Writes (timestamp, grupo_market_data, payload) packets to a pcap file, as UDP packets to the (address, port)
+    destination of their grupo. Returns the bytes written'''
+    output = bytearray(pack_pcap_global_header())
+    written = 0
+    for timestamp, grupo_market_data, payload in packets:
+        output += pack_pcap_record(timestamp, build_udp_frame(payload, destinations[grupo_market_data], source))
+        if len(output) >= buffer_size:
+            output_file.write(output)
+            written += len(output)
+            output.clear()
+    output_file.write(output)
+    return written + len(output)
@@ -6,44 +6,9 @@ If something comes, prints the summary of the information.
 
 import socket
 import bmv_utils.parse
+from bmv_utils.multicast import BMV_MULTICAST_FEEDS
 
 
-# Producto 18 PROD
-BMV_PROD18_PROD_GROUP_A = "239.100.100.18"  # Grupo UDP para producto 18 de BMV, feed A
-BMV_PROD18_PROD_PORT_A = 12121
-BMV_PROD18_PROD_GROUP_B = "239.100.200.18"  # Grupo UDP para producto 18 de BMV, feed B
-BMV_PROD18_PROD_PORT_B = 12122
-
-# Producto 18 DRP
-BMV_PROD18_DRP_GROUP_A = "239.150.100.18"  # Grupo UDP para producto 18 de BMV, feed A
-BMV_PROD18_DRP_PORT_A = 12131
-BMV_PROD18_DRP_GROUP_B = "239.150.200.18"  # Grupo UDP para producto 18 de BMV, feed B
-BMV_PROD18_DRP_PORT_B = 12132
-
-# Producto 18 TEST
-BMV_PROD18_DRP_GROUP_A = "239.200.100.18"  # Grupo UDP para producto 18 de BMV, feed A
-BMV_PROD18_DRP_PORT_A = 12141
-BMV_PROD18_DRP_GROUP_B = "239.200.200.18"  # Grupo UDP para producto 18 de BMV, feed B
-BMV_PROD18_DRP_PORT_B = 12142
-
-# Producto 40 PROD
-BMV_PROD40_PROD_GROUP_A = "239.100.100.40"  # Grupo UDP para producto 18 de BMV, feed A
-BMV_PROD40_PROD_PORT_A = 12121
-BMV_PROD40_PROD_GROUP_B = "239.100.200.40"  # Grupo UDP para producto 18 de BMV, feed B
-BMV_PROD40_PROD_PORT_B = 12122
-
-# Producto 40 DRP
-BMV_PROD40_DRP_GROUP_A = "239.150.100.40"  # Grupo UDP para producto 18 de BMV, feed A
-BMV_PROD40_DRP_PORT_A = 12131
-BMV_PROD40_DRP_GROUP_B = "239.150.200.40"  # Grupo UDP para producto 18 de BMV, feed B
-BMV_PROD40_DRP_PORT_B = 12132
-
-# Producto 40 TEST
-BMV_PROD40_TEST_GROUP_A = "239.200.100.40"  # Grupo UDP para producto 18 de BMV, feed A
-BMV_PROD40_TEST_PORT_A = 12141
-BMV_PROD40_TEST_GROUP_B = "239.200.200.40"  # Grupo UDP para producto 18 de BMV, feed B
-BMV_PROD40_TEST_PORT_B = 12142
-
 def setup_UDP_server(group, port):
     """
     Sets up a udp socket to receive packets on group and port
@@ -88,28 +53,13 @@ def check_BMV_producto(group, port, label):
 
 if __name__ == '__main__':
     counter_msgs = {}
-    print("PROD")
-    print("PRODUCTO 18")
-    check_BMV_producto(BMV_PROD18_PROD_GROUP_A, BMV_PROD18_PROD_PORT_A, "Puerto A")
-    check_BMV_producto(BMV_PROD18_PROD_GROUP_B, BMV_PROD18_PROD_PORT_B, "Puerto B")
-    print("PRODUCTO 40")
-    check_BMV_producto(BMV_PROD40_PROD_GROUP_A, BMV_PROD40_PROD_PORT_A, "Puerto A")
-    check_BMV_producto(BMV_PROD40_PROD_GROUP_B, BMV_PROD40_PROD_PORT_B, "Puerto B")
-    print("DRP")
-    print("PRODUCTO 18")
-    check_BMV_producto(BMV_PROD18_DRP_GROUP_A, BMV_PROD18_DRP_PORT_A, "Puerto A")
-    check_BMV_producto(BMV_PROD18_DRP_GROUP_B, BMV_PROD18_DRP_PORT_B, "Puerto B")
-    print("PRODUCTO 40")
-    check_BMV_producto(BMV_PROD40_DRP_GROUP_A, BMV_PROD40_DRP_PORT_A, "Puerto A")
-    check_BMV_producto(BMV_PROD40_DRP_GROUP_B, BMV_PROD40_DRP_PORT_B, "Puerto B")
-    print("TEST")
-    print("PRODUCTO 18")
-    check_BMV_producto(BMV_PROD18_DRP_GROUP_A, BMV_PROD18_DRP_PORT_A, "Puerto A")
-    check_BMV_producto(BMV_PROD18_DRP_GROUP_B, BMV_PROD18_DRP_PORT_B, "Puerto B")
-    print("PRODUCTO 40")
-    check_BMV_producto(BMV_PROD40_TEST_GROUP_A, BMV_PROD40_TEST_PORT_A, "Puerto A")
-    check_BMV_producto(BMV_PROD40_TEST_GROUP_B, BMV_PROD40_TEST_PORT_B, "Puerto B")
-    
+    for ambiente in ('PROD', 'DRP', 'TEST'):
+        print(ambiente)
+        for producto in (18, 40):
+            print(f"PRODUCTO {producto}")
+            for feed in ('A', 'B'):
+                group, port = BMV_MULTICAST_FEEDS[(ambiente, producto, feed)]
+                check_BMV_producto(group, port, f"Puerto {feed}")
 
 
 # Paquete de prueba
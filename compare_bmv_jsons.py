@@ -3,11 +3,12 @@ Whenever you find a timestamp, compare it with the dateutil.parser library funct
 otherwise, use asserts to compare the two.
 """
 
+import argparse
 import json
 from  bmv_utils.compare import *
 import sys
 
-def compare_bmv_producto_jsons(expected_output, actual_output):
+def compare_bmv_producto_jsons(expected_output, actual_output, comparers=None):
     is_equal = True
     with open(expected_output, 'r') as expected_file:
         with open(actual_output, 'r') as actual_file:
@@ -18,7 +19,7 @@ def compare_bmv_producto_jsons(expected_output, actual_output):
                 expected_json = json.loads(expected_line)
                 try:
                     actual_json = json.loads(actual_line)
-                    is_equal = compare_bmv_message_json(expected_json, actual_json) and is_equal
+                    is_equal = compare_bmv_message_json(expected_json, actual_json, comparers) and is_equal
                 except AssertionError as e:
                     print(f"Assertion failed: {e}")
                     is_equal = False
@@ -28,13 +29,81 @@ def compare_bmv_producto_jsons(expected_output, actual_output):
     return is_equal
 
 
+def compare_bmv_producto_jsons_by_key(expected_output, actual_output, join='auto',
+                                      memory_limit=BMV_JOIN_MEMORY_LIMIT, directory=None, workers=1, max_examples=100,
+                                      comparers=None):
+    '''Compare the messages of both files that have the same key, wherever they are in the files.
+    Keys only in expected_output are missing, keys only in actual_output are extra.
+    With more than one worker, the files are split by key and the parts are compared in parallel.
+    Returns the summary of the comparison, see bmv_utils.compare.new_bmv_compare_summary.'''
+    if workers > 1:
+        return compare_bmv_jsons_parallel(expected_output, actual_output, workers, join, memory_limit, directory,
+                                          max_examples, comparers)
+    return compare_bmv_joined_lines(join_bmv_jsons(expected_output, actual_output, join, memory_limit, directory),
+                                    max_examples, comparers)
+
+
+def parse_tolerances(value):
+    '''Parses FIELD=TOLERANCE pairs separated by commas'''
+    tolerances = {}
+    for pair in value.split(','):
+        field, tolerance = pair.split('=')
+        tolerances[field] = float(tolerance)
+    return tolerances
+
+
+def print_bmv_compare_summary(summary):
+    for example in summary['examples']:
+        if example['category'] == 'missing':
+            print(f"Missing: {example['key']} ({example['tipoMensaje']})")
+        elif example['category'] == 'extra':
+            print(f"Extra: {example['key']} ({example['tipoMensaje']})")
+        else:
+            differences = ', '.join(f'{field} {expected!r} != {actual!r}'
+                                    for field, expected, actual in example['differences'])
+            print(f"Different: key {example['key']} ({example['tipoMensaje']}): {differences}")
+    for tipo_mensaje, counts in sorted(summary['by tipo'].items(), key=lambda item: str(item[0])):
+        print(f"{tipo_mensaje}: " + ', '.join(f'{category} {count}' for category, count in counts.items()))
+        for field, count in sorted(summary['by field'].get(tipo_mensaje, {}).items()):
+            print(f"    {field}: {count} different")
+    counts = summary['counts']
+    print(f"equal {counts['equal']}, different {counts['different']}, "
+          f"missing {counts['missing']}, extra {counts['extra']}")
+
+
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print('[Error] Usage: compare_bmv_jsons.py expected.json actual.json')
-        print('Compare two json files, one is the expected output, the other is the actual output.')
-        sys.exit(1)
-    expected_output = sys.argv[1]
-    actual_output = sys.argv[2]
-    is_equal = compare_bmv_producto_jsons(expected_output, actual_output)
-    print(f"{expected_output} is equal to {actual_output}? {is_equal}")
-            
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description='Compare two json files, one is the expected output, the other is the actual output.')
+    parser.add_argument('expected_output', metavar='expected.json')
+    parser.add_argument('actual_output', metavar='actual.json')
+    parser.add_argument('--mode', choices=('key', 'lines'), default='key',
+                        help='Pair the messages by their key, or line by line as they come (default: key)')
+    parser.add_argument('--join', choices=BMV_JOINS, default='auto',
+                        help='With --mode key: merge of files sorted by key, hash join of files in any order, '
+                             'or merge when both are sorted (default: auto)')
+    parser.add_argument('--memory-limit', type=int, default=BMV_JOIN_MEMORY_LIMIT,
+                        help='Bytes of memory for the lines of actual.json joined in memory, about %d times its size '
+                             'on disk, bigger files are split on disk (default: %%(default)s)' % BMV_JOIN_MEMORY_OVERHEAD)
+    parser.add_argument('--temp-directory', help='Where to split the files that do not fit in memory')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='With --mode key: processes comparing parts of the files in parallel (default: 1)')
+    parser.add_argument('--max-examples', type=int, default=100,
+                        help='With --mode key: differences printed, the rest are only counted (default: 100)')
+    parser.add_argument('--tolerance', type=parse_tolerances, default={}, metavar='FIELD=TOLERANCE,...',
+                        help='Absolute tolerance of prices, by field name or by price type precio4 or precio8, '
+                             'like precio8=0.000001,importe=0.01 (default: exact)')
+    parser.add_argument('--ignore', type=lambda value: tuple(filter(None, value.split(','))),
+                        default=BMV_COMPARE_IGNORE, metavar='FIELD,...',
+                        help='Fields not compared, separated by commas (default: %s)' % ','.join(BMV_COMPARE_IGNORE))
+    args = parser.parse_args()
+    comparers = compile_bmv_comparers(args.tolerance, args.ignore)
+    if args.mode == 'lines':
+        is_equal = compare_bmv_producto_jsons(args.expected_output, args.actual_output, comparers)
+    else:
+        summary = compare_bmv_producto_jsons_by_key(args.expected_output, args.actual_output, args.join,
+                                                    args.memory_limit, args.temp_directory, args.workers,
+                                                    args.max_examples, comparers)
+        print_bmv_compare_summary(summary)
+        counts = summary['counts']
+        is_equal = counts['different'] + counts['missing'] + counts['extra'] == 0
+    print(f"{args.expected_output} is equal to {args.actual_output}? {is_equal}")
@@ -0,0 +1,34 @@
+#! /usr/bin/env python
+"""
+Compares two captures of BMV traffic, like the one of our recorder against the one of the reference box,
+straight from the pcap files. Packets are paired by grupo_market_data, sesion and secuencia and compared as bytes,
+only the messages that differ are decoded.
+"""
+import argparse
+
+from bmv_utils.compare import BMV_COMPARE_IGNORE, compile_bmv_comparers
+from bmv_utils.diff import diff_bmv_pcaps
+from compare_bmv_jsons import parse_tolerances, print_bmv_compare_summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two pcap files from BMV, one is the expected capture, '
+                                                 'the other is the actual capture.')
+    parser.add_argument('expected_filename', metavar='expected.pcap')
+    parser.add_argument('actual_filename', metavar='actual.pcap')
+    parser.add_argument('--max-examples', type=int, default=100,
+                        help='Differences printed, the rest are only counted (default: 100)')
+    parser.add_argument('--tolerance', type=parse_tolerances, default={}, metavar='FIELD=TOLERANCE,...',
+                        help='Absolute tolerance of prices of decoded messages, by field name or by price type '
+                             'precio4 or precio8 (default: exact)')
+    parser.add_argument('--index-directory',
+                        help='Where to build the indexes of captures that have none, created if needed '
+                             '(default: a temporary directory)')
+    args = parser.parse_args()
+    summary = diff_bmv_pcaps(args.expected_filename, args.actual_filename, args.max_examples,
+                             compile_bmv_comparers(args.tolerance, BMV_COMPARE_IGNORE), args.index_directory)
+    print_bmv_compare_summary(summary)
+    print('packets ' + ', '.join(f'{category} {count}' for category, count in summary['packets'].items()))
+    counts = summary['counts']
+    is_equal = counts['different'] + counts['missing'] + counts['extra'] == 0
+    print(f"{args.expected_filename} is equal to {args.actual_filename}? {is_equal}")
@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+"""
+Generates synthetic BMV traffic, grupo 18 messages and grupo 40 catalogs, into a pcap file or to a multicast feed.
+"""
+import argparse
+from datetime import datetime
+
+import bmv_utils.multicast
+import bmv_utils.parse
+import bmv_utils.synthetic
+
+
+def parse_mix(value):
+    """Parses TIPO=WEIGHT pairs separated by commas, like P=30,O=50"""
+    mix = {}
+    for pair in value.split(','):
+        tipo_mensaje, weight = pair.split('=')
+        assert tipo_mensaje in bmv_utils.parse.BMV_LAYOUTS_BY_TIPO, f'Unknown tipoMensaje {tipo_mensaje}'
+        mix[tipo_mensaje] = float(weight)
+    return mix
+
+
+def parse_range(value):
+    """Parses MIN-MAX, or a single number for both"""
+    minimum, _, maximum = value.partition('-')
+    return int(minimum), int(maximum or minimum)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generates reproducible synthetic BMV packets, into a pcap file or published to multicast groups')
+    parser.add_argument('pcap_filename', metavar='file.pcap', nargs='?', help='pcap file to write')
+    parser.add_argument('--publish', action='store_true', help='Send the packets to the multicast feed instead')
+    parser.add_argument('--messages', type=int, default=1000000, help='grupo 18 messages to generate (default: 1000000)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generator, same seed same packets (default: 0)')
+    parser.add_argument('--instruments', type=int, default=500, help='Number of instruments (default: 500)')
+    parser.add_argument('--mix', type=parse_mix, help='Weights of the grupo 18 messages (default: %s)' % ','.join(
+        f'{tipo}={weight}' for tipo, weight in bmv_utils.synthetic.BMV_SYNTHETIC_MIX.items()))
+    parser.add_argument('--catalog-mix', type=parse_mix, help='Weights of the catalogs of grupo 40 (default: %s)' % ','.join(
+        f'{tipo}={weight}' for tipo, weight in bmv_utils.synthetic.BMV_SYNTHETIC_CATALOG_MIX.items()))
+    parser.add_argument('--no-catalogs', action='store_true', help='Do not generate grupo 40 packets')
+    parser.add_argument('--messages-per-packet', type=parse_range, default=(1, 8), metavar='MIN-MAX',
+                        help='Messages in each packet (default: 1-8)')
+    parser.add_argument('--rate', type=float, default=10000.0, help='Average messages per second (default: 10000)')
+    parser.add_argument('--start-time', type=datetime.fromisoformat, default=datetime(2022, 10, 19, 8, 30),
+                        help='Local time of the first packet (default: 2022-10-19T08:30:00)')
+    parser.add_argument('--first-sequence', type=int, default=1, help='secuencia of the first grupo 18 message (default: 1)')
+    parser.add_argument('--environment', choices=('PROD', 'DRP', 'TEST'), default='TEST',
+                        help='Feed A of this environment is the destination of the packets (default: TEST)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='With --publish, times faster than the rate, 0 is as fast as possible (default: 1)')
+    parser.add_argument('--interface', help='With --publish, address of the interface to send from')
+    args = parser.parse_args()
+    if not args.publish and args.pcap_filename is None:
+        parser.error('a pcap file or --publish is required')
+
+    generator = bmv_utils.synthetic.BmvSyntheticGenerator(
+        args.seed, args.instruments, args.mix, {} if args.no_catalogs else args.catalog_mix, args.messages_per_packet,
+        args.rate, bmv_utils.parse.bmv_epoch_milliseconds(args.start_time), args.first_sequence)
+    destinations = {grupo: destination for (environment, grupo, feed), destination
+                    in bmv_utils.multicast.BMV_MULTICAST_FEEDS.items() if environment == args.environment and feed == 'A'}
+    packets = generator.iter_packets(args.messages)
+    if args.publish:
+        udp_socket = bmv_utils.multicast.make_bmv_multicast_socket(interface=args.interface)
+        try:
+            counters = bmv_utils.multicast.publish_bmv_packets(
+                packets, {grupo: [destination] for grupo, destination in destinations.items()}, udp_socket, args.speed)
+        finally:
+            udp_socket.close()
+        print(f"{counters['packets']} packets ({counters['bytes']} bytes) in {counters['seconds']:.3f} s, "
+              f"{counters['packets/sec']:.0f} packets/sec")
+    else:
+        with open(args.pcap_filename, 'wb') as output_file:
+            size = bmv_utils.synthetic.write_bmv_pcap(output_file, packets, destinations)
+        print(f'{args.messages} messages, {size} bytes written to {args.pcap_filename}')
@@ -0,0 +1,34 @@
+#! /usr/bin/env python
+"""
+Builds the sequence index of a pcap file from BMV, and prints ranges of its messages using the index.
+"""
+import argparse
+import json
+from datetime import datetime
+
+import bmv_utils.index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Indexes the packets of a pcap file from BMV by secuencia, or prints a range of its messages as json lines')
+    parser.add_argument('pcap_filename', metavar='file.pcap')
+    parser.add_argument('--index', dest='index_filename', help='Index file (default: file.pcap.idx)')
+    parser.add_argument('--first-sequence', type=int, help='Print the messages from this secuencia')
+    parser.add_argument('--last-sequence', type=int, help='Print the messages up to this secuencia (included)')
+    parser.add_argument('--start-time', type=datetime.fromisoformat,
+                        help='Print the messages from this local time, like 2022-10-19T09:00:00')
+    parser.add_argument('--end-time', type=datetime.fromisoformat, help='Print the messages before this local time')
+    parser.add_argument('--grupo', type=int, default=18, help='grupo_market_data of the messages (default: 18)')
+    args = parser.parse_args()
+    if all(value is None for value in (args.first_sequence, args.last_sequence, args.start_time, args.end_time)):
+        index_filename = bmv_utils.index.build_bmv_index(args.pcap_filename, args.index_filename)
+        with bmv_utils.index.BmvIndex(index_filename) as index:
+            print(f'{len(index)} packets indexed in {index_filename}')
+    else:
+        index_filename = args.index_filename or bmv_utils.index.bmv_index_filename(args.pcap_filename)
+        with bmv_utils.index.BmvIndex(index_filename, args.pcap_filename) as index:
+            for mensaje in bmv_utils.index.iter_bmv_indexed_messages(
+                    args.pcap_filename, args.first_sequence, args.last_sequence, args.start_time, args.end_time,
+                    args.grupo, index=index):
+                print(json.dumps(mensaje))
@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+"""
+Listens to the multicast feeds of BMV and prints the health of each one every few seconds: packets and messages
+received, sequence gaps, packets out of order or duplicated, decoding errors and latency from the exchange.
+"""
+import argparse
+import json
+import time
+
+import bmv_utils.feed
+import bmv_utils.multicast
+
+
+def print_feed_stats(label, stats, previous, elapsed):
+    '''Prints the statistics of a feed, with the rate of messages over the elapsed seconds since previous'''
+    rate = (stats['messages'] - previous.get('messages', 0)) / elapsed if elapsed > 0 else 0.0
+    latency = stats.get('latency ms')
+    latency = f", latency p50 {latency['p50']:.1f} p99 {latency['p99']:.1f} max {latency['max']:.1f} ms" if latency else ''
+    print(f"{label}: sq {stats['last sequence']}, {stats['packets']} packets, {stats['messages']} messages "
+          f"({rate:,.0f}/sec), gaps {stats['gaps']} (missing {stats['missing']}), "
+          f"out of order {stats['out of order']} (recovered {stats['recovered']}), duplicates {stats['duplicates']}, "
+          f"errors {stats['errors']}, dropped {stats['dropped']}{latency}")
+    if stats['errors'] > previous.get('errors', 0):
+        print(f"    last error: {stats['last error']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Receives the BMV multicast feeds and reports their health')
+    parser.add_argument('--environment', dest='environments', action='append', choices=('PROD', 'DRP', 'TEST'),
+                        help='Environment of the feeds, can be repeated (default: PROD)')
+    parser.add_argument('--grupos', type=lambda value: [int(grupo) for grupo in value.split(',')], default=[18, 40],
+                        help='grupo_market_data of the feeds, separated by commas (default: 18,40)')
+    parser.add_argument('--feeds', default='AB', help='Feeds to listen to, A, B or AB (default: AB)')
+    parser.add_argument('--interface', default='0.0.0.0',
+                        help='Address of the interface to join the groups on (default: the one of the route)')
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between reports (default: 5)')
+    parser.add_argument('--duration', type=float, help='Seconds to listen before stopping (default: until Ctrl-C)')
+    parser.add_argument('--no-validate', dest='validate', action='store_false',
+                        help='Decode the messages without checking their values against the catalogs')
+    parser.add_argument('--slots', type=int, default=bmv_utils.feed.BMV_FEED_SLOTS,
+                        help='Packets that can wait to be decoded before new ones are dropped (default: %(default)s)')
+    parser.add_argument('--output', metavar='stats.json', help='Save the last statistics of every feed as json')
+    args = parser.parse_args()
+
+    environments = args.environments or ['PROD']
+    feeds = {f'{environment} {grupo} {feed}': destination
+             for (environment, grupo, feed), destination in bmv_utils.multicast.BMV_MULTICAST_FEEDS.items()
+             if environment in environments and grupo in args.grupos and feed in args.feeds}
+    for label, (group, port) in feeds.items():
+        print(f'{label}: {group}:{port}')
+
+    previous = {label: {} for label in feeds}
+    stats = {}
+    start = last_report = time.monotonic()
+    with bmv_utils.feed.BmvFeedHandler(feeds, args.interface, args.validate, args.slots) as handler:
+        try:
+            while args.duration is None or time.monotonic() - start < args.duration:
+                wait = args.interval if args.duration is None else min(args.interval,
+                                                                       args.duration - (time.monotonic() - start))
+                time.sleep(max(wait, 0))
+                stats = handler.snapshot()
+                now = time.monotonic()
+                for label, feed_stats in stats.items():
+                    print_feed_stats(label, feed_stats, previous[label], now - last_report)
+                previous, last_report = stats, now
+        except KeyboardInterrupt:
+            stats = handler.snapshot()
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(stats, output_file, indent=2)
+        print(f'Statistics saved in {args.output}')
@@ -2,7 +2,10 @@
 """
 Reads a pcap file from BMV and generates messages inside the pcap file in json format.
 """
-import sys
+import argparse
+from datetime import datetime
+
+import bmv_utils.output
 import bmv_utils.parse
 
 # Note on networking info.
@@ -11,13 +14,42 @@ import bmv_utils.parse
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print('[Error] Usage: parse_bmv_pcap.py [file.pcap] [output.json]')
-        print('Reads the pcap file assuming is capture from BMV multicast and generates a json file with the messages')
-        sys.exit(1)
-    pcap_filename = sys.argv[1]
-    json_output_filename = sys.argv[2]
-    counter_msgs = bmv_utils.parse.parse_bmv_pcap_file(open(pcap_filename, 'rb'), open(json_output_filename, 'wt'))
+    parser = argparse.ArgumentParser(
+        description='Reads the pcap file assuming is capture from BMV multicast and generates a json file with the messages')
+    parser.add_argument('pcap_filename', metavar='file.pcap')
+    parser.add_argument('output_filename', metavar='output.json',
+                        help='json lines file, or directory with one table per tipoMensaje for parquet and arrow')
+    parser.add_argument('--format', dest='output_format', choices=bmv_utils.output.BMV_OUTPUT_FORMATS, default='jsonl',
+                        help='Format of the output (default: jsonl)')
+    parser.add_argument('--json-encoder', choices=bmv_utils.output.BMV_JSON_ENCODERS, default='json',
+                        help='Encoder for jsonl. orjson is faster but its lines are compact json (default: json)')
+    parser.add_argument('--validation', choices=bmv_utils.parse.BMV_VALIDATION_LEVELS, default='strict',
+                        help='Checks of the parsed fields: every message, 1 in every --sample-every packets, or none (default: strict)')
+    parser.add_argument('--sample-every', type=int, default=bmv_utils.parse.BMV_VALIDATION_SAMPLE_EVERY,
+                        help='Packets per checked packet with --validation sampled (default: %(default)s)')
+    parser.add_argument('--types', type=lambda value: value.split(','),
+                        help='Only write these tipoMensaje, separated by commas, like P,O')
+    parser.add_argument('--instruments', type=lambda value: [int(instrument) for instrument in value.split(',')],
+                        help='Only write the messages of these numeroInstrumento, separated by commas')
+    parser.add_argument('--first-sequence', type=int, help='Only write messages from this secuencia')
+    parser.add_argument('--last-sequence', type=int, help='Only write messages up to this secuencia (included)')
+    parser.add_argument('--start-time', type=datetime.fromisoformat,
+                        help='Only write the packets from this local time, like 2022-10-19T09:00:00')
+    parser.add_argument('--end-time', type=datetime.fromisoformat, help='Only write the packets before this local time')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes to parse the pcap file in parallel, by byte ranges (default: 1)')
+    args = parser.parse_args()
+    bmv_filter = bmv_utils.parse.make_bmv_filter(args.types, args.instruments, args.first_sequence, args.last_sequence,
+                                                 args.start_time, args.end_time)
+    if args.workers > 1:
+        counter_msgs = bmv_utils.parse.parse_bmv_pcap_file_parallel(args.pcap_filename, args.output_filename,
+                                                                    args.workers, args.output_format, args.json_encoder,
+                                                                    args.validation, args.sample_every, bmv_filter)
+    else:
+        writer = bmv_utils.output.open_bmv_writer(args.output_filename, args.output_format, json_encoder=args.json_encoder)
+        counter_msgs = bmv_utils.parse.parse_bmv_pcap_file(open(args.pcap_filename, 'rb'), writer,
+                                                           args.validation, args.sample_every, bmv_filter)
+        writer.close()
     for key in counter_msgs:
         counter_msgs[key]['avg size'] = counter_msgs[key]['bytes'] / counter_msgs[key]['total']
     print(counter_msgs)
@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+"""
+Publishes the packets of a pcap file from BMV as a multicast feed, to test the handlers of the feed.
+"""
+import argparse
+
+import bmv_utils.multicast
+
+
+def parse_destination(value):
+    """Parses GRUPO=ADDRESS:PORT, like 18=239.200.100.18:12141"""
+    grupo, address = value.split('=')
+    group, port = address.rsplit(':', 1)
+    return int(grupo), (group, int(port))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Sends the UDP payloads of a pcap file from BMV to multicast groups, '
+                    'at the recorded rate, N times faster or as fast as possible')
+    parser.add_argument('pcap_filename', metavar='file.pcap')
+    parser.add_argument('--destination', dest='destinations', type=parse_destination, action='append',
+                        metavar='GRUPO=ADDRESS:PORT',
+                        help='Where to send the packets of a grupo_market_data, can be repeated '
+                             '(default: feed A of --environment for grupos 18 and 40)')
+    parser.add_argument('--environment', choices=('PROD', 'DRP', 'TEST'), default='TEST',
+                        help='Environment of the default destinations (default: TEST)')
+    parser.add_argument('--feeds', default='A', help='Feeds of the default destinations, A, B or AB (default: A)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Times faster than recorded, 0 is as fast as possible (default: 1)')
+    parser.add_argument('--first-sequence', type=int, help='Send from the packet with this secuencia')
+    parser.add_argument('--last-sequence', type=int, help='Send up to the packet with this secuencia')
+    parser.add_argument('--batch-window', type=float, default=0.0002,
+                        help='Packets due within these seconds of each other are sent together (default: 0.0002)')
+    parser.add_argument('--batch-size', type=int, default=64, help='Most packets sent together (default: 64)')
+    parser.add_argument('--ttl', type=int, default=1, help='Multicast TTL (default: 1, the local network)')
+    parser.add_argument('--interface', help='Address of the interface to send from (default: the one of the route)')
+    args = parser.parse_args()
+
+    destinations = {}
+    if args.destinations:
+        for grupo, destination in args.destinations:
+            destinations.setdefault(grupo, []).append(destination)
+    else:
+        for (environment, grupo, feed), destination in bmv_utils.multicast.BMV_MULTICAST_FEEDS.items():
+            if environment == args.environment and feed in args.feeds:
+                destinations.setdefault(grupo, []).append(destination)
+    for grupo, targets in sorted(destinations.items()):
+        print(f'grupo {grupo} -> {", ".join(f"{group}:{port}" for group, port in targets)}')
+
+    udp_socket = bmv_utils.multicast.make_bmv_multicast_socket(args.ttl, interface=args.interface)
+    packets = bmv_utils.multicast.iter_bmv_feed_packets(args.pcap_filename, set(destinations),
+                                                        args.first_sequence, args.last_sequence)
+    try:
+        counters = bmv_utils.multicast.publish_bmv_packets(packets, destinations, udp_socket, args.speed,
+                                                           args.batch_window, args.batch_size)
+    finally:
+        udp_socket.close()
+    print(f"{counters['packets']} packets ({counters['bytes']} bytes) in {counters['seconds']:.3f} s, "
+          f"{counters['packets/sec']:.0f} packets/sec, most behind schedule {counters['max delay'] * 1000:.3f} ms")
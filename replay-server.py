@@ -1,250 +1,333 @@
-#! /usr/bin/env python
-"""
-Script para responder a solicitudes de retransmisión estilo BMV
-"""
-
-
-import socket
-from time import time
-
-# Constants
-HEADER_SIZE = 17
-LENGTH_SIZE = 2
-
-
-def main_loop():
-    """Waits for connections and returns replay requests"""
-    while True:
-
-        # Wait for a connection
-        print('Esperando por una conexión...')
-        connection, client_address = sock.accept()
-
-        try:
-            print(f'Conexión de cliente desde: {str(client_address[0])}')
-
-            # Receive the data in small chunks and retransmit it
-            while True:
-                data = connection.recv(19)
-                if data:
-                    print('Información recibida analizando...')
-                    if data[0] != 19:
-                        print(f'El tamaño de los datos no es el esperado [{str(data[0])}] ignoramos al cliente')
-                        print('Cerramos la conexión...')
-                        connection.close()
-                        break
-
-                    if data[1] != 33:
-                        print(f'El tipo de mensaje no es el esperado [{str(data[1])}] ignoramos al cliente')
-                        print('Cerramos la conexión...')
-                        connection.close()
-                        break
-
-                    if data[2] != 18:
-                        print(f'El código de grupo no es el esperado [{str(data[2])}] respondemos al cliente B')
-
-                        connection.sendall(fill_login_response('B'))
-                        print('Cerramos la conexión...')
-                        connection.close()
-                        break
-
-                    print(f'Solicitud de sesion grupo: {data[2]} usuario: {str(data[3:9])}, passw: {str(data[9:19])}')
-                    print('Respondemos al cliente A')
-
-                    connection.sendall(fill_login_response('A'))
-
-                    data2 = connection.recv(9)
-
-                    if data2:
-                        print('Información recibida nuevamente, analizando...')
-                        if data2[0] != 9:
-                            print(f'El tamaño de los datos no es el esperado [{str(data2[0])}] ignoramos al cliente')
-                            print('Cerramos la conexión...')
-                            connection.close()
-                            break
-                        if data2[1] != 35:
-                            print(f'El tipo de mensaje no es el esperado [{str(data2[1])}] ignoramos al cliente')
-                            print('Cerramos la conexión...')
-                            connection.close()
-                            break
-
-                        if data2[2] != 18:
-                            print(f'El código de grupo no es el esperado [{str(data2[2])}] respondemos al cliente B')
-                            connection.sendall(fill_replay_response('B', 0, 0, 0))
-                            print('Cerramos la conexión...')
-                            connection.close()
-                            break
-
-                        first_message_array = data2[3:7]
-                        first_message = int.from_bytes(first_message_array, 'big')
-
-                        if first_message < 0:
-                            print(f'El primer mensaje no es válido [{first_message}] respondemos al cliente J')
-                            connection.sendall(fill_replay_response('J', 0, 0, 0))
-                            print('Cerramos la conexión...')
-                            connection.close()
-                            break
-
-                        quantity_array = data2[7:9]
-                        quantity = int.from_bytes(quantity_array, 'big')
-
-                        if quantity < 0:
-                            print(f'La cantidad de mensajes no es válida [{quantity}] respondemos al cliente K')
-                            connection.sendall(fill_replay_response('K', 0, 0, 0))
-                            print('Cerramos la conexión...')
-                            connection.close()
-                            break
-
-                        print(f'Solicitud de re-transmision, grupo: [{data2[2]}], '
-                              f'primera secuencia: {first_message}, cantidad: {quantity}')
-                        print('Respondemos al cliente solicitud aceptada A')
-                        connection.sendall(fill_replay_response('A', data2[2], first_message, quantity))
-
-                        # Aquí enviamos los paquetes
-                        for i in range(first_message, first_message + quantity):
-                            print(f'Enviando paquete con secuencia inicial: {i}')
-                            connection.sendall(fill_replay_packet(i))
-                        print('Cerramos la conexión...')
-                        connection.close()
-                        break
-                else:
-                    print(f'No se obtuvieron más datos de: {str(client_address[0])}')
-                    break
-        except (RuntimeError, TypeError, NameError):
-            print('Ha ocurrido un error. Terminamos la aplicación')
-            return
-
-
-def fill_login_response(response_status):
-    """Returns the correct response for a login"""
-    login_response = bytearray(HEADER_SIZE + LENGTH_SIZE + 2)
-    # HEADER
-    # Length
-    length = HEADER_SIZE + LENGTH_SIZE + 2
-    login_response[0:2] = length.to_bytes(2, 'big')
-    # Total Messages
-    login_response[2] = 1
-    # Market Data Group
-    login_response[3] = 18
-    # Session
-    login_response[4] = 2
-    # Sequence Number
-    sequence_number = 0
-    login_response[5:9] = sequence_number.to_bytes(4, 'big')
-    # Date-Time
-    login_response[9:17] = (int(time()) * 1000 + 123).to_bytes(8, 'big')
-
-    # LENGTH
-    # Length message
-    login_response[HEADER_SIZE:HEADER_SIZE + LENGTH_SIZE] = (int(2)).to_bytes(2, 'big')
-
-    # MESSAGE
-    login_response[HEADER_SIZE + LENGTH_SIZE + 0] = 38  # &
-    login_response[HEADER_SIZE + LENGTH_SIZE + 1] = str.encode(response_status, 'iso_8859_1')[0]
-    return login_response
-
-
-def fill_replay_response(replay_status, group, first_message, quantity):
-    """Returns a replay response"""
-    replay_response = bytearray(HEADER_SIZE + LENGTH_SIZE + 9)
-    # HEADER
-    # Length
-    length = HEADER_SIZE + LENGTH_SIZE + 9
-    replay_response[0:2] = length.to_bytes(2, 'big')
-    # Total Messages
-    replay_response[2] = 1
-    # Market Data Group
-    replay_response[3] = 18
-    # Session
-    replay_response[4] = 2
-    # Sequence Number
-    sequence_number = 0
-    replay_response[5:9] = sequence_number.to_bytes(4, 'big')
-    # Date-Time
-    replay_response[9:17] = (int(time()) * 1000 + 123).to_bytes(8, 'big')
-
-    # LENGTH
-    # Length message
-    replay_response[HEADER_SIZE:HEADER_SIZE + LENGTH_SIZE] = (int(2)).to_bytes(2, 'big')
-
-    # MESSAGE
-    replay_response[HEADER_SIZE + LENGTH_SIZE + 0] = 42  # *
-    replay_response[HEADER_SIZE + LENGTH_SIZE + 1] = group
-    first_message_array = first_message.to_bytes(4, 'big')
-    replay_response[HEADER_SIZE + LENGTH_SIZE + 2:HEADER_SIZE + LENGTH_SIZE + 6] = first_message_array
-    quantity_array = quantity.to_bytes(2, 'big')
-    replay_response[HEADER_SIZE + LENGTH_SIZE + 6:HEADER_SIZE + LENGTH_SIZE + 8] = quantity_array
-    replay_response[HEADER_SIZE + LENGTH_SIZE + 8] = str.encode(replay_status, 'iso_8859_1')[0]
-    return replay_response
-
-
-def fill_replay_packet(sequence):
-    f"""Returns the correct replay packet for the given {sequence}"""
-    replay_packet = bytearray(HEADER_SIZE + LENGTH_SIZE + 52)
-    # HEADER
-    # Length
-    length = HEADER_SIZE + LENGTH_SIZE + 52
-    replay_packet[0:2] = length.to_bytes(2, 'big')
-    # Total Messages
-    replay_packet[2] = 1
-    # Market Data Group
-    replay_packet[3] = 18
-    # Session
-    replay_packet[4] = 2
-    # Sequence Number
-    sequence_number = sequence
-    replay_packet[5:9] = sequence_number.to_bytes(4, 'big')
-    # Date-Time
-    replay_packet[9:17] = (int(time()) * 1000 + 123).to_bytes(8, 'big')
-
-    # LENGTH
-    # Length message
-    replay_packet[HEADER_SIZE:HEADER_SIZE + LENGTH_SIZE] = (int(52)).to_bytes(2, 'big')
-
-    # MESSAGE
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 0] = 80  # P Message type
-    # Instrument Number
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 1:HEADER_SIZE + LENGTH_SIZE + 5] = (int(12345)).to_bytes(4, 'big')
-    # Trade Time
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 5:HEADER_SIZE + LENGTH_SIZE + 13] = (int(time()) * 1000).to_bytes(8, 'big')
-    # Volume
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 13:HEADER_SIZE + LENGTH_SIZE + 17] = (int(200)).to_bytes(4, 'big')
-    # Price
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 17:HEADER_SIZE + LENGTH_SIZE + 25] = (int(1050000000)).to_bytes(8, 'big')
-    # Tipo de concertacion
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 25] = 67  # C
-    # Trade Number
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 26:HEADER_SIZE + LENGTH_SIZE + 30] = sequence_number.to_bytes(4, 'big')
-    # Price Setter
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 30] = 1
-    # Operation type
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 31] = 67  # C
-    # Amount
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 32:HEADER_SIZE + LENGTH_SIZE + 40] = (int(210000000000)).to_bytes(8, 'big')
-    # Buy
-    buy_str = 'GBM  '
-    buy_array = str.encode(buy_str, 'iso_8859_1')
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 40:HEADER_SIZE + LENGTH_SIZE + 45] = buy_array
-    # Sell
-    sell_str = 'HSBC '
-    sell_array = str.encode(sell_str, 'iso_8859_1')
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 45:HEADER_SIZE + LENGTH_SIZE + 50] = sell_array
-    # Settlement
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 50] = 50  # 2
-    # Auction indicator
-    replay_packet[HEADER_SIZE + LENGTH_SIZE + 50] = 32  # space
-    return replay_packet
-
-
-# Create a TCP/IP socket
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-# Bind the socket to the port
-port = 10000
-server_address = ('localhost', port)
-print('Escuchando en el puerto: %d' % port)
-sock.bind(server_address)
-
-# Listen for incoming connections
-sock.listen(1)
-main_loop()
+#! /usr/bin/env python
+"""
+Script para responder a solicitudes de retransmisión estilo BMV
+Con capturas (pcap), responde con los paquetes grabados en ellas; sin capturas, con paquetes P fabricados.
+Atiende a muchos clientes a la vez (asyncio), con límites de cantidad y de solicitudes por cliente.
+"""
+
+
+import argparse
+import asyncio
+import logging
+import logging.handlers
+import queue
+import struct
+from collections import deque
+from time import monotonic, time
+
+from bmv_utils.replay import BmvReplayCaptures
+
+# Constants
+HEADER_SIZE = 17
+LENGTH_SIZE = 2
+LOGIN_SIZE = 19
+REPLAY_REQUEST_SIZE = 9
+LOGIN_TYPE = 33  # !
+REPLAY_REQUEST_TYPE = 35  # #
+# Status of the replay responses. L is from this simulator, the rest are the ones of BMV.
+REPLAY_ACCEPTED = 'A'
+REPLAY_INVALID_GROUP = 'B'
+REPLAY_INVALID_FIRST_MESSAGE = 'J'
+REPLAY_INVALID_QUANTITY = 'K'
+REPLAY_LIMIT_EXCEEDED = 'L'
+
+log = logging.getLogger('replay-server')
+
+
+class ClientRateLimiter:
+    """Allows up to max_requests replay requests per client address in every period of seconds"""
+
+    def __init__(self, max_requests: int, period: float):
+        self.max_requests = max_requests
+        self.period = period
+        self.requests = {}  # Times of the last requests, by client address
+
+    def allow(self, client: str) -> bool:
+        now = monotonic()
+        requests = self.requests.setdefault(client, deque())
+        while requests and requests[0] <= now - self.period:
+            requests.popleft()
+        if len(requests) >= self.max_requests:
+            return False
+        requests.append(now)
+        return True
+
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Serves a login and a replay request of a client, then closes the connection"""
+    client = writer.get_extra_info('peername')[0]
+    try:
+        await asyncio.wait_for(serve_client(reader, writer, client), args.timeout)
+    except asyncio.TimeoutError:
+        log.info('Tiempo agotado', extra={'client': client})
+    except (asyncio.IncompleteReadError, ConnectionError) as e:
+        log.info('Conexión terminada por el cliente: %s', e, extra={'client': client})
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def serve_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, client: str):
+    log.info('Conexión de cliente', extra={'client': client})
+    data = await reader.readexactly(LOGIN_SIZE)
+    if data[0] != LOGIN_SIZE:
+        log.warning('El tamaño de los datos no es el esperado [%d] ignoramos al cliente', data[0], extra={'client': client})
+        return
+    if data[1] != LOGIN_TYPE:
+        log.warning('El tipo de mensaje no es el esperado [%d] ignoramos al cliente', data[1], extra={'client': client})
+        return
+    if data[2] not in grupos:
+        log.warning('El código de grupo no es el esperado [%d] respondemos al cliente B', data[2], extra={'client': client})
+        writer.write(fill_login_response('B'))
+        await writer.drain()
+        return
+    log.info('Solicitud de sesion grupo: %d usuario: %s', data[2], data[3:9], extra={'client': client})
+    writer.write(fill_login_response('A'))
+    await writer.drain()
+
+    data2 = await reader.readexactly(REPLAY_REQUEST_SIZE)
+    if data2[0] != REPLAY_REQUEST_SIZE:
+        log.warning('El tamaño de los datos no es el esperado [%d] ignoramos al cliente', data2[0], extra={'client': client})
+        return
+    if data2[1] != REPLAY_REQUEST_TYPE:
+        log.warning('El tipo de mensaje no es el esperado [%d] ignoramos al cliente', data2[1], extra={'client': client})
+        return
+    group = data2[2]
+    first_message = int.from_bytes(data2[3:7], 'big', signed=True)
+    quantity = int.from_bytes(data2[7:9], 'big', signed=True)
+    if group not in grupos:
+        status = REPLAY_INVALID_GROUP
+    elif first_message < 0:
+        status = REPLAY_INVALID_FIRST_MESSAGE
+    elif quantity < 0 or quantity > args.max_quantity:
+        status = REPLAY_INVALID_QUANTITY
+    elif not rate_limiter.allow(client):
+        status = REPLAY_LIMIT_EXCEEDED
+    else:
+        status = REPLAY_ACCEPTED
+    log.info('Solicitud de re-transmision, grupo: %d, primera secuencia: %d, cantidad: %d, respuesta: %s',
+             group, first_message, quantity, status, extra={'client': client})
+    if status != REPLAY_ACCEPTED:
+        writer.write(fill_replay_response(status, 0, 0, 0))
+        await writer.drain()
+        return
+    writer.write(fill_replay_response(status, group, first_message, quantity))
+
+    # Aquí enviamos los paquetes por lotes de --batch-size bytes, un envío por lote,
+    # esperando al cliente cuando su buffer de envío se llena.
+    sent = 0
+    if captures is None:
+        batches = iter_replay_packet_batches(first_message, quantity, args.batch_size)
+    else:
+        batches = captures.iter_packet_batches(group, first_message, quantity, args.batch_size)
+    for batch in batches:
+        writer.writelines(batch)
+        await writer.drain()
+        sent += len(batch)
+    log.info('Enviados %d paquetes', sent, extra={'client': client})
+
+
+async def main_loop():
+    """Waits for connections and returns replay requests"""
+    server = await asyncio.start_server(handle_client, args.host, args.port, backlog=args.backlog)
+    log.info('Escuchando en el puerto: %d', args.port, extra={'client': '-'})
+    async with server:
+        await server.serve_forever()
+
+
+def fill_login_response(response_status):
+    """Returns the correct response for a login"""
+    login_response = bytearray(HEADER_SIZE + LENGTH_SIZE + 2)
+    # HEADER
+    # Length
+    length = HEADER_SIZE + LENGTH_SIZE + 2
+    login_response[0:2] = length.to_bytes(2, 'big')
+    # Total Messages
+    login_response[2] = 1
+    # Market Data Group
+    login_response[3] = 18
+    # Session
+    login_response[4] = 2
+    # Sequence Number
+    sequence_number = 0
+    login_response[5:9] = sequence_number.to_bytes(4, 'big')
+    # Date-Time
+    login_response[9:17] = (int(time()) * 1000 + 123).to_bytes(8, 'big')
+
+    # LENGTH
+    # Length message
+    login_response[HEADER_SIZE:HEADER_SIZE + LENGTH_SIZE] = (int(2)).to_bytes(2, 'big')
+
+    # MESSAGE
+    login_response[HEADER_SIZE + LENGTH_SIZE + 0] = 38  # &
+    login_response[HEADER_SIZE + LENGTH_SIZE + 1] = str.encode(response_status, 'iso_8859_1')[0]
+    return login_response
+
+
+def fill_replay_response(replay_status, group, first_message, quantity):
+    """Returns a replay response"""
+    replay_response = bytearray(HEADER_SIZE + LENGTH_SIZE + 9)
+    # HEADER
+    # Length
+    length = HEADER_SIZE + LENGTH_SIZE + 9
+    replay_response[0:2] = length.to_bytes(2, 'big')
+    # Total Messages
+    replay_response[2] = 1
+    # Market Data Group
+    replay_response[3] = 18
+    # Session
+    replay_response[4] = 2
+    # Sequence Number
+    sequence_number = 0
+    replay_response[5:9] = sequence_number.to_bytes(4, 'big')
+    # Date-Time
+    replay_response[9:17] = (int(time()) * 1000 + 123).to_bytes(8, 'big')
+
+    # LENGTH
+    # Length message
+    replay_response[HEADER_SIZE:HEADER_SIZE + LENGTH_SIZE] = (int(2)).to_bytes(2, 'big')
+
+    # MESSAGE
+    replay_response[HEADER_SIZE + LENGTH_SIZE + 0] = 42  # *
+    replay_response[HEADER_SIZE + LENGTH_SIZE + 1] = group
+    first_message_array = first_message.to_bytes(4, 'big')
+    replay_response[HEADER_SIZE + LENGTH_SIZE + 2:HEADER_SIZE + LENGTH_SIZE + 6] = first_message_array
+    quantity_array = quantity.to_bytes(2, 'big')
+    replay_response[HEADER_SIZE + LENGTH_SIZE + 6:HEADER_SIZE + LENGTH_SIZE + 8] = quantity_array
+    replay_response[HEADER_SIZE + LENGTH_SIZE + 8] = str.encode(replay_status, 'iso_8859_1')[0]
+    return replay_response
+
+
+def fill_replay_packet(sequence):
+    f"""Returns the correct replay packet for the given {sequence}"""
+    replay_packet = bytearray(HEADER_SIZE + LENGTH_SIZE + 52)
+    # HEADER
+    # Length
+    length = HEADER_SIZE + LENGTH_SIZE + 52
+    replay_packet[0:2] = length.to_bytes(2, 'big')
+    # Total Messages
+    replay_packet[2] = 1
+    # Market Data Group
+    replay_packet[3] = 18
+    # Session
+    replay_packet[4] = 2
+    # Sequence Number
+    sequence_number = sequence
+    replay_packet[5:9] = sequence_number.to_bytes(4, 'big')
+    # Date-Time
+    replay_packet[9:17] = (int(time()) * 1000 + 123).to_bytes(8, 'big')
+
+    # LENGTH
+    # Length message
+    replay_packet[HEADER_SIZE:HEADER_SIZE + LENGTH_SIZE] = (int(52)).to_bytes(2, 'big')
+
+    # MESSAGE
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 0] = 80  # P Message type
+    # Instrument Number
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 1:HEADER_SIZE + LENGTH_SIZE + 5] = (int(12345)).to_bytes(4, 'big')
+    # Trade Time
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 5:HEADER_SIZE + LENGTH_SIZE + 13] = (int(time()) * 1000).to_bytes(8, 'big')
+    # Volume
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 13:HEADER_SIZE + LENGTH_SIZE + 17] = (int(200)).to_bytes(4, 'big')
+    # Price
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 17:HEADER_SIZE + LENGTH_SIZE + 25] = (int(1050000000)).to_bytes(8, 'big')
+    # Tipo de concertacion
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 25] = 67  # C
+    # Trade Number
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 26:HEADER_SIZE + LENGTH_SIZE + 30] = sequence_number.to_bytes(4, 'big')
+    # Price Setter
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 30] = 1
+    # Operation type
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 31] = 67  # C
+    # Amount
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 32:HEADER_SIZE + LENGTH_SIZE + 40] = (int(210000000000)).to_bytes(8, 'big')
+    # Buy
+    buy_str = 'GBM  '
+    buy_array = str.encode(buy_str, 'iso_8859_1')
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 40:HEADER_SIZE + LENGTH_SIZE + 45] = buy_array
+    # Sell
+    sell_str = 'HSBC '
+    sell_array = str.encode(sell_str, 'iso_8859_1')
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 45:HEADER_SIZE + LENGTH_SIZE + 50] = sell_array
+    # Settlement
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 50] = 50  # 2
+    # Auction indicator
+    replay_packet[HEADER_SIZE + LENGTH_SIZE + 50] = 32  # space
+    return replay_packet
+
+
+# Fabricated packets are copies of this one, only the sequence and times change.
+REPLAY_PACKET_TEMPLATE = bytes(fill_replay_packet(0))
+REPLAY_PACKET_SIZE = len(REPLAY_PACKET_TEMPLATE)
+# Sequence Number and Date-Time of the header
+REPLAY_PACKET_HEADER_STRUCT = struct.Struct('>iq')
+# Trade Time and Trade Number of the message
+REPLAY_PACKET_TRADE_TIME_STRUCT = struct.Struct('>q')
+REPLAY_PACKET_TRADE_NUMBER_STRUCT = struct.Struct('>i')
+
+
+def fill_replay_packets(first_sequence, quantity):
+    """Returns the replay packets of quantity sequences from first_sequence, one after the other in a single buffer"""
+    replay_packets = bytearray(REPLAY_PACKET_TEMPLATE) * quantity
+    date_time = int(time()) * 1000
+    offset = 0
+    for sequence in range(first_sequence, first_sequence + quantity):
+        REPLAY_PACKET_HEADER_STRUCT.pack_into(replay_packets, offset + 5, sequence, date_time + 123)
+        REPLAY_PACKET_TRADE_TIME_STRUCT.pack_into(replay_packets, offset + HEADER_SIZE + LENGTH_SIZE + 5, date_time)
+        REPLAY_PACKET_TRADE_NUMBER_STRUCT.pack_into(replay_packets, offset + HEADER_SIZE + LENGTH_SIZE + 26, sequence)
+        offset += REPLAY_PACKET_SIZE
+    return replay_packets
+
+
+def iter_replay_packet_batches(first_sequence, quantity, batch_size):
+    """Yields lists with the fabricated replay packets, views over buffers of up to batch_size bytes"""
+    per_batch = max(batch_size // REPLAY_PACKET_SIZE, 1)
+    for sequence in range(first_sequence, first_sequence + quantity, per_batch):
+        replay_packets = memoryview(fill_replay_packets(sequence, min(per_batch, first_sequence + quantity - sequence)))
+        yield [replay_packets[offset:offset + REPLAY_PACKET_SIZE]
+               for offset in range(0, len(replay_packets), REPLAY_PACKET_SIZE)]
+
+
+parser = argparse.ArgumentParser(description='Responds to BMV replay requests')
+parser.add_argument('pcap_filenames', metavar='file.pcap', nargs='*',
+                    help='Captures with the packets to replay. Without them, fabricated P messages are sent')
+parser.add_argument('--host', default='localhost', help='Address to listen on (default: localhost)')
+parser.add_argument('--port', type=int, default=10000, help='Port to listen on (default: 10000)')
+parser.add_argument('--backlog', type=int, default=512, help='Pending connections (default: 512)')
+parser.add_argument('--max-quantity', type=int, default=1000,
+                    help='Most messages a client can ask in a replay request (default: 1000)')
+parser.add_argument('--rate-limit', type=int, default=10,
+                    help='Replay requests a client address can do in every --rate-period (default: 10)')
+parser.add_argument('--rate-period', type=float, default=60.0, help='Seconds of the rate limit (default: 60)')
+parser.add_argument('--batch-size', type=int, default=1 << 16,
+                    help='Bytes of packets sent with each write to a client (default: %(default)s)')
+parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to serve a client (default: 30)')
+args = parser.parse_args()
+
+# Log records are formatted and written by a thread, not while sending packets.
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s client=%(client)s %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+log.setLevel(logging.INFO)
+log_listener.start()
+
+# Packets to replay, by secuencia
+captures = None
+grupos = (18,)
+if args.pcap_filenames:
+    captures = BmvReplayCaptures(args.pcap_filenames)
+    grupos = captures.grupos()
+    log.info('Cargados %d paquetes de los grupos %s', len(captures), grupos, extra={'client': '-'})
+rate_limiter = ClientRateLimiter(args.rate_limit, args.rate_period)
+
+try:
+    asyncio.run(main_loop())
+except KeyboardInterrupt:
+    pass
+finally:
+    log_listener.stop()
@@ -0,0 +1,73 @@
+'''
+Joining by key of json lines files with messages of grupo 18 and grupo 40, that share their keys.
+'''
+import json
+
+import pytest
+
+from bmv_utils.compare import (compare_bmv_joined_lines, compare_bmv_jsons_parallel, is_sorted_by_bmv_key,
+                               join_bmv_jsons, read_bmv_key)
+
+
+def make_messages(count):
+    '''Messages P of grupo 18 and catalogs cd of grupo 40 with the same keys, in capture order'''
+    messages = []
+    for secuencia in range(1, count + 1):
+        messages.append({'key': f'20221019-{secuencia}', 'tipoMensaje': 'P', 'numeroInstrumento': secuencia,
+                         'volumen': 100 * secuencia, 'precio': 1.5})
+        messages.append({'key': f'20221019-{secuencia}', 'tipoMensaje': 'cd', 'numeroInstrumento': 1000 + secuencia,
+                         'tipoValor': 'FE', 'clase': 'IPC'})
+    return messages
+
+
+def write_json_lines(path, messages):
+    with open(path, 'w') as output_file:
+        for message in messages:
+            output_file.write(json.dumps(message) + '\n')
+    return str(path)
+
+
+@pytest.fixture
+def expected_filename(tmp_path):
+    return write_json_lines(tmp_path / 'expected.json', make_messages(50))
+
+
+def test_read_bmv_key_has_the_grupo():
+    assert read_bmv_key('{"key": "20221019-7", "tipoMensaje": "P"}') == (18, '20221019-7')
+    assert read_bmv_key('{"key": "20221019-7", "tipoMensaje": "cd"}') == (40, '20221019-7')
+
+
+@pytest.mark.parametrize('join', ['hash', 'merge'])
+def test_reordered_grupos_are_equal(tmp_path, expected_filename, join):
+    messages = make_messages(50)
+    # Each grupo in its own block, sorted by (grupo_market_data, key).
+    actual_filename = write_json_lines(tmp_path / 'actual.json', messages[0::2] + messages[1::2])
+    assert is_sorted_by_bmv_key(actual_filename)
+    if join == 'merge':
+        expected_filename = write_json_lines(tmp_path / 'sorted.json', messages[0::2] + messages[1::2])
+    summary = compare_bmv_joined_lines(join_bmv_jsons(expected_filename, actual_filename, join))
+    assert summary['counts'] == {'equal': 100, 'different': 0, 'missing': 0, 'extra': 0}
+
+
+def test_missing_catalog_is_only_missing(tmp_path, expected_filename):
+    messages = make_messages(50)
+    del messages[21]  # The catalog cd of secuencia 11
+    actual_filename = write_json_lines(tmp_path / 'actual.json', list(reversed(messages)))
+    summary = compare_bmv_joined_lines(join_bmv_jsons(expected_filename, actual_filename))
+    assert summary['counts'] == {'equal': 99, 'different': 0, 'missing': 1, 'extra': 0}
+    assert summary['examples'] == [{'key': '20221019-11', 'grupo_market_data': 40, 'tipoMensaje': 'cd',
+                                    'category': 'missing', 'differences': []}]
+
+
+@pytest.mark.parametrize('sort', [False, True])
+def test_parallel_compare_pairs_by_grupo(tmp_path, sort):
+    messages = make_messages(50)
+    if sort:
+        messages = messages[0::2] + messages[1::2]
+    expected_filename = write_json_lines(tmp_path / 'expected.json', messages)
+    messages[40]['volumen'] = 1  # The P of secuencia 21
+    del messages[5]
+    actual_filename = write_json_lines(tmp_path / 'actual.json', messages)
+    summary = compare_bmv_jsons_parallel(expected_filename, actual_filename, 2, directory=str(tmp_path))
+    assert summary['counts'] == {'equal': 98, 'different': 1, 'missing': 1, 'extra': 0}
+    assert summary['by field'] == {'P': {'volumen': 1}}
@@ -0,0 +1,48 @@
+'''
+The receiver of the live feeds, with a socket that fails.
+'''
+import socket
+import threading
+import time
+
+from bmv_utils.feed import BmvFeedHandler
+
+
+class FailingSocket:
+    '''A UDP socket whose first recv_into fails like a network error'''
+
+    def __init__(self, udp_socket):
+        self.udp_socket = udp_socket
+        self.failed = False
+
+    def fileno(self):
+        return self.udp_socket.fileno()
+
+    def recv_into(self, buffer):
+        if not self.failed:
+            self.failed = True
+            raise ConnectionRefusedError('Connection refused')
+        return self.udp_socket.recv_into(buffer)
+
+
+def test_receive_counts_socket_errors_and_keeps_receiving():
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_socket.bind(('127.0.0.1', 0))
+    udp_socket.setblocking(False)
+    handler = BmvFeedHandler({'feed': ('127.0.0.1', udp_socket.getsockname()[1])}, slots=4, slot_size=64)
+    handler.sockets = [('feed', FailingSocket(udp_socket))]
+    receiver = threading.Thread(target=handler.receive, daemon=True)
+    receiver.start()
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            sender.sendto(b'packet', udp_socket.getsockname())
+        label, slot, size, received = handler.ready.get(timeout=5)
+    finally:
+        handler.stopped.set()
+        receiver.join()
+        udp_socket.close()
+    assert (label, size, bytes(handler.slots[slot][:size])) == ('feed', 6, b'packet')
+    snapshot = handler.stats['feed'].snapshot()
+    assert snapshot['errors'] == 1
+    assert snapshot['last error'] == 'Connection refused'
+    assert len(handler.free) == 3
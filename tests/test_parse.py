@@ -0,0 +1,63 @@
+'''
+Parsers registered at runtime, and the filters over their packets and messages.
+'''
+import struct
+
+import pytest
+
+import bmv_utils.parse
+from bmv_utils.parse import (BMV_HEADER_STRUCT, BMV_PARSERS, BMV_TIPOS_CON_INSTRUMENTO, make_bmv_filter,
+                             parse_bmv_udp_packet, register_bmv_parser)
+
+
+def parse_mensaje_z(to_parse, validate):
+    return {'tipoMensaje': 'Z', 'numeroInstrumento': struct.unpack_from('>i', to_parse, 1)[0]}
+
+
+def make_packet(instrumentos):
+    '''A packet of grupo 18 with a message Z for each numeroInstrumento'''
+    mensajes = b''.join(struct.pack('>hci', 5, b'Z', instrumento) for instrumento in instrumentos)
+    header = BMV_HEADER_STRUCT.pack(BMV_HEADER_STRUCT.size + len(mensajes), len(instrumentos), 18, 1, 100,
+                                    1666198895501)
+    return header + mensajes
+
+
+@pytest.fixture
+def register_z():
+    yield lambda con_instrumento: register_bmv_parser(18, 'Z', parse_mensaje_z, con_instrumento=con_instrumento)
+    BMV_PARSERS[18].pop(b'Z', None)
+    BMV_TIPOS_CON_INSTRUMENTO.discard(b'Z')
+
+
+def test_registered_with_instrumento_is_filtered_by_instrument(register_z):
+    register_z(True)
+    paquete = parse_bmv_udp_packet(make_packet([7, 8, 7]), bmv_filter=make_bmv_filter(instruments=[7]))
+    assert [mensaje['numeroInstrumento'] for mensaje in paquete['mensajes']] == [7, 7]
+
+
+def test_registered_without_instrumento_is_not_accepted_by_instrument(register_z):
+    register_z(False)
+    paquete = parse_bmv_udp_packet(make_packet([7, 8]), bmv_filter=make_bmv_filter(instruments=[7]))
+    assert paquete['mensajes'] == []
+    paquete = parse_bmv_udp_packet(make_packet([7, 8]), bmv_filter=make_bmv_filter(types=['Z']))
+    assert len(paquete['mensajes']) == 2
+
+
+def test_replacing_a_parser_keeps_its_instrumento():
+    parser = BMV_PARSERS[18][b'P']
+    register_bmv_parser(18, 'P', parser)
+    assert b'P' in BMV_TIPOS_CON_INSTRUMENTO
+
+
+def test_rejected_packet_returns_before_decoding(monkeypatch, register_z):
+    register_z(True)
+
+    def fail(*args):
+        raise AssertionError('A rejected packet must not be formatted nor decoded')
+
+    monkeypatch.setattr(bmv_utils.parse, 'format_bmv_key_date', fail)
+    monkeypatch.setattr(bmv_utils.parse, 'parse_by_message_type', fail)
+    paquete = parse_bmv_udp_packet(make_packet([7, 8]), bmv_filter=make_bmv_filter(first_sequence=200))
+    assert paquete['mensajes'] == []
+    assert 'timestamp' not in paquete
+    assert paquete['secuencia'] == 100